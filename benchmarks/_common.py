@@ -0,0 +1,99 @@
+"""
+Common helpers for the benchmarks
+
+The benchmarks that need a database connect to a running MongoDB server and use (then drop) a scratch database
+"""
+import argparse
+import random
+import time
+import typing
+import pymongo
+import pymongo.database
+
+import e7epd
+
+# Number of parts to benchmark with, if not given in the command line
+default_sizes = [10_000, 100_000]
+
+
+def get_arg_parser(description: str) -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--uri', help='The MongoDB server to connect to', default='mongodb://localhost:27017/')
+    parser.add_argument('--db', help='The scratch database name, which gets dropped', default='e7epd_benchmark')
+    parser.add_argument('--sizes', help='The number of parts to benchmark with', type=int, nargs='+', default=default_sizes)
+    parser.add_argument('--repeat', help='How many times to run each benchmark', type=int, default=5)
+    return parser
+
+
+def best_of(func: typing.Callable, repeat: int) -> float:
+    """ Runs a function a few times, returning the fastest run's time in seconds. For benchmarks without a database """
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def get_scratch_db(uri: str, db_name: str) -> pymongo.database.Database:
+    client = pymongo.MongoClient(uri)
+    client.drop_database(db_name)
+    return client[db_name]
+
+
+def make_resistor(i: int) -> dict:
+    """ Makes a somewhat realistic resistor document """
+    return {
+        'ipn': f"RES-{i:07d}",
+        'mfg_part_numb': f"RC0603FR-07{i % 1000}KL",
+        'manufacturer': random.choice(e7epd.spec.autofill_helpers_list['passive_manufacturers']),
+        'stock': random.randint(0, 5000),
+        'package': random.choice(e7epd.spec.autofill_helpers_list['passive_packages']),
+        'storage': f"Drawer {i % 50}",
+        'comments': "Thick film resistor, general purpose, used across a few older boards",
+        'datasheet': "https://www.example.com/datasheets/resistor.pdf",
+        'user': None,
+        'resistance': float(random.choice([10, 47, 100, 470, 1e3, 4.7e3, 10e3, 47e3, 100e3])),
+        'tolerance': 1.0,
+        'power': 0.1,
+    }
+
+
+def populate_resistors(db: e7epd.E7EPD, n: int):
+    """ Adds n resistors to the database """
+    r = db.add_new_parts(e7epd.spec.Resistor, (make_resistor(i) for i in range(n)), batch_size=5000)
+    if len(r.errors) != 0:
+        raise UserWarning(f"Unable to populate the database: {r.errors[0]}")
+
+
+def bytes_out(db: pymongo.database.Database) -> int:
+    """ Gets the number of bytes the server has sent out """
+    return db.command('serverStatus')['network']['bytesOut']
+
+
+def measure(db: pymongo.database.Database, func: typing.Callable, repeat: int) -> typing.Tuple[float, int]:
+    """
+    Runs a function multiple times
+
+    Returns: A tuple of the best latency in seconds, and the number of bytes the server sent per run
+    """
+    # The serverStatus reply itself gets counted, so measure it to remove it after
+    b0 = bytes_out(db)
+    overhead = bytes_out(db) - b0
+
+    best = float('inf')
+    sent = 0
+    for _ in range(repeat):
+        b0 = bytes_out(db)
+        t0 = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - t0)
+        sent = bytes_out(db) - b0 - overhead
+    return best, sent
+
+
+def print_results(title: str, results: typing.List[typing.Tuple[int, str, float, int]]):
+    print(title)
+    print(f"{'Parts':>8}  {'Method':<30} {'Latency (ms)':>12}  {'Sent (kB)':>10}")
+    for n, name, latency, sent in results:
+        print(f"{n:>8}  {name:<30} {latency*1000:>12.1f}  {sent/1000:>10.1f}")
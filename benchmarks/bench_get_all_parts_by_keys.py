@@ -0,0 +1,46 @@
+"""
+Benchmark for E7EPD.get_all_parts_by_keys, comparing getting every full document (how it used to work) against
+letting the database do the projection, or the distinct for unique values
+
+Run from the repository root with
+    python -m benchmarks.bench_get_all_parts_by_keys --uri mongodb://localhost:27017/
+"""
+import e7epd
+from benchmarks import _common
+
+
+def full_documents(db: e7epd.E7EPD, ret_key):
+    """ The previous implementation, which got all parts then only kept the asked keys """
+    ret = []
+    for d_i in db.get_parts(e7epd.spec.Resistor):
+        if type(ret_key) is list:
+            ret.append({i: d_i[i] for i in ret_key})
+        else:
+            ret.append(d_i[ret_key])
+    return ret
+
+
+def main():
+    args = _common.get_arg_parser(__doc__).parse_args()
+    results = []
+    for n in args.sizes:
+        mongo_db = _common.get_scratch_db(args.uri, args.db)
+        db = e7epd.E7EPD(mongo_db)
+        _common.populate_resistors(db, n)
+
+        to_run = [
+            ("ipn, full documents", lambda: full_documents(db, 'ipn')),
+            ("ipn, projection", lambda: db.get_all_parts_by_keys(e7epd.spec.Resistor, 'ipn')),
+            ("ipn, distinct", lambda: db.get_all_parts_by_keys(e7epd.spec.Resistor, 'ipn', unique=True)),
+            ("[ipn, type], full documents", lambda: full_documents(db, ['ipn', 'type'])),
+            ("[ipn, type], projection", lambda: db.get_all_parts_by_keys(e7epd.spec.Resistor, ['ipn', 'type'])),
+        ]
+        for name, func in to_run:
+            latency, sent = _common.measure(mongo_db, func, args.repeat)
+            results.append((n, name, latency, sent))
+        mongo_db.client.drop_database(args.db)
+    _common.print_results("get_all_parts_by_keys", results)
+
+
+if __name__ == '__main__':
+    main()
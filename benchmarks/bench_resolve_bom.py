@@ -0,0 +1,60 @@
+"""
+Benchmark for E7EPD.resolve_bom, comparing finding the parts of each BOM line one at a time with find_pcb_part
+(how it used to work) against resolving the whole BOM in at most two requests
+
+Run from the repository root with
+    python -m benchmarks.bench_resolve_bom --uri mongodb://localhost:27017/
+"""
+import random
+
+import e7epd
+from benchmarks import _common
+
+# Number of lines in the synthetic boards
+board_sizes = [50, 400]
+
+
+def make_board(n_parts: int, n_lines: int) -> dict:
+    """ Makes a board with half its lines for a specific IPN, and half for a generic resistor """
+    parts = []
+    for i in range(n_lines):
+        if i % 2 == 0:
+            part = {'ipn': f"RES-{random.randrange(n_parts):07d}"}
+        else:
+            resistor = _common.make_resistor(i)
+            part = {
+                'resistance': {'val': resistor['resistance'], 'op': '=='},
+                'package': {'val': resistor['package'], 'op': '=='},
+            }
+        parts.append({'type': 'resistor', 'part': part, 'qty': 1, 'designator': f"R{i}"})
+    return {'id': 'BENCH', 'rev': 'A', 'stock': 0, 'parts': parts}
+
+
+def per_line(db: e7epd.E7EPD, board: dict):
+    """ The previous implementation, with one request per BOM line """
+    return [db.find_pcb_part(line) for line in board['parts']]
+
+
+def main():
+    args = _common.get_arg_parser(__doc__).parse_args()
+    results = []
+    for n in args.sizes:
+        mongo_db = _common.get_scratch_db(args.uri, args.db)
+        db = e7epd.E7EPD(mongo_db)
+        _common.populate_resistors(db, n)
+
+        for n_lines in board_sizes:
+            board = make_board(n, n_lines)
+            to_run = [
+                (f"{n_lines} lines, per line", lambda: per_line(db, board)),
+                (f"{n_lines} lines, resolve_bom", lambda: db.resolve_bom(board)),
+            ]
+            for name, func in to_run:
+                latency, sent = _common.measure(mongo_db, func, args.repeat)
+                results.append((n, name, latency, sent))
+        mongo_db.client.drop_database(args.db)
+    _common.print_results("resolve_bom", results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Micro-benchmark for parsing and formatting engineering numbers, comparing EngNumber (how it used to work) against
+e7epd.units, with the caches cleared first (every value is new) and kept (values come up again, like in a parts list)
+
+This doesn't need a database. Run from the repository root with
+    python -m benchmarks.bench_units
+"""
+import argparse
+import random
+import typing
+
+from engineering_notation import EngNumber
+
+from e7epd import units
+from benchmarks import _common
+
+# E12 values, and the prefixes used for passives
+e12_values = [1.0, 1.2, 1.5, 1.8, 2.2, 2.7, 3.3, 3.9, 4.7, 5.6, 6.8, 8.2]
+text_prefixes = ['p', 'n', 'u', '', 'k', 'M']
+
+
+def make_texts(n: int, unique: bool) -> typing.List[str]:
+    """
+    Makes resistor and capacitor values as they would be in a CSV file, like `4.7kohm` or `100nF`, either mostly
+    repeating E12 values or all different
+    """
+    ret = []
+    for _ in range(n):
+        if unique:
+            v = round(random.uniform(1, 1000), 3)
+        else:
+            v = random.choice(e12_values) * random.choice([1, 10, 100])
+        unit = random.choice(['ohm', 'F', ''])
+        ret.append(f"{v:g}{random.choice(text_prefixes)}{unit}")
+    return ret
+
+
+def make_values(n: int, unique: bool) -> typing.List[float]:
+    """ Makes values as stored in the database, either mostly repeating E12 values or all different """
+    if unique:
+        return [random.uniform(1, 1000) * 10 ** random.randint(-12, 6) for _ in range(n)]
+    return [random.choice(e12_values) * 10 ** random.randint(-12, 6) for _ in range(n)]
+
+
+def parse_eng_number(texts: typing.List[str]) -> typing.List[float]:
+    """ The previous implementation, removing the unit by hand then going through EngNumber """
+    ret = []
+    for t in texts:
+        for end_unit in ['ohm', 'F', 'H', 'Ω']:
+            if t.endswith(end_unit):
+                t = t[:-len(end_unit)]
+                break
+        ret.append(float(EngNumber(t)))
+    return ret
+
+
+def parse_cold(texts: typing.List[str]) -> typing.List[float]:
+    units.parse.cache_clear()
+    return units.parse_many(texts)
+
+
+def format_cold(values: typing.List[float]) -> typing.List[str]:
+    units.format_eng.cache_clear()
+    return units.format_many(values)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', help='The number of values to parse and format', type=int, nargs='+',
+                        default=_common.default_sizes)
+    parser.add_argument('--repeat', help='How many times to run each benchmark', type=int, default=5)
+    args = parser.parse_args()
+
+    print("Engineering numbers")
+    print(f"{'Values':>8}  {'Method':<36} {'Latency (ms)':>12}  {'Per value (us)':>14}")
+    for n in args.sizes:
+        texts = make_texts(n, unique=False)
+        unique_texts = make_texts(n, unique=True)
+        repeated = make_values(n, unique=False)
+        unique = make_values(n, unique=True)
+        to_run = [
+            ("parse repeated, EngNumber", lambda: parse_eng_number(texts)),
+            ("parse repeated, units.parse_many", lambda: parse_cold(texts)),
+            ("parse unique, EngNumber", lambda: parse_eng_number(unique_texts)),
+            ("parse unique, units.parse_many", lambda: parse_cold(unique_texts)),
+            ("format repeated, EngNumber", lambda: [str(EngNumber(v)) for v in repeated]),
+            ("format repeated, units.format_many", lambda: format_cold(repeated)),
+            ("format unique, EngNumber", lambda: [str(EngNumber(v)) for v in unique]),
+            ("format unique, units.format_many", lambda: format_cold(unique)),
+        ]
+        for name, func in to_run:
+            latency = _common.best_of(func, args.repeat)
+            print(f"{n:>8}  {name:<36} {latency*1000:>12.1f}  {latency/n*1e6:>14.2f}")
+
+
+if __name__ == '__main__':
+    main()
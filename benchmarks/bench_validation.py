@@ -0,0 +1,58 @@
+"""
+Micro-benchmark for validating new parts, comparing walking the part spec for every part (how it used to work) against
+the precompiled SpecValidator, both one part at a time and with validate_many
+
+This doesn't need a database. Run from the repository root with
+    python -m benchmarks.bench_validation
+"""
+import argparse
+import typing
+
+import e7epd
+from benchmarks import _common
+
+
+def validate_by_walking_spec(part_class: e7epd.spec.PartSpec, new_part: dict):
+    """ The previous implementation, which walks the spec's items for every part """
+    for d in new_part:
+        if d not in part_class.items.keys():
+            raise e7epd.InputException(f"Given key of {d} is not part of the spec")
+        if new_part[d] is not None:
+            if type(new_part[d]) != part_class.items[d].input_type:
+                raise e7epd.InputException(f"Input value of {new_part[d]} for {d} is "
+                                           f"not of type {part_class.items[d].input_type}")
+    for d in part_class.items:
+        if part_class.items[d].required:
+            if d not in new_part:
+                raise e7epd.InputException(f"Required key of {d} is not found in the new part dict")
+
+
+def per_part(func: typing.Callable[[e7epd.spec.PartSpec, dict], None], parts: typing.List[dict]):
+    for p in parts:
+        func(e7epd.spec.Resistor, p)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', help='The number of parts to validate', type=int, nargs='+',
+                        default=_common.default_sizes)
+    parser.add_argument('--repeat', help='How many times to run each benchmark', type=int, default=5)
+    args = parser.parse_args()
+
+    validator = e7epd.SpecValidator.for_part(e7epd.spec.Resistor)
+    print("Validation")
+    print(f"{'Parts':>8}  {'Method':<30} {'Latency (ms)':>12}  {'Per part (us)':>13}")
+    for n in args.sizes:
+        parts = [_common.make_resistor(i) for i in range(n)]
+        to_run = [
+            ("walking the spec", lambda: per_part(validate_by_walking_spec, parts)),
+            ("SpecValidator.validate", lambda: per_part(lambda c, p: validator.validate(p), parts)),
+            ("SpecValidator.validate_many", lambda: validator.validate_many(parts)),
+        ]
+        for name, func in to_run:
+            latency = _common.best_of(func, args.repeat)
+            print(f"{n:>8}  {name:<30} {latency*1000:>12.1f}  {latency/n*1e6:>13.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,17 @@
 from e7epd.e7epd import E7EPD, E7EPDConfigTable
-from e7epd.e7epd import EmptyInDatabase, InputException, NegativeStock
+from e7epd.e7epd import EmptyInDatabase, InputException, NegativeStock, KitShortfall
 from e7epd.e7epd import SpecWithOperator, ComparisonOperators
+from e7epd.e7epd import compile_query, CompiledQuery, QueryExplanation
+from e7epd.e7epd import E7EPDIndexManager, IndexReport
+from e7epd.e7epd import BulkInsertResult, BulkRowError, SpecValidator
+from e7epd.e7epd import BuildableReport, BOMLineStock, KitPlan, KitLine
+from e7epd.e7epd import InventoryStats, InventoryGroupStats
+from e7epd.e7epd_async import AsyncE7EPD
+from e7epd.cache import PartCache
+from e7epd.lookup import IPNIndex, PartNumberIndex, SimilarPart
+from e7epd.backup import BackupManifest, BackupFile, BackupDelta, RestoreResult, RestoreCollectionResult
+from e7epd.exporter import ExportResult, ExportFile
+from e7epd.importer import ImportProfile, ImportProgress, ImportResult
 import e7epd.e707pd_spec as spec
 
 # Version of this backend
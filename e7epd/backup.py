@@ -0,0 +1,678 @@
+"""
+Backing up the database into an archive, which is a directory with one compressed file per collection and a manifest
+"""
+import collections
+import concurrent.futures
+import dataclasses
+import datetime
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import typing
+import zlib
+import bson
+import bson.codec_options
+import bson.json_util
+import bson.raw_bson
+import pymongo
+import pymongo.collection
+import pymongo.errors
+
+import e7epd.e7epd
+from e7epd.e7epd import InputException, BulkRowError, SpecValidator
+
+# zstd compression needs the optional zstandard package, otherwise gzip is used
+try:
+    import zstandard
+except ImportError as e:
+    zstd_available = e
+    """zstd_available is None if zstd compression is available, otherwise it will be the import exception"""
+else:
+    zstd_available = None
+
+# What can be raised when reading a corrupted file
+file_read_errors = (OSError, EOFError, zlib.error) + ((zstandard.ZstdError,) if zstd_available is None else ())
+
+# The collections that get backed up
+backup_collections = ('parts', 'pcbs', 'user', 'config', 'stock_events', 'stock_snapshots')
+# The file formats for each collection: newline-delimited canonical extended JSON, or concatenated BSON documents
+backup_formats = ('ndjson', 'bson')
+backup_compressions = ('zstd', 'gzip', None)
+compression_extensions = {'zstd': '.zst', 'gzip': '.gz', None: ''}
+
+manifest_file_name = 'manifest.json'
+manifest_version = 2
+
+# How many bytes of documents are gathered before being written out, which bounds the memory used per collection
+write_chunk_size = 1 << 20
+# How many documents the database sends at once
+read_batch_size = 1000
+# How long to wait for more changes from the change stream before considering an incremental backup caught up
+change_stream_wait_ms = 500
+
+# The file next to the manifest that keeps track of an interrupted restore
+checkpoint_file_name = 'restore_checkpoint.json'
+# Collections that are only restored when replacing the database, as merging them would mix two databases' settings
+replace_only_collections = ('config',)
+restore_modes = ('merge', 'replace')
+
+json_options = bson.json_util.CANONICAL_JSON_OPTIONS
+raw_codec_options = bson.codec_options.CodecOptions(document_class=bson.raw_bson.RawBSONDocument)
+
+
+@dataclasses.dataclass
+class BackupFile:
+    """ Dataclass for a backed up collection in the manifest """
+    collection: str
+    file: str                   # The file name, relative to the archive
+    count: int                  # The number of documents
+    sha256: str                 # The SHA-256 of the uncompressed file
+    size: int                   # The size of the uncompressed file in bytes
+
+
+@dataclasses.dataclass
+class BackupDelta:
+    """
+    Dataclass for an incremental backup in the manifest. Its file has one record per document changed since the
+    previous backup, either `{'op': 'upsert', 'coll': ..., 'doc': ...}` or `{'op': 'delete', 'coll': ..., '_id': ...}`
+    """
+    file: str
+    created: str                # When the incremental backup was taken, in ISO 8601 UTC
+    count: int                  # The number of changed or deleted documents
+    sha256: str
+    size: int
+
+
+@dataclasses.dataclass
+class BackupManifest:
+    """ Dataclass for an archive's manifest, describing what it has """
+    created: str                            # When the backup started, in ISO 8601 UTC
+    database_spec_rev: typing.Union[str, None]     # The database's spec revision at that time
+    format: str
+    compression: typing.Union[str, None]
+    collections: typing.Dict[str, BackupFile] = dataclasses.field(default_factory=dict)
+    # The incremental backups taken after the full one, oldest first
+    deltas: typing.List[BackupDelta] = dataclasses.field(default_factory=list)
+    # The change stream's resume token (as canonical extended JSON) after the latest backup, if the database is a
+    # replica set. The next incremental backup starts from there
+    resume_token: typing.Union[dict, None] = None
+    version: int = manifest_version
+
+    def to_dict(self) -> dict:
+        return dataclasses.asdict(self)
+
+    @classmethod
+    def from_dict(cls, d: dict) -> 'BackupManifest':
+        d = dict(d)
+        d['collections'] = {k: BackupFile(**v) for k, v in d['collections'].items()}
+        d['deltas'] = [BackupDelta(**v) for v in d.get('deltas', [])]
+        return cls(**d)
+
+
+@dataclasses.dataclass
+class RestoreCollectionResult:
+    """ Dataclass for the outcome of restoring a collection, or replaying an incremental backup """
+    inserted: int = 0           # For incremental backups, the documents inserted or replaced
+    skipped: int = 0            # Documents that were already in the database
+    deleted: int = 0            # For incremental backups, the documents deleted
+    errors: typing.List[BulkRowError] = dataclasses.field(default_factory=list)
+
+
+@dataclasses.dataclass
+class RestoreResult:
+    """ Dataclass for the outcome of a restore """
+    resumed: bool = False       # Whether this continued an interrupted restore
+    collections: typing.Dict[str, RestoreCollectionResult] = dataclasses.field(default_factory=dict)
+    # The outcome of replaying each incremental backup, by its file name
+    deltas: typing.Dict[str, RestoreCollectionResult] = dataclasses.field(default_factory=dict)
+
+
+def get_default_compression() -> str:
+    """ Returns zstd if the zstandard package is installed, otherwise gzip """
+    return 'zstd' if zstd_available is None else 'gzip'
+
+
+def get_file_name(collection: str, fmt: str, compression: typing.Union[str, None]) -> str:
+    return f"{collection}.{fmt}{compression_extensions[compression]}"
+
+
+def open_compressed(path: str, mode: str, compression: typing.Union[str, None]) -> typing.BinaryIO:
+    """
+    Opens a file to stream through a compressor or decompressor
+
+    Args:
+        path: The file to open
+        mode: Either 'rb' or 'wb'
+        compression: Either 'zstd', 'gzip' or None for no compression
+    """
+    if compression not in backup_compressions:
+        raise InputException(f"Unknown compression {compression}")
+    if compression == 'gzip':
+        return gzip.open(path, mode, compresslevel=6)
+    f = open(path, mode)
+    if compression is None:
+        return f
+    if zstd_available is not None:
+        f.close()
+        raise InputException(f"zstd compression is not available (due to \"{zstd_available}\")")
+    if mode == 'wb':
+        return zstandard.ZstdCompressor(level=3).stream_writer(f)
+    return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(f))
+
+
+def _encode_document(doc: typing.Mapping, fmt: str) -> bytes:
+    if fmt == 'bson':
+        if isinstance(doc, bson.raw_bson.RawBSONDocument):
+            return doc.raw
+        return bson.encode(doc)
+    return (bson.json_util.dumps(doc, json_options=json_options) + '\n').encode()
+
+
+def _write_documents(docs: typing.Iterable[typing.Mapping], file_path: str, fmt: str,
+                     compression: typing.Union[str, None]) -> typing.Tuple[int, str, int]:
+    """
+    Streams documents into a compressed file, only holding about `write_chunk_size` bytes in memory. The file is
+    written under a temporary name, and only renamed once complete. If writing fails, the temporary file is removed
+
+    Returns: The number of documents, and the SHA-256 and size of the uncompressed file
+    """
+    partial_path = file_path + '.partial'
+    sha = hashlib.sha256()
+    count = 0
+    size = 0
+    chunk = []
+    chunk_size = 0
+    try:
+        with open_compressed(partial_path, 'wb', compression) as f:
+            for doc in docs:
+                b = _encode_document(doc, fmt)
+                chunk.append(b)
+                chunk_size += len(b)
+                count += 1
+                if chunk_size >= write_chunk_size:
+                    b = b''.join(chunk)
+                    sha.update(b)
+                    f.write(b)
+                    size += len(b)
+                    chunk = []
+                    chunk_size = 0
+            b = b''.join(chunk)
+            sha.update(b)
+            f.write(b)
+            size += len(b)
+    except BaseException:
+        _remove_file(partial_path)
+        raise
+    os.replace(partial_path, file_path)
+    return count, sha.hexdigest(), size
+
+
+def _remove_file(path: str):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def _remove_dump(path: str, collections: typing.Iterable[str], fmt: str, compression: typing.Union[str, None],
+                 remove_dir: bool):
+    """ Removes the files of a backup that failed, and its directory if it was made for it and is now empty """
+    for c in collections:
+        file_path = os.path.join(path, get_file_name(c, fmt, compression))
+        _remove_file(file_path)
+        _remove_file(file_path + '.partial')
+    if remove_dir and len(os.listdir(path)) == 0:
+        os.rmdir(path)
+
+
+def _dump_collection(coll: pymongo.collection.Collection, path: str, fmt: str,
+                     compression: typing.Union[str, None]) -> BackupFile:
+    """ Streams a collection into a compressed file """
+    file_name = get_file_name(coll.name, fmt, compression)
+    if fmt == 'bson':
+        # The documents are written as they came from the database, without decoding them
+        cursor = coll.with_options(codec_options=raw_codec_options).find({}, batch_size=read_batch_size)
+    else:
+        cursor = coll.find({}, batch_size=read_batch_size)
+    with cursor:
+        count, sha256, size = _write_documents(cursor, os.path.join(path, file_name), fmt, compression)
+    return BackupFile(collection=coll.name, file=file_name, count=count, sha256=sha256, size=size)
+
+
+def _get_change_stream(db: 'e7epd.e7epd.E7EPD', collections: typing.Iterable[str], resume_after: dict = None):
+    """ Opens a change stream on the backed up collections, with the full document of each change """
+    return db.db.watch([{'$match': {'ns.coll': {'$in': list(collections)}}}], full_document='updateLookup',
+                       resume_after=resume_after, max_await_time_ms=change_stream_wait_ms)
+
+
+def _token_to_json(token: typing.Union[typing.Mapping, None]) -> typing.Union[dict, None]:
+    if token is None:
+        return None
+    return json.loads(bson.json_util.dumps(token, json_options=json_options))
+
+
+def _token_from_json(token: typing.Union[dict, None]) -> typing.Union[dict, None]:
+    if token is None:
+        return None
+    return bson.json_util.loads(json.dumps(token), json_options=json_options)
+
+
+def backup_database(db: 'e7epd.e7epd.E7EPD', path: str, fmt: str = 'ndjson', compression: str = 'auto',
+                    collections: typing.Iterable[str] = backup_collections, workers: int = 4) -> BackupManifest:
+    """
+    Backs up the database into an archive, see :meth:`E7EPD.backup_db`
+
+    Raises:
+        InputException: If the format or compression is unknown, or the path already has a backup
+    """
+    log = logging.getLogger('backup')
+    if fmt not in backup_formats:
+        raise InputException(f"Unknown backup format {fmt}")
+    if compression == 'auto':
+        compression = get_default_compression()
+    if compression not in backup_compressions:
+        raise InputException(f"Unknown compression {compression}")
+    made_dir = not os.path.isdir(path)
+    os.makedirs(path, exist_ok=True)
+    if os.path.exists(os.path.join(path, manifest_file_name)):
+        raise InputException(f"{path} already has a backup")
+
+    manifest = BackupManifest(created=datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                              database_spec_rev=db.config.get_db_version(), format=fmt, compression=compression)
+    log.info(f"Backing up the database to {path}")
+    collections = list(collections)
+    try:
+        if db.is_replica_set():
+            # Taken before dumping, so any change made during the dump is also in the next incremental backup
+            with _get_change_stream(db, collections) as stream:
+                manifest.resume_token = _token_to_json(stream.resume_token)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='backup') as pool:
+            futures = [pool.submit(_dump_collection, db.db[c], path, fmt, compression) for c in collections]
+            try:
+                for fut in concurrent.futures.as_completed(futures):
+                    b = fut.result()
+                    log.debug(f"Backed up {b.count} documents from {b.collection}")
+            except BaseException:
+                for fut in futures:
+                    fut.cancel()
+                raise
+    except BaseException:
+        # The pool has waited for the dumps that were running, so none of the files are being written anymore.
+        # Removing them lets a retry into the same path start clean
+        log.info(f"Removing the incomplete backup in {path}")
+        _remove_dump(path, collections, fmt, compression, made_dir)
+        raise
+    for c, fut in zip(collections, futures):
+        manifest.collections[c] = fut.result()
+    # The manifest is written last, so an archive without one is known to be incomplete
+    _write_json(os.path.join(path, manifest_file_name), manifest.to_dict())
+    return manifest
+
+
+def backup_database_incremental(db: 'e7epd.e7epd.E7EPD', path: str) -> typing.Union[BackupDelta, None]:
+    """
+    Adds an incremental backup to an archive, see :meth:`E7EPD.backup_db`
+
+    Raises:
+        InputException: If the archive has no change stream position, or the changes since it are no longer available
+    """
+    log = logging.getLogger('backup')
+    manifest = read_manifest(path)
+    if manifest.resume_token is None:
+        raise InputException(f"The backup in {path} has no change stream position, which needs the database to be a "
+                             f"replica set. Take a new full backup")
+    collections = list(manifest.collections)
+    # Changes made after this are left for the next backup, so a busy database doesn't keep this going
+    cutoff = db.db.command('ping').get('operationTime')
+    token = _token_from_json(manifest.resume_token)
+    # The last change of each document, by collection and _id
+    changes = {}        # type: typing.Dict[typing.Tuple[str, str], dict]
+    log.info(f"Backing up the changes since the last backup in {path}")
+    try:
+        with _get_change_stream(db, collections, resume_after=token) as stream:
+            while True:
+                change = stream.try_next()
+                if change is None:
+                    token = stream.resume_token
+                    break
+                if cutoff is not None and change['clusterTime'] > cutoff:
+                    break
+                op = change['operationType']
+                if op not in ('insert', 'update', 'replace', 'delete'):
+                    # Like a collection getting dropped or renamed, which can't be replayed from the documents
+                    raise InputException(f"A {op} of {change.get('ns')} happened since the last backup, take a new "
+                                         f"full backup")
+                coll = change['ns']['coll']
+                doc_id = change['documentKey']['_id']
+                doc = change.get('fullDocument')
+                if op == 'delete' or doc is None:
+                    # An updated document that's been deleted since has no full document
+                    record = {'op': 'delete', 'coll': coll, '_id': doc_id}
+                else:
+                    record = {'op': 'upsert', 'coll': coll, 'doc': doc}
+                changes[(coll, bson.json_util.dumps(doc_id))] = record
+                token = change['_id']
+    except pymongo.errors.OperationFailure as e:
+        # ChangeStreamHistoryLost
+        if e.code == 286:
+            raise InputException("The changes since the last backup are no longer in the oplog, take a new full "
+                                 "backup")
+        raise
+
+    delta = None
+    if len(changes) != 0:
+        file_name = get_file_name(f"delta_{len(manifest.deltas) + 1:04d}", manifest.format, manifest.compression)
+        created = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        count, sha256, size = _write_documents(changes.values(), os.path.join(path, file_name), manifest.format,
+                                               manifest.compression)
+        delta = BackupDelta(file=file_name, created=created, count=count, sha256=sha256, size=size)
+        manifest.deltas.append(delta)
+        log.debug(f"Backed up {count} changed documents")
+    manifest.resume_token = _token_to_json(token)
+    _write_json(os.path.join(path, manifest_file_name), manifest.to_dict())
+    return delta
+
+
+def _write_json(path: str, data: dict):
+    """ Writes a JSON file by replacing it, so it's never left half written """
+    with open(path + '.partial', 'w') as f:
+        json.dump(data, f, indent=4)
+    os.replace(path + '.partial', path)
+
+
+def read_manifest(path: str) -> BackupManifest:
+    """
+    Reads the manifest of an archive
+
+    Raises:
+        InputException: If the path is not a complete backup
+    """
+    manifest_path = os.path.join(path, manifest_file_name)
+    if not os.path.isfile(manifest_path):
+        raise InputException(f"{path} is not a complete backup, as it has no {manifest_file_name}")
+    with open(manifest_path) as f:
+        manifest = BackupManifest.from_dict(json.load(f))
+    if manifest.version > manifest_version:
+        raise InputException(f"The backup's manifest version {manifest.version} is newer than supported")
+    return manifest
+
+
+def verify_backup(path: str) -> BackupManifest:
+    """
+    Checks that every file of an archive matches the size and SHA-256 in its manifest
+
+    Returns: The archive's manifest
+
+    Raises:
+        InputException: If the archive is incomplete, or any file is missing or doesn't match
+    """
+    manifest = read_manifest(path)
+    for b in list(manifest.collections.values()) + manifest.deltas:
+        file_path = os.path.join(path, b.file)
+        if not os.path.isfile(file_path):
+            raise InputException(f"The backup file {b.file} is missing")
+        sha = hashlib.sha256()
+        size = 0
+        try:
+            with open_compressed(file_path, 'rb', manifest.compression) as f:
+                while True:
+                    chunk = f.read(write_chunk_size)
+                    if not chunk:
+                        break
+                    sha.update(chunk)
+                    size += len(chunk)
+        except file_read_errors as e:
+            raise InputException(f"The backup file {b.file} could not be read: {e}")
+        if size != b.size or sha.hexdigest() != b.sha256:
+            raise InputException(f"The backup file {b.file} does not match its checksum")
+    return manifest
+
+
+def _iter_raw_documents(f: typing.BinaryIO, fmt: str) -> typing.Iterator[bytes]:
+    """ Iterates through the undecoded documents of a backup file """
+    if fmt == 'ndjson':
+        for line in f:
+            if line.strip():
+                yield line
+        return
+    while True:
+        head = f.read(4)
+        if not head:
+            return
+        body = f.read(int.from_bytes(head, 'little') - 4)
+        yield head + body
+
+
+def _decode_document(raw: bytes, fmt: str) -> dict:
+    if fmt == 'ndjson':
+        return bson.json_util.loads(raw, json_options=json_options)
+    return bson.decode(raw)
+
+
+def _get_document_errors(db: 'e7epd.e7epd.E7EPD', collection: str, doc: dict) -> typing.List[str]:
+    """ Validates a document being restored against its spec, if its collection has one """
+    if collection == 'parts':
+        try:
+            part_class = db.get_part_spec_by_db_name(doc.get('type'))
+        except InputException as e:
+            return [str(e)]
+        return SpecValidator.for_part(part_class).get_errors({k: v for k, v in doc.items() if k not in ('_id', 'type')})
+    if collection == 'pcbs':
+        return SpecValidator.for_pcb().get_errors({k: v for k, v in doc.items() if k != '_id'})
+    return []
+
+
+def _insert_batch(coll: pymongo.collection.Collection,
+                  batch: typing.List[typing.Tuple[int, dict]]) -> typing.Tuple[int, int, typing.List[BulkRowError]]:
+    """
+    Inserts a batch of documents in any order, skipping over those already in the database
+
+    Returns: The number of inserted and skipped documents, and the errors of any other document
+    """
+    try:
+        r = coll.insert_many([d for _, d in batch], ordered=False)
+    except pymongo.errors.BulkWriteError as e:
+        skipped = 0
+        errors = []
+        for w in e.details['writeErrors']:
+            if w['code'] == 11000:
+                skipped += 1
+            else:
+                i, d = batch[w['index']]
+                errors.append(BulkRowError(i, d.get('ipn'), w['errmsg']))
+        return e.details['nInserted'], skipped, errors
+    return len(r.inserted_ids), 0, []
+
+
+class _Checkpoint:
+    """
+    Keeps track of how far a restore got, so it can be resumed. For each collection, `done` is the number of documents
+    from the start of its file that were all inserted (or skipped)
+    """
+    def __init__(self, path: str, manifest: BackupManifest, mode: str):
+        self.path = path
+        self.data = {'backup_created': manifest.created, 'mode': mode, 'collections': {}}
+
+    def load(self) -> bool:
+        """ Loads the checkpoint if one exists for the same backup and mode, returning whether it did """
+        if not os.path.isfile(self.path):
+            return False
+        with open(self.path) as f:
+            data = json.load(f)
+        if data.get('backup_created') != self.data['backup_created'] or data.get('mode') != self.data['mode']:
+            return False
+        self.data = data
+        return True
+
+    def get_done(self, collection: str) -> typing.Tuple[int, bool]:
+        """ Returns how many documents of a collection are done, and if the whole collection is """
+        c = self.data['collections'].get(collection, {})
+        return c.get('done', 0), c.get('complete', False)
+
+    def set_done(self, collection: str, done: int, complete: bool = False):
+        self.data['collections'][collection] = {'done': done, 'complete': complete}
+        _write_json(self.path, self.data)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _restore_collection(db: 'e7epd.e7epd.E7EPD', path: str, manifest: BackupManifest, b: BackupFile,
+                        checkpoint: _Checkpoint, pool: concurrent.futures.ThreadPoolExecutor,
+                        batch_size: int, max_in_flight: int) -> RestoreCollectionResult:
+    """
+    Streams a collection's backup file into the database. Documents are decoded and validated here, while the batches
+    are inserted by the pool with at most `max_in_flight` batches waiting
+    """
+    log = logging.getLogger('restore')
+    result = RestoreCollectionResult()
+    start, complete = checkpoint.get_done(b.collection)
+    if complete:
+        log.info(f"{b.collection} was already restored")
+        return result
+    coll = db.db[b.collection]
+    # The batches being inserted in the order they were sent, with the document number they end at
+    pending = collections.deque()       # type: typing.Deque[typing.Tuple[int, concurrent.futures.Future]]
+
+    def finish_oldest():
+        end, fut = pending.popleft()
+        inserted, skipped, errors = fut.result()
+        result.inserted += inserted
+        result.skipped += skipped
+        result.errors.extend(errors)
+        # Every batch before this one is done, so a resume can start after it
+        checkpoint.set_done(b.collection, end)
+
+    def send(batch, end):
+        pending.append((end, pool.submit(_insert_batch, coll, batch)))
+        while len(pending) >= max_in_flight or (len(pending) != 0 and pending[0][1].done()):
+            finish_oldest()
+
+    if start != 0:
+        log.info(f"Resuming the restore of {b.collection} after {start} documents")
+    n = 0
+    batch = []
+    with open_compressed(os.path.join(path, b.file), 'rb', manifest.compression) as f:
+        for n, raw in enumerate(_iter_raw_documents(f, manifest.format), start=1):
+            if n <= start:
+                continue
+            doc = _decode_document(raw, manifest.format)
+            errors = _get_document_errors(db, b.collection, doc)
+            if len(errors) != 0:
+                result.errors.append(BulkRowError(n - 1, doc.get('ipn'), errors[0]))
+                continue
+            batch.append((n - 1, doc))
+            if len(batch) >= batch_size:
+                send(batch, n)
+                batch = []
+    if len(batch) != 0:
+        send(batch, n)
+    while len(pending) != 0:
+        finish_oldest()
+    checkpoint.set_done(b.collection, max(n, start), complete=True)
+    return result
+
+
+def _apply_delta_batch(db: 'e7epd.e7epd.E7EPD', batch: typing.List[typing.Tuple[int, dict]],
+                       result: RestoreCollectionResult):
+    """ Applies a batch of an incremental backup's records, adding the outcome to `result` """
+    by_coll = {}        # type: typing.Dict[str, typing.List[typing.Tuple[int, dict, typing.Any]]]
+    for i, record in batch:
+        if record['op'] == 'upsert':
+            op = pymongo.ReplaceOne({'_id': record['doc']['_id']}, record['doc'], upsert=True)
+        else:
+            op = pymongo.DeleteOne({'_id': record['_id']})
+        by_coll.setdefault(record['coll'], []).append((i, record, op))
+    for coll, items in by_coll.items():
+        try:
+            r = db.db[coll].bulk_write([op for _, _, op in items], ordered=False)
+        except pymongo.errors.BulkWriteError as e:
+            result.inserted += e.details['nUpserted'] + e.details['nMatched']
+            result.deleted += e.details['nRemoved']
+            for w in e.details['writeErrors']:
+                if w['code'] == 11000:
+                    result.skipped += 1
+                else:
+                    i, record, _ = items[w['index']]
+                    result.errors.append(BulkRowError(i, record.get('doc', {}).get('ipn'), w['errmsg']))
+            continue
+        result.inserted += r.upserted_count + r.matched_count
+        result.deleted += r.deleted_count
+
+
+def _replay_delta(db: 'e7epd.e7epd.E7EPD', path: str, manifest: BackupManifest, d: BackupDelta, mode: str,
+                  checkpoint: _Checkpoint, batch_size: int) -> RestoreCollectionResult:
+    """
+    Replays an incremental backup, replacing (or inserting) each changed document and deleting each deleted one.
+    This can be done more than once with the same outcome, so a resumed restore redoes the last unsaved batch
+    """
+    result = RestoreCollectionResult()
+    key = f"delta {d.file}"
+    start, complete = checkpoint.get_done(key)
+    if complete:
+        return result
+    n = 0
+    batch = []
+    with open_compressed(os.path.join(path, d.file), 'rb', manifest.compression) as f:
+        for n, raw in enumerate(_iter_raw_documents(f, manifest.format), start=1):
+            if n <= start:
+                continue
+            record = _decode_document(raw, manifest.format)
+            if mode != 'replace' and record['coll'] in replace_only_collections:
+                continue
+            if record['op'] == 'upsert':
+                errors = _get_document_errors(db, record['coll'], record['doc'])
+                if len(errors) != 0:
+                    result.errors.append(BulkRowError(n - 1, record['doc'].get('ipn'), errors[0]))
+                    continue
+            batch.append((n - 1, record))
+            if len(batch) >= batch_size:
+                _apply_delta_batch(db, batch, result)
+                checkpoint.set_done(key, n)
+                batch = []
+    if len(batch) != 0:
+        _apply_delta_batch(db, batch, result)
+    checkpoint.set_done(key, max(n, start), complete=True)
+    return result
+
+
+def restore_database(db: 'e7epd.e7epd.E7EPD', path: str, mode: str = 'merge', batch_size: int = 1000,
+                     workers: int = 4) -> RestoreResult:
+    """
+    Restores the database from an archive, see :meth:`E7EPD.restore`
+
+    Raises:
+        InputException: If the mode is unknown, or the archive is incomplete or doesn't match its checksums
+    """
+    log = logging.getLogger('restore')
+    if mode not in restore_modes:
+        raise InputException(f"Unknown restore mode {mode}")
+    manifest = verify_backup(path)
+    checkpoint = _Checkpoint(os.path.join(path, checkpoint_file_name), manifest, mode)
+    result = RestoreResult(resumed=checkpoint.load())
+    to_restore = [b for b in manifest.collections.values()
+                  if mode == 'replace' or b.collection not in replace_only_collections]
+
+    if mode == 'replace' and not result.resumed:
+        log.info("Dropping the collections to replace")
+        for b in to_restore:
+            db.db.drop_collection(b.collection)
+        db.indexes.ensure_indexes()
+        db.install_validators()
+        # Saved before inserting anything, so a resume doesn't drop the collections again
+        if len(to_restore) != 0:
+            checkpoint.set_done(to_restore[0].collection, 0)
+
+    log.info(f"Restoring the database from {path}")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='restore') as pool:
+        for b in to_restore:
+            result.collections[b.collection] = _restore_collection(db, path, manifest, b, checkpoint, pool,
+                                                                   batch_size, max_in_flight=workers * 2)
+    # The incremental backups are replayed in order, after the full backup
+    for d in manifest.deltas:
+        log.info(f"Replaying the incremental backup {d.file}")
+        result.deltas[d.file] = _replay_delta(db, path, manifest, d, mode, checkpoint, batch_size)
+    checkpoint.remove()
+    return result
@@ -0,0 +1,187 @@
+"""
+An optional in-process cache for parts, so repeated lookups don't have to go back to the database
+"""
+import collections
+import copy
+import logging
+import threading
+import time
+import typing
+import pymongo.collection
+import pymongo.errors
+
+
+class PartCache:
+    """
+    A bounded least-recently-used cache of parts, keyed either by IPN or by query.
+
+    If a change stream is started (which requires the database to be a replica set), entries are invalidated as soon
+    as any part changes in the database. Otherwise, entries expire after `ttl` seconds. Changes done through the same
+    :class:`E7EPD` object always invalidate the cache right away.
+
+    Attributes:
+        hits (int): How many lookups were found in the cache
+        misses (int): How many lookups were not found in the cache, or had expired
+        evictions (int): How many entries were removed to make space for new ones
+        invalidations (int): How many times the cache got invalidated due to a part change
+    """
+    def __init__(self, max_size: int = 1024, ttl: float = 30):
+        """
+        Args:
+            max_size: The maximum number of entries to keep
+            ttl: How many seconds an entry is valid for, if there isn't a change stream
+        """
+        self.log = logging.getLogger('PartCache')
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self._lock = threading.RLock()
+        self._entries = collections.OrderedDict()   # type: typing.OrderedDict[tuple, typing.Tuple[float, typing.Any]]
+        self._query_keys = set()
+        # The Mongo _id to IPN, as change stream events for deleted parts only have the _id
+        self._id_to_ipn = {}
+        # Incremented on each invalidation, so a value read from the database before a change isn't cached after it
+        self.generation = 0
+
+        self._change_stream_thread = None       # type: typing.Union[threading.Thread, None]
+        self._stop_change_stream = threading.Event()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def uses_change_stream(self) -> bool:
+        """ Whether the entries are invalidated by a change stream instead of expiring """
+        return self._change_stream_thread is not None and self._change_stream_thread.is_alive()
+
+    def get(self, key: tuple) -> typing.Tuple[bool, typing.Any]:
+        """
+        Gets an entry from the cache
+
+        Returns: A tuple of whether the entry was found, and a copy of the entry's value
+        """
+        with self._lock:
+            e = self._entries.get(key)
+            if e is not None and not self.uses_change_stream and time.monotonic() - e[0] > self.ttl:
+                self._remove(key)
+                e = None
+            if e is None:
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, copy.deepcopy(e[1])
+
+    def put(self, key: tuple, value: typing.Any, generation: int):
+        """
+        Adds an entry to the cache
+
+        Args:
+            key: The entry's key. Keys starting with 'ipn' are for a single part, and with 'query' for anything else
+            value: The value to cache, which gets copied
+            generation: The cache's `generation` from before the value was read from the database. If the cache got
+                        invalidated since, the value is not cached as it might be out of date
+        """
+        with self._lock:
+            if generation != self.generation:
+                return
+            if key[0] == 'query':
+                self._query_keys.add(key)
+            elif value is not None and '_id' in value:
+                self._id_to_ipn[value['_id']] = key[1]
+            self._entries[key] = (time.monotonic(), copy.deepcopy(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key: tuple):
+        _, value = self._entries.pop(key)
+        if key[0] == 'query':
+            self._query_keys.discard(key)
+        elif value is not None and '_id' in value:
+            self._id_to_ipn.pop(value['_id'], None)
+
+    def invalidate_part(self, ipn: str = None, doc_id: typing.Any = None):
+        """
+        Invalidates a part, along with all cached queries as any of them could include that part
+
+        Args:
+            ipn: The part's IPN, if known
+            doc_id: The part's Mongo _id, if known
+        """
+        with self._lock:
+            self.generation += 1
+            self.invalidations += 1
+            if ipn is None:
+                ipn = self._id_to_ipn.get(doc_id)
+            if ipn is not None and ('ipn', ipn) in self._entries:
+                self._remove(('ipn', ipn))
+            for k in list(self._query_keys):
+                self._remove(k)
+
+    def clear(self):
+        """ Removes all entries """
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._query_keys.clear()
+            self._id_to_ipn.clear()
+
+    def stats(self) -> dict:
+        """ Returns the cache's counters, along with its size """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'size': len(self._entries),
+                'uses_change_stream': self.uses_change_stream,
+            }
+
+    def start_change_stream(self, coll: pymongo.collection.Collection):
+        """
+        Starts watching the parts collection in a background thread, invalidating any part that changes.
+        The database must be a replica set for this
+
+        Args:
+            coll: The parts collection
+        """
+        if self.uses_change_stream:
+            return
+        stream = coll.watch(max_await_time_ms=1000)
+        self._stop_change_stream.clear()
+        self._change_stream_thread = threading.Thread(target=self._watch, args=(stream,),
+                                                      name='PartCacheChangeStream', daemon=True)
+        self._change_stream_thread.start()
+        # Anything cached before now could have been changed without an event
+        self.clear()
+
+    def _watch(self, stream):
+        try:
+            while not self._stop_change_stream.is_set() and stream.alive:
+                change = stream.try_next()
+                if change is None:
+                    continue
+                if 'documentKey' in change:
+                    ipn = (change.get('fullDocument') or {}).get('ipn')
+                    self.invalidate_part(ipn, change['documentKey']['_id'])
+                else:
+                    # Events like the collection getting dropped
+                    self.clear()
+        except pymongo.errors.PyMongoError:
+            self.log.exception("The change stream failed, falling back to expiring entries")
+        finally:
+            stream.close()
+            # Entries could have been changed while the stream was down
+            self.clear()
+
+    def close(self):
+        """ Stops the change stream, if running """
+        self._stop_change_stream.set()
+        if self._change_stream_thread is not None:
+            self._change_stream_thread.join()
+            self._change_stream_thread = None
@@ -16,14 +16,14 @@ import rich.text
 from rich.prompt import Prompt
 from rich.logging import RichHandler
 import rich.table
-import decimal
-from engineering_notation import EngNumber
 import questionary
 import prompt_toolkit
+import prompt_toolkit.completion
 import prompt_toolkit.formatted_text
 from prompt_toolkit.formatted_text import to_formatted_text, HTML
 import os
 import sys
+import time
 import typing
 import json
 import pymongo
@@ -37,6 +37,7 @@ import urllib.parse
 from prompt_toolkit.formatted_text import FormattedText
 # Local Modules Import
 import e7epd
+import e7epd.units
 from e7epd.e707pd_spec import ShowAsEnum
 import e7epd.label_making
 
@@ -80,6 +81,11 @@ class CLIConfig:
     class DatabaseDeprecatedException(Exception):
         pass
 
+    # The Mongo clients by their connection config, shared between all instances of this class
+    _client_registry = {}       # type: typing.Dict[str, pymongo.MongoClient]
+    # The keys of the clients whose server has been pinged
+    _checked_clients = set()    # type: typing.Set[str]
+
     def __init__(self):
         self.log = logging.getLogger('CLIConfig')
         if not pkg_resources.resource_isdir(__name__, 'data'):
@@ -116,35 +122,79 @@ class CLIConfig:
 
         return self.get_database_client(db_conf)
 
-    def get_database_client(self, db_conf: dict) -> pymongo.database.Database:
+    def get_database_client(self, db_conf: dict, check_connection: bool = True) -> pymongo.database.Database:
         """
         This function just returns the client, without any of the config checking.
 
+        Clients are kept in a registry keyed by the connection config, so getting the same database again reuses the
+        client and its connection pool. The server is only pinged the first time a client is used.
+
         Args:
             db_conf: The database config dictionary
+            check_connection: Whether to ping the server if it hasn't been yet for this client
         """
         if db_conf['type'] in ['local', 'mysql_server', 'postgress_server']:
             raise self.DatabaseDeprecatedException("Not supported, deprecated in 0.7.0", db_conf)
         elif db_conf['type'] == 'mongodb':
-            # todo: enable socket connection
-            ssl_on = db_conf['ssl']
-            if db_conf['auth']:
-                conn_str = f"mongodb://{urllib.parse.quote(db_conf['username'])}:{urllib.parse.quote(db_conf['password'])}@{db_conf['db_host']}:27017/?authSource={db_conf['auth_db']}"
-            else:
-                conn_str = f"mongodb://{db_conf['db_host']}:27017/"
-            conn = pymongo.MongoClient(conn_str, serverSelectionTimeoutMS=1000*2, tls=ssl_on)
+            key = json.dumps(db_conf, sort_keys=True)
+            if key not in self._client_registry:
+                self._client_registry[key] = pymongo.MongoClient(self._get_mongo_uri(db_conf),
+                                                                 **self._get_mongo_kwargs(db_conf))
+            conn = self._client_registry[key]
             db = conn[db_conf['auth_db']]
-            try:
-                # The ping command is cheap and does not require auth.
-                conn.admin.command('ping')
-            except pymongo.errors.ConnectionFailure:
-                self.log.exception("ConnectionFailure going to database")
-                raise self.DatabaseConnectionException()
-            except pymongo.errors.OperationFailure:
-                self.log.exception("OperationFailure going to database")
-                raise self.DatabaseConnectionException()
+            if check_connection and key not in self._checked_clients:
+                try:
+                    # The ping command is cheap and does not require auth.
+                    conn.admin.command('ping')
+                except pymongo.errors.ConnectionFailure:
+                    self.log.exception("ConnectionFailure going to database")
+                    raise self.DatabaseConnectionException()
+                except pymongo.errors.OperationFailure:
+                    self.log.exception("OperationFailure going to database")
+                    raise self.DatabaseConnectionException()
+                self._checked_clients.add(key)
             return db
 
+    @staticmethod
+    def _get_mongo_uri(db_conf: dict) -> str:
+        """
+        Gets the connection string for a Mongo database config. A stored URI (for example for a replica set or an
+        SRV record) is used as is, otherwise it's made from either the Unix socket path or the host and port
+        """
+        if db_conf.get('uri'):
+            return db_conf['uri']
+        if db_conf.get('socket_path'):
+            # The socket path must be percent-encoded, including its slashes
+            return f"mongodb://{urllib.parse.quote(db_conf['socket_path'], safe='')}/"
+        return f"mongodb://{db_conf['db_host']}:{db_conf.get('port', 27017)}/"
+
+    @staticmethod
+    def _get_mongo_kwargs(db_conf: dict) -> dict:
+        """ Gets the keyword arguments to create a `MongoClient` with for a Mongo database config """
+        kwargs = {'serverSelectionTimeoutMS': 1000*2}
+        # TLS can't be used over a Unix socket, and for an URI it's part of the URI
+        if db_conf.get('ssl') and not db_conf.get('socket_path') and not db_conf.get('uri'):
+            kwargs['tls'] = True
+        if db_conf.get('auth'):
+            kwargs['username'] = db_conf['username']
+            kwargs['password'] = db_conf['password']
+            kwargs['authSource'] = db_conf['auth_db']
+        if db_conf.get('compressors'):
+            kwargs['compressors'] = db_conf['compressors']
+        if db_conf.get('read_preference'):
+            kwargs['readPreference'] = db_conf['read_preference']
+        if db_conf.get('replica_set'):
+            kwargs['replicaSet'] = db_conf['replica_set']
+        return kwargs
+
+    @classmethod
+    def close_clients(cls):
+        """ Closes all clients in the registry """
+        for conn in cls._client_registry.values():
+            conn.close()
+        cls._client_registry.clear()
+        cls._checked_clients.clear()
+
     @CLIConfig_config_db_list_checker
     def get_database_connection_info(self, database_name: str = None) -> dict:
         return self.config.db_list[database_name]
@@ -168,7 +218,9 @@ class CLIConfig:
     def save_database_as_postgress(self, database_name: str, username: str, password: str, db_name: str, host: str):
         raise DeprecationWarning("Removed in 0.7.0")
 
-    def save_database_as_mongo(self, database_name: str, username: str, password: str, host: str, auth_db: str, authenticated: bool = False, ssl: bool = False):
+    def save_database_as_mongo(self, database_name: str, username: str, password: str, host: str, auth_db: str, authenticated: bool = False, ssl: bool = False,
+                               port: int = 27017, socket_path: str = None, uri: str = None, compressors: str = None,
+                               read_preference: str = None, replica_set: str = None):
         """
         Saves a database info as a Mongo
         Args:
@@ -178,12 +230,25 @@ class CLIConfig:
             host: The db host
             authenticated: Whether the server needs authentication or not
             ssl: Whether the connection will have ssl/tls enabled
+            port: The db port
+            socket_path: The path to the server's Unix socket, used instead of the host and port if given
+            uri: A full connection string, like for a replica set or a `mongodb+srv://` URI, used instead of the
+                 host and port if given
+            compressors: A comma separated list of wire compressors to use, like `zstd,snappy,zlib`
+            read_preference: The read preference, like `primaryPreferred` or `nearest`
+            replica_set: The name of the replica set
         """
         self._save_database_generic(database_name, username, password, host)
         self.config.db_list[database_name]['type'] = 'mongodb'
         self.config.db_list[database_name]['auth'] = authenticated
         self.config.db_list[database_name]['auth_db'] = auth_db
         self.config.db_list[database_name]['ssl'] = ssl
+        self.config.db_list[database_name]['port'] = port
+        self.config.db_list[database_name]['socket_path'] = socket_path
+        self.config.db_list[database_name]['uri'] = uri
+        self.config.db_list[database_name]['compressors'] = compressors
+        self.config.db_list[database_name]['read_preference'] = read_preference
+        self.config.db_list[database_name]['replica_set'] = replica_set
         self.save()
 
     def _save_database_generic(self, database_name: str, username: str, password: str, host: str):
@@ -201,8 +266,23 @@ class CLIConfig:
         self.save()
 
 
+class IPNCompleter(prompt_toolkit.completion.Completer):
+    """ Completes IPNs from the database's IPN index, first by prefix then anywhere in the IPN """
+    def __init__(self, ipn_index: e7epd.IPNIndex, part_type: e7epd.spec.PartSpec = None, limit: int = 50):
+        self.ipn_index = ipn_index
+        self.part_type = part_type
+        self.limit = limit
+
+    def get_completions(self, document, complete_event):
+        text = document.text_before_cursor
+        for ipn in self.ipn_index.search(text.strip(), self.limit, self.part_type):
+            yield prompt_toolkit.completion.Completion(ipn, start_position=-len(text))
+
+
 class CLI:
     cli_revision = e7epd.__version__
+    # How many parts to print at once
+    parts_page_size = 50
 
     class _HelperFunctionExitError(Exception):
         def __init__(self, data=None):
@@ -216,8 +296,13 @@ class CLI:
     #         super().__init__()
 
     def __init__(self, config: CLIConfig, database_connection: pymongo.database.Database):
-        self.db = e7epd.E7EPD(database_connection)
+        self.db = e7epd.E7EPD(database_connection, cache=e7epd.PartCache())
         self.conf = config
+        if len(self.db.index_report.built) != 0:
+            console.print(f"Built the database indexes {', '.join(self.db.index_report.built)}")
+        if len(self.db.index_report.failed) != 0:
+            console.print(f"[red]Unable to build the database indexes {', '.join(self.db.index_report.failed)}. "
+                          f"Check them with --check-indexes[/]")
 
         self.printer = None
         if e7epd.label_making.direct_printing_failed is None:
@@ -237,22 +322,27 @@ class CLI:
         warnings.warn("This function is not needed as spec_list is a dict where the key is what's stored in the database", DeprecationWarning)
         return spec_list[db_name]
 
-    def _ask_ipn(self, existing_ipn_list: list = None, must_already_exist: bool = None) -> str:
+    @staticmethod
+    def _get_validation_error(e: pymongo.errors.WriteError) -> str:
+        """ Gets the message for a write the database's validator refused (error code 121) """
+        details = e.details or {}
+        return f"The database's validator refused it: {details.get('errInfo', details.get('errmsg', e))}"
+
+    def _ask_ipn(self, part_type: e7epd.spec.PartSpec = None, must_already_exist: bool = None) -> str:
         """
-        Asks for the IPN. This function handles type hinting with a given list, checking if the ipn
+        Asks for the IPN. This function handles type hinting with the database's IPN index, checking if the ipn
         is a Digikey barcode scan, and raises an error if the entered part number is already in the database or not.
 
         Args:
-            existing_ipn_list: A list of current manufacturer part numbers to typehint
-            must_already_exist: If a given part number must exist in the `existing_mfr_list` or must not exist
+            part_type: If given, only hint IPNs of this part type, and an existing IPN must be of this type
+            must_already_exist: If a given part number must exist in the database or must not exist
 
         Returns: The entered manufacturer part number
         """
-        # Replace default argument
-        if existing_ipn_list is None:
-            existing_ipn_list = []
-        if len(existing_ipn_list) != 0:
-            ipn_entered = questionary.autocomplete("Enter the IPN (or scan a Digikey barcode): ", choices=existing_ipn_list).ask()
+        ipn_index = self.db.get_ipn_index()
+        if len(ipn_index) != 0:
+            ipn_entered = questionary.autocomplete("Enter the IPN (or scan a Digikey barcode): ", choices=[],
+                                                   completer=IPNCompleter(ipn_index, part_type)).ask()
         else:
             ipn_entered = questionary.text("Enter the IPN (or scan a Digikey barcode): ").ask()
         if ipn_entered == '' or ipn_entered is None:
@@ -262,11 +352,12 @@ class CLI:
         ipn_entered = ipn_entered.strip().upper()
 
         if must_already_exist is True:
-            if ipn_entered not in existing_ipn_list:
+            if ipn_entered not in ipn_index or \
+                    (part_type is not None and ipn_index.get_type(ipn_entered) != part_type.db_type_name):
                 console.print("[red]Part must already exist in the database[/]")
                 raise self._HelperFunctionExitError(ipn_entered)
         elif must_already_exist is False:
-            if ipn_entered in existing_ipn_list:
+            if ipn_entered in ipn_index:
                 console.print("[red]Part must not already exist in the database, which it does![/]")
                 raise self._HelperFunctionExitError(ipn_entered)
         return ipn_entered
@@ -294,7 +385,7 @@ class CLI:
         Called when wanting to input parts for a PCB
         """
         all_parts_dict = []
-        all_ipn_parts = self.db.get_all_parts_by_keys(None, ret_key=['ipn', 'type'])
+        ipn_index = self.db.get_ipn_index()
         while 1:
             new_part = {'part': {}}
             # Ask for the part itself, what it is and get the type
@@ -306,12 +397,12 @@ class CLI:
                 break
             elif specific_part == "Specific":
                 try:
-                    ipn = self._ask_ipn([i['ipn'] for i in all_ipn_parts], True)
+                    ipn = self._ask_ipn(None, True)
                 except self._HelperFunctionExitError:
                     console.print("[red]IPN must not exist in database[/]")
                     continue
                 new_part['part']['ipn'] = ipn
-                new_part['type'] = [i['type'] for i in all_ipn_parts if i['ipn'] == ipn][0]
+                new_part['type'] = ipn_index.get_type(ipn)
             elif specific_part == "Generic":
                 try:
                     part_type = self.choose_component()
@@ -358,26 +449,41 @@ class CLI:
         ta = rich.table.Table(title=title)
         for spec_db_name in part_type.table_display_order:
             ta.add_column(part_type.items[spec_db_name].showcase_name)
-        for part in parts_list:
-            row = []
-            for spec_db_name in part_type.table_display_order:
-                to_display = part[spec_db_name]
-                display_as = part_type.items[spec_db_name].shows_as
-                if to_display is not None:
-                    if display_as == ShowAsEnum.engineering:
-                        to_display = str(EngNumber(to_display))
-                    elif display_as == ShowAsEnum.precentage:
-                        to_display = str(to_display) + "%"
-                    else:
-                        to_display = str(to_display)
-                row.append(to_display)
+        # Format a column at a time, so each column's formatting is only looked up once
+        columns = []
+        for spec_db_name in part_type.table_display_order:
+            values = [part[spec_db_name] for part in parts_list]
+            display_as = part_type.items[spec_db_name].shows_as
+            if display_as == ShowAsEnum.engineering:
+                columns.append(e7epd.units.format_many(values))
+            elif display_as == ShowAsEnum.precentage:
+                columns.append([None if v is None else str(v) + "%" for v in values])
+            else:
+                columns.append([None if v is None else str(v) for v in values])
+        for row in zip(*columns):
             ta.add_row(*row)
         console.print(ta)
 
+    def print_parts_pages(self, part_type: e7epd.spec.PartSpec, title: str,
+                          to_filter: typing.List[e7epd.SpecWithOperator] = None):
+        """
+        Prints parts one page at a time, asking before getting the next page
+
+        Returns: The number of printed parts
+        """
+        n_printed = 0
+        for page in self.db.iter_pages(part_type, self.parts_page_size, to_filter):
+            self.print_parts_list(part_type, page, title=title)
+            n_printed += len(page)
+            if len(page) < self.parts_page_size:
+                break
+            if questionary.confirm("Show the next page?", default=True, auto_enter=True).ask() is not True:
+                break
+        return n_printed
+
     def print_all_parts(self, part_type: e7epd.spec.PartSpec):
         """ Prints all parts in the database per given type """
-        parts_list = self.db.get_parts(part_type)
-        self.print_parts_list(part_type, parts_list, title="All parts in %s" % part_type.showcase_name)
+        self.print_parts_pages(part_type, title="All parts in %s" % part_type.showcase_name)
 
     def print_filtered_parts(self, part_type: e7epd.spec.PartSpec):
         """
@@ -392,11 +498,12 @@ class CLI:
         if len(specs_selected) == 0:
             console.print("[red]Must choose something[/]")
             return
+        console.print("Text is matched exactly. End it with * to match by the start, or start it with * to match anywhere")
         search_filter = []
         for s in specs_selected:
             if s == 'ipn':
                 try:
-                    inp = self._ask_ipn(self.db.get_all_parts_by_keys(part_type, 'ipn'))
+                    inp = self._ask_ipn(part_type)
                 except self._HelperFunctionExitError:
                     console.print("Canceled part lookup")
                     return
@@ -411,11 +518,12 @@ class CLI:
             print(s, inp, op)
             search_filter.append(e7epd.SpecWithOperator(key=s, val=inp, operator=op))
         try:
-            parts_list = self.db.get_parts(part_type, search_filter)
-        except e7epd.EmptyInDatabase:
-            console.print("[red]No filtered parts in the database[/]")
+            n_printed = self.print_parts_pages(part_type, "All parts in %s" % part_type.showcase_name, search_filter)
+        except e7epd.InputException as e:
+            console.print(f"[red]Invalid search: {e}[/]")
             return
-        self.print_parts_list(part_type, parts_list, title="All parts in %s" % part_type.showcase_name)
+        if n_printed == 0:
+            console.print("[red]No filtered parts in the database[/]")
 
     def print_parts(self, part_type: e7epd.spec.PartSpec = None):
         if part_type is None:
@@ -473,13 +581,20 @@ class CLI:
                         op = re.findall(r'\>=|\>|\<=|\<', val)[0]
                         op = e7epd.ComparisonOperators(op)
                         val = re.sub(r'\>=|\>|\<=|\<', "", val)
-                if spec.units != '':
-                    if val.lower().endswith(spec.units.lower()):       # remove the engineering unit if applicable
+                    elif spec.input_type is str and val.startswith('*'):
+                        op = e7epd.ComparisonOperators.contains
+                        val = val.strip('*')
+                    elif spec.input_type is str and val.endswith('*'):
+                        op = e7epd.ComparisonOperators.starts_with
+                        val = val.rstrip('*')
+                # Engineering numbers are parsed with their unit, otherwise remove the unit if applicable
+                if spec.units != '' and spec.shows_as != ShowAsEnum.engineering:
+                    if val.lower().endswith(spec.units.lower()):
                         val = val[:-len(spec.units)]
                 if spec.shows_as == ShowAsEnum.engineering:
                     try:
-                        val = EngNumber(val)
-                    except decimal.InvalidOperation:
+                        val = e7epd.units.parse(val, spec.units)
+                    except ValueError:
                         console.print("Invalid engineering number")
                         continue
                 elif spec.shows_as == ShowAsEnum.precentage:
@@ -551,18 +666,16 @@ class CLI:
 
         Returns: A tuple of a selected component database and the manufacturer part number
         """
-        if part_db is None:
-            all_ipn_list = self.db.get_all_parts_by_keys(None, 'ipn')
-        else:
-            all_ipn_list = self.db.get_all_parts_by_keys(part_db, 'ipn')
-
         try:
-            ipn_number = self._ask_ipn(all_ipn_list, must_already_exist=ipn_must_exist)
+            ipn_number = self._ask_ipn(part_db, must_already_exist=ipn_must_exist)
         except self._HelperFunctionExitError:
             raise self._HelperFunctionExitError()
 
         if part_db is None:
-            t = self.db.get_part_by_ipn(ipn_number)['type']
+            try:
+                t = self.db.get_ipn_index().get_type(ipn_number)
+            except KeyError:
+                t = self.db.get_part_by_ipn(ipn_number)['type']
             part_db = self.db.get_part_spec_by_db_name(t)
 
         return part_db, ipn_number
@@ -578,7 +691,37 @@ class CLI:
                 except KeyboardInterrupt:
                     console.print("Did not add part")
                     return
-        self.db.add_new_pcb(new_pcb)
+        try:
+            self.db.add_new_pcb(new_pcb)
+        except e7epd.InputException as e:
+            console.print(f"[red]Invalid PCB, it is not added: {e}[/]")
+        except pymongo.errors.WriteError as e:
+            if e.code != 121:
+                raise
+            console.print(f"[red]{self._get_validation_error(e)}, it is not added[/]")
+
+    def _check_similar_parts(self, ipn: str, mfg_part_numb: str) -> bool:
+        """
+        Warns about any part with a part number similar to a new part's IPN or manufacturer part number
+
+        Returns: Whether to go ahead with adding the part
+        """
+        similar = {}
+        for pn in {ipn, mfg_part_numb} - {None, ''}:
+            for p in self.db.find_similar_parts(pn, min_similarity=0.6):
+                if p.ipn not in similar or p.similarity > similar[p.ipn].similarity:
+                    similar[p.ipn] = p
+        if len(similar) == 0:
+            return True
+        ta = rich.table.Table(title='Similar Parts Already in the Database')
+        ta.add_column("IPN")
+        ta.add_column("Manufacturer Part Number")
+        ta.add_column("Similarity")
+        for p in sorted(similar.values(), key=lambda i: i.similarity, reverse=True):
+            ta.add_row(p.ipn, p.mfg_part_numb, f"{p.similarity:.0%}")
+        console.print(ta)
+        return questionary.confirm("This part may already be in the database. Add it anyway?", auto_enter=False,
+                                   default=False).ask()
 
     def add_new_part(self, part_type: e7epd.spec.PartSpec = None):
         """ Function gets called when a part is to be added """
@@ -590,7 +733,7 @@ class CLI:
                 self.add_new_pcb()
                 return
             try:
-                ipn = self._ask_ipn(self.db.get_all_parts_by_keys(part_type, 'ipn'), must_already_exist=False)
+                ipn = self._ask_ipn(part_type, must_already_exist=False)
             except self._HelperFunctionExitError as e:
                 if e.extra_data is not None:
                     if questionary.confirm("Would you like to instead add the parts to your stock?", auto_enter=False, default=False).ask():
@@ -606,6 +749,8 @@ class CLI:
                         new_part['mfg_part_numb'] = self._ask_mfg_part_number(new_part['ipn'])
                     except self._HelperFunctionExitError:
                         raise KeyboardInterrupt()
+                    if not self._check_similar_parts(new_part['ipn'], new_part['mfg_part_numb']):
+                        raise KeyboardInterrupt()
                 else:
                     # Select an autocomplete choice, or None if there isn't any
                     autocomplete_choices = self.db.get_autocomplete_list(part_type, spec_db_name)
@@ -621,7 +766,14 @@ class CLI:
                         e7epd.label_making.print_barcodes([new_part['ipn']], self.printer)
                         self.printer.close()
             # todo: move this above print function. is here to test above function
-            self.db.add_new_part(part_type, new_part)
+            try:
+                self.db.add_new_part(part_type, new_part)
+            except e7epd.InputException as e:
+                console.print(f"[red]Invalid part, it is not added: {e}[/]")
+            except pymongo.errors.WriteError as e:
+                if e.code != 121:
+                    raise
+                console.print(f"[red]{self._get_validation_error(e)}, it is not added[/]")
 
         except KeyboardInterrupt:
             console.print("\nOk, no part is added")
@@ -665,9 +817,8 @@ class CLI:
                     console.print("Must be greater than 0")
                     continue
                 break
-            component['stock'] += add_by
-            self.db.update_part_stock(ipn, component['stock'])
-            console.print('[green]Add to your stock :). There is now {:d} left of it.[/]'.format(component['stock']))
+            new_stock = self.db.adjust_stock(ipn, add_by)
+            console.print('[green]Add to your stock :). There is now {:d} left of it.[/]'.format(new_stock))
         except KeyboardInterrupt:
             console.print("\nOk, no stock is changed")
             return
@@ -693,13 +844,13 @@ class CLI:
                     console.print("Must be greater than 0")
                     continue
                 break
-            if component['stock'] - remove_by < 0:
+            try:
+                new_stock = self.db.adjust_stock(ipn, -remove_by)
+            except e7epd.NegativeStock as e:
                 console.print("[red]Stock will go to negative[/]")
-                console.print("[red]If you want to make the stock zero, restart this operation and remove {:d} parts instead[/]".format(component['stock']))
+                console.print("[red]If you want to make the stock zero, restart this operation and remove {:d} parts instead[/]".format(e.amount_to_make_zero))
                 return
-            component['stock'] -= remove_by
-            self.db.update_part_stock(ipn, component['stock'])
-            console.print('[green]Removed to your stock :). There is now {:d} left of it.[/]'.format(component['stock']))
+            console.print('[green]Removed to your stock :). There is now {:d} left of it.[/]'.format(new_stock))
         except KeyboardInterrupt:
             console.print("Ok, no stock is changed")
             return
@@ -733,7 +884,16 @@ class CLI:
                 if to_change is None:
                     raise KeyboardInterrupt()
                 if to_change == 'exit_save':
-                    self.db.update_part(part_db, ipn, to_update)
+                    try:
+                        self.db.update_part(part_db, ipn, to_update)
+                    except e7epd.InputException as e:
+                        console.print(f"[red]Invalid part: {e}[/]")
+                        continue
+                    except pymongo.errors.WriteError as e:
+                        if e.code != 121:
+                            raise
+                        console.print(f"[red]{self._get_validation_error(e)}[/]")
+                        continue
                     break
                 if to_change == 'no_save':
                     raise KeyboardInterrupt()
@@ -764,8 +924,7 @@ class CLI:
         board = self.db.get_pcb(all_boards[board_name][0], all_boards[board_name][1])
 
         all_parts_in_board = []         # type: typing.List[tuple]
-        for board_part in board['parts']:
-            parts = self.db.find_pcb_part(board_part)
+        for board_part, parts in zip(board['parts'], self.db.resolve_bom(board)):
             if len(parts) == 0:
                 all_parts_in_board.append(([str(board_part['qty']), board_part['designator'], '-', '-', '-', '-', '-'], 'red'))
             elif len(parts) == 1:
@@ -776,6 +935,10 @@ class CLI:
                     all_parts_in_board.append(([str(board_part['qty']), board_part['designator'], '-', part['type'], part['ipn'], f"{part['stock']:d}", part['storage']], 'yellow'))
 
         console.print("You currently have {:d} PCBs available".format(board['stock']))
+        buildable = self.db.buildable_quantity(board['id'], board['rev'])
+        if buildable.buildable is not None:
+            console.print("You can build {:d} more with the parts in stock, limited by {}".format(
+                buildable.buildable, ', '.join(i.designator for i in buildable.limiting)))
 
         ta = rich.table.Table(title='All components for {} Rev {}'.format(board['board name'], board['rev']))
         ta.add_column("Stock Required")
@@ -791,6 +954,133 @@ class CLI:
 
         return
 
+    def _ask_for_pcb(self) -> typing.Union[typing.Tuple[str, str], None]:
+        """ Asks for a PCB in the database. Returns a tuple of its ID and revision, or None if none is selected """
+        all_boards = self.db.get_all_unique_pcbs()
+        if len(all_boards) == 0:
+            console.print("There are no PCBs in the database")
+            return None
+        all_boards = {f"{i['id']} Rev {i['rev']}": (i['id'], i['rev']) for i in all_boards}
+        board_name = questionary.autocomplete("Enter the PCB name: ", choices=sorted(all_boards.keys())).ask()
+        if board_name not in all_boards:
+            console.print("No board is given")
+            return None
+        return all_boards[board_name]
+
+    def _print_kit_plan(self, plan: e7epd.KitPlan):
+        ta = rich.table.Table(title=f'Parts to build {plan.count} of {plan.pcb_id} Rev {plan.rev}')
+        ta.add_column("Reference")
+        ta.add_column("Needed")
+        ta.add_column("Taken From")
+        ta.add_column("Missing")
+        for line in plan.lines:
+            ta.add_row(line.designator, f"{line.needed:d}", ', '.join(f"{n:d} of {ipn}" for ipn, n in line.take.items()),
+                       f"{line.shortfall:d}" if line.shortfall else '', style='red' if line.shortfall else None)
+        console.print(ta)
+
+    def build_pcbs(self):
+        """ Takes all parts needed to build some PCBs from the stock, and adds to the PCB's stock """
+        board = self._ask_for_pcb()
+        if board is None:
+            return
+        count = questionary.text("How many PCBs are you building?", validate=lambda x: x.isdigit() and int(x) > 0).ask()
+        if count is None:
+            return
+        try:
+            plan = self.db.kit_build(board[0], board[1], int(count), dry_run=True)
+        except e7epd.InputException as e:
+            console.print(f"[red]{e}[/]")
+            return
+        self._print_kit_plan(plan)
+        if not plan.is_buildable:
+            console.print("[red]There isn't enough stock to build the PCBs[/]")
+            return
+        if not questionary.confirm("Take these parts from the stock?", auto_enter=False, default=False).ask():
+            return
+        try:
+            self.db.kit_build(board[0], board[1], int(count))
+        except e7epd.KitShortfall as e:
+            console.print("[red]The stock changed, and there isn't enough anymore. Nothing was taken from the stock[/]")
+            self._print_kit_plan(e.plan)
+            return
+        console.print(f"Built {count} of {board[0]} Rev {board[1]}")
+
+    def search_all_parts(self):
+        """ Searches all parts of all types for some words """
+        text = questionary.text("Enter the words to search for (quote a phrase to match it whole, start a word with - to exclude it):").ask()
+        if text is None or text.strip() == '':
+            return
+        try:
+            parts = self.db.search(text)
+        except pymongo.errors.OperationFailure:
+            logging.exception("Unable to search")
+            console.print("[red]Unable to search. Is the database's text index built? Check with --check-indexes[/]")
+            return
+        if len(parts) == 0:
+            console.print("No part matched the search")
+            return
+        ta = rich.table.Table(title=f'Parts matching "{text}"')
+        ta.add_column("IPN")
+        ta.add_column("Type")
+        ta.add_column("Manufacturer")
+        ta.add_column("Manufacturer Part Number")
+        ta.add_column("Stock")
+        ta.add_column("Storage")
+        for p in parts:
+            ta.add_row(p['ipn'], self.db.get_part_spec_by_db_name(p.get('type')).showcase_name,
+                       p.get('manufacturer') or '', p.get('mfg_part_numb') or '',
+                       str(p.get('stock') if p.get('stock') is not None else ''), p.get('storage') or '')
+        console.print(ta)
+
+    def print_statistics(self):
+        """ Prints statistics about the parts, grouped by a selected key """
+        group_choices = {'Part Type': 'type', 'Storage Location': 'storage', 'Manufacturer': 'manufacturer',
+                         'Package': 'package'}
+        group = questionary.select("What do you want to group the parts by?", choices=list(group_choices.keys()) + [self.return_formatted_choice]).ask()
+        if group is None or group == 'Return':
+            return
+        group_key = group_choices[group]
+        stats = self.db.inventory_stats([group_key])
+
+        console.print(f"There are {stats.count:d} parts with a total stock of {stats.stock:d}, "
+                      f"where {stats.zero_stock:d} parts have no stock")
+        ta = rich.table.Table(title=f'Parts per {group}')
+        ta.add_column(group)
+        ta.add_column("Parts")
+        ta.add_column("Total Stock")
+        ta.add_column("Parts Without Stock")
+        for g in stats.groups:
+            name = g.key[group_key]
+            if group_key == 'type':
+                name = self.db.get_part_spec_by_db_name(name).showcase_name
+            ta.add_row('-' if name is None else str(name), f"{g.count:d}", f"{g.stock:d}", f"{g.zero_stock:d}")
+        console.print(ta)
+
+        ta = rich.table.Table(title='Parts Without a Value')
+        ta.add_column("Key")
+        ta.add_column("Parts")
+        for k, n in stats.null_counts.items():
+            if n != 0:
+                ta.add_row(e7epd.spec.BasePartItems[k].showcase_name, f"{n:d}")
+        console.print(ta)
+
+    def print_buildable_report(self):
+        """ Prints how many of each PCB can be built with the parts in stock """
+        report = self.db.buildable_report()
+        if len(report) == 0:
+            console.print("There are no PCBs with parts in the database")
+            return
+        ta = rich.table.Table(title='Buildable PCBs')
+        ta.add_column("PCB")
+        ta.add_column("Rev")
+        ta.add_column("Buildable")
+        ta.add_column("Limited By")
+        for r in report:
+            limiting = ', '.join(f"{i.designator} ({', '.join(i.ipns) if i.ipns else 'no part'})" for i in r.limiting)
+            ta.add_row(r.pcb_id, r.rev, '-' if r.buildable is None else f"{r.buildable:d}", limiting,
+                       style='red' if r.buildable == 0 else None)
+        console.print(ta)
+
     def component_cli(self, part_db: e7epd.spec.PartSpec):
         """ The CLI handler for components """
         while 1:
@@ -929,7 +1219,18 @@ class CLI:
                 t = self.conf.get_database_connection_info(db_name)
                 if t['type'] == 'mongodb':
                     console.print("This is a Mongo server, where")
-                    console.print(f"\tDatabase Host: {t['db_host']}")
+                    if t.get('uri'):
+                        console.print("\tConnected with a URI")
+                    elif t.get('socket_path'):
+                        console.print(f"\tUnix Socket: {t['socket_path']}")
+                    else:
+                        console.print(f"\tDatabase Host: {t['db_host']}:{t.get('port', 27017)}")
+                    if t.get('replica_set'):
+                        console.print(f"\tReplica Set: {t['replica_set']}")
+                    if t.get('compressors'):
+                        console.print(f"\tCompression: {t['compressors']}")
+                    if t.get('read_preference'):
+                        console.print(f"\tRead Preference: {t['read_preference']}")
                     console.print(f"\tMongo Auth DB: {t['auth_db']}")
                     if t['auth']:
                         console.print("\tAuthentication Enabled")
@@ -952,14 +1253,18 @@ class CLI:
                 self.db.close()
                 self.conf.save()
                 return
+        try:
+            self.db.snapshot_stock_if_due()
+        except pymongo.errors.OperationFailure:
+            logging.exception("Unable to take a snapshot of the stock")
         console.print(rich.panel.Panel("[bold]Welcome to the E707PD[/bold]\n"
                                        "Database Spec Revision {}, Backend Revision {}, CLI Revision {}\n"
                                        "Selected database {}".format(self.db.config.get_db_version(), e7epd.__version__, self.cli_revision, self.conf.get_selected_database()), title_align='center'))
         try:
             while 1:
-                choices = ['Check components for PCB', 'Search Part',
+                choices = ['Check components for PCB', 'Buildable PCBs report', 'Build PCBs', 'Search', 'Search Part',
                            'Add new part', 'Add new stock', 'Remove stock', 'Edit part',
-                           'Database Setting',
+                           'Statistics', 'Database Setting',
                            # 'Digikey API Settings'
                            ]
                 if e7epd.label_making.available is None:
@@ -976,6 +1281,12 @@ class CLI:
                 elif to_do == 'Check components for PCB':
                     self.print_pcb_and_component_availability()
                     continue
+                elif to_do == 'Buildable PCBs report':
+                    self.print_buildable_report()
+                elif to_do == 'Build PCBs':
+                    self.build_pcbs()
+                elif to_do == 'Search':
+                    self.search_all_parts()
                 elif to_do == 'Search Part':
                     self.print_parts()
                 elif to_do == 'Add new part':
@@ -1011,6 +1322,8 @@ class CLI:
                 #             self.component_cli(part_db)
                 #         except KeyboardInterrupt:
                 #             break
+                elif to_do == 'Statistics':
+                    self.print_statistics()
                 elif to_do == 'Database Setting':
                     self.database_settings()
                 # elif to_do == 'Digikey API Settings':     # todo: this
@@ -1028,8 +1341,30 @@ def ask_for_database(config: CLIConfig):
     db_id_name = questionary.text("What do you want to call this database").unsafe_ask()
     is_server = questionary.select("Do you want the database to be a local file or is there a server running?", choices=['mongoDb']).unsafe_ask()
     if is_server == 'mongoDb':
-        host = questionary.text("What is the database host?").unsafe_ask()
-        ssl = questionary.confirm("Will the server be connected with SSL/TSL?", auto_enter=False, default=False).unsafe_ask()
+        host = ''
+        port = 27017
+        socket_path = None
+        uri = None
+        replica_set = None
+        ssl = False
+        conn_type = questionary.select("How do you want to connect to the server?", choices=['Host', 'Unix socket', 'URI (replica set or SRV)']).unsafe_ask()
+        if conn_type == 'Host':
+            host = questionary.text("What is the database host?").unsafe_ask()
+            port = int(questionary.text("What is the database port?", default='27017', validate=lambda x: x.isdigit()).unsafe_ask())
+            replica_set = questionary.text("What is the replica set name (Enter nothing for none)?").unsafe_ask()
+            if replica_set == '':
+                replica_set = None
+        elif conn_type == 'Unix socket':
+            socket_path = questionary.path("What is the server's socket path?", default='/tmp/mongodb-27017.sock').unsafe_ask()
+        else:
+            uri = questionary.text("What is the connection URI (mongodb:// or mongodb+srv://)?").unsafe_ask()
+        if socket_path is None and uri is None:
+            ssl = questionary.confirm("Will the server be connected with SSL/TSL?", auto_enter=False, default=False).unsafe_ask()
+        compressors = questionary.select("What wire compression do you want to use?", choices=['None', 'zstd', 'snappy', 'zlib']).unsafe_ask()
+        if compressors == 'None':
+            compressors = None
+        read_preference = questionary.select("What read preference do you want to use?",
+                                             choices=['primary', 'primaryPreferred', 'secondary', 'secondaryPreferred', 'nearest']).unsafe_ask()
         auth_db = questionary.text("What is the database name you want to use (and auth database of authenticating if setup?)").unsafe_ask()
         username = questionary.text("What is the database username (Enter nothing for un-auth)?").unsafe_ask()
         if username == '':
@@ -1038,7 +1373,9 @@ def ask_for_database(config: CLIConfig):
         else:
             password = questionary.password("What is the database password?").unsafe_ask()
             is_auth = True
-        config.save_database_as_mongo(database_name=db_id_name, username=username, password=password, host=host, authenticated=is_auth, ssl=ssl, auth_db=auth_db)
+        config.save_database_as_mongo(database_name=db_id_name, username=username, password=password, host=host, authenticated=is_auth, ssl=ssl, auth_db=auth_db,
+                                      port=port, socket_path=socket_path, uri=uri, compressors=compressors,
+                                      read_preference=read_preference, replica_set=replica_set)
         # try and get the database
         try:
             c = config.config.db_list[db_id_name]
@@ -1136,24 +1473,193 @@ def printDigikeyOrder():
         printer.close()
 
 
-def exporter_app(conf: CLIConfig, database_connection: pymongo.database.Database):
-    # log = logging.getLogger('exporter_app')
-    # db = e7epd.E7EPD(database_connection)
-    console.print("Not implemented (todo)")
+def exporter_app(conf: CLIConfig, database_connection: pymongo.database.Database, path: str = None,
+                 fmt: str = 'csv', part_types: typing.List[str] = None):
+    """
+    A sub-application that exports the parts into a directory
+
+    Args:
+        conf: The CLI configuration
+        database_connection: The database to export from
+        path: The directory to export into. Defaults to `partdb_export_<date and time>` in the current directory
+        fmt: The format, either `csv`, `ndjson` or `parquet`
+        part_types: Optionally only export these part types, by their database type name (or `other`)
+    """
+    import e7epd.exporter
+
+    db = e7epd.E7EPD(database_connection, ensure_indexes=False)
+    part_classes = None
+    if part_types:
+        by_name = {e7epd.exporter.get_type_file_name(i): i for i in db.comp_types}
+        unknown = [i for i in part_types if i not in by_name]
+        if len(unknown) != 0:
+            console.print(f"[red]Unknown part types {', '.join(unknown)}, which can be {', '.join(by_name)}[/]")
+            return
+        part_classes = [by_name[i] for i in part_types]
+    if path is None:
+        path = os.path.abspath(f"partdb_export_{time.strftime('%y%m%d%H%M%S')}")
+    try:
+        with console.status(f"Exporting the parts to {path}"):
+            result = db.export_parts(path, fmt, part_classes)
+    except e7epd.InputException as e:
+        console.print(f"[red]{e}[/]")
+        return
+
+    ta = rich.table.Table(title=f'Exported to {path}')
+    ta.add_column("File")
+    ta.add_column("Parts")
+    for f in result.files:
+        ta.add_row(f.file, f"{f.count:d}")
+    console.print(ta)
 
 
-def importer_app(conf: CLIConfig, database_connection: pymongo.database.Database, import_file: str):
+def check_indexes_app(conf: CLIConfig, database_connection: pymongo.database.Database):
     """
-    An importer sub-application that imports an existing "database" from a CSV file
+    A sub-application that reports any missing or unused index in the database, without building anything
+    """
+    db = e7epd.E7EPD(database_connection, ensure_indexes=False)
+    report = db.indexes.check_indexes()
+
+    ta = rich.table.Table(title='Database Indexes')
+    ta.add_column("Index")
+    ta.add_column("Status")
+    for i in report.existing:
+        if i in report.unused:
+            ta.add_row(i, "Unused", style='yellow')
+        else:
+            ta.add_row(i, "OK")
+    for i in report.missing:
+        ta.add_row(i, "Missing", style='red')
+    # Unused indexes that were not made by this application
+    for i in report.unused:
+        if i not in report.existing:
+            ta.add_row(i, "Unused (not managed)", style='yellow')
+    console.print(ta)
+    if len(report.missing) != 0:
+        console.print("[red]Some indexes are missing, they will be built the next time the application is started[/]")
+
+
+def backup_app(conf: CLIConfig, database_connection: pymongo.database.Database, path: str, incremental: bool = False):
+    """
+    A sub-application that backs up the database into a directory, or adds an incremental backup to it
+    """
+    db = e7epd.E7EPD(database_connection, ensure_indexes=False)
+    try:
+        if incremental:
+            with console.status(f"Backing up the changes since the last backup in {path}"):
+                delta = db.backup_db_incremental(path)
+            if delta is None:
+                console.print("Nothing changed since the last backup")
+            else:
+                console.print(f"Backed up {delta.count:d} changed documents into {delta.file}")
+            return
+        with console.status(f"Backing up the database to {path}"):
+            manifest = db.backup_db(path)
+    except e7epd.InputException as e:
+        console.print(f"[red]{e}[/]")
+        return
 
-    Args:
-        conf:
-        database_connection:
-        import_file:
+    ta = rich.table.Table(title=f'Backup in {path}')
+    ta.add_column("Collection")
+    ta.add_column("Documents")
+    ta.add_column("File")
+    for b in manifest.collections.values():
+        ta.add_row(b.collection, f"{b.count:d}", b.file)
+    console.print(ta)
+
+
+def restore_app(conf: CLIConfig, database_connection: pymongo.database.Database, path: str, mode: str):
+    """
+    A sub-application that restores the database from a backup directory
+    """
+    if mode == 'replace':
+        if not questionary.confirm(f"This will replace the database {conf.get_selected_database()} with the backup. "
+                                   "Are you sure?", auto_enter=False, default=False).ask():
+            return
+    db = e7epd.E7EPD(database_connection)
+    try:
+        with console.status(f"Restoring the database from {path}"):
+            result = db.restore(path, mode)
+    except e7epd.InputException as e:
+        console.print(f"[red]{e}[/]")
+        return
+
+    if result.resumed:
+        console.print("Continued an interrupted restore")
+    for name, r in result.deltas.items():
+        console.print(f"Replayed {name}: {r.inserted:d} changed and {r.deleted:d} deleted documents")
+    ta = rich.table.Table(title=f'Restored from {path}')
+    ta.add_column("Collection")
+    ta.add_column("Inserted")
+    ta.add_column("Already There")
+    ta.add_column("Errors")
+    for name, r in result.collections.items():
+        ta.add_row(name, f"{r.inserted:d}", f"{r.skipped:d}", f"{len(r.errors):d}", style='red' if r.errors else None)
+    console.print(ta)
+    for name, r in list(result.collections.items()) + list(result.deltas.items()):
+        for e in r.errors:
+            console.print(f"[red]{name} document {e.index:d} ({e.ipn}): {e.message}[/]")
+
+
+def _ask_import_columns(header: typing.List[str], db: e7epd.E7EPD) -> e7epd.ImportProfile:
+    """
+    Asks which part key (common to all part types) each CSV column is, and which column is the part type
+
+    Raises:
+        KeyboardInterrupt: If the user exits
+    """
+    profile = e7epd.ImportProfile()
+    console.print("The following are your headers: (column, header name)")
+    for i, h in enumerate(header):
+        console.print(f"\t{i} --> {h}")
+    for i, h in enumerate(header):
+        choices = [questionary.Choice(title=f"{v.showcase_name} (Required)" if v.required else f"{v.showcase_name}", value=k)
+                   for k, v in e7epd.spec.BasePartItems.items() if k not in profile.columns.values()]
+        if 'type' not in profile.columns.values():
+            choices += [questionary.Choice(title=FormattedText([('blue', 'Part Type')]), value='type')]
+        choices += [questionary.Choice(title=FormattedText([('orange', 'None/Other')]), value='None')]
+        a = questionary.select(f"What database key matches the column {i} ({h})?", choices=choices).unsafe_ask()
+        if a != 'None':
+            profile.columns[h] = a
+    if profile.get_type_column() is None:
+        part_type = questionary.select("There is no part type column. What part type are all parts?",
+                                       choices=[questionary.Choice(i.showcase_name, value=i) for i in db.comp_types]).unsafe_ask()
+        profile.default_type = e7epd.importer.get_type_file_name(part_type)
+        _ask_import_type_columns(header, profile, part_type)
+    return profile
+
+
+def _ask_import_type_columns(header: typing.List[str], profile: e7epd.ImportProfile, part_type: e7epd.spec.PartSpec):
+    """ Asks which part type specific key each column not mapped yet is """
+    columns = profile.type_columns.setdefault(e7epd.importer.get_type_file_name(part_type), {})
+    for i, h in enumerate(header):
+        if h in profile.columns:
+            continue
+        choices = [questionary.Choice(title=f"{v.showcase_name} (Required)" if v.required else f"{v.showcase_name}", value=k)
+                   for k, v in part_type.items.items() if k not in columns.values() and k not in e7epd.spec.BasePartItems]
+        choices += [questionary.Choice(title=FormattedText([('orange', 'None')]), value='None')]
+        a = questionary.select(f"For {part_type.showcase_name}, what database key matches the column {i} ({h})?",
+                               choices=choices).unsafe_ask()
+        if a != 'None':
+            columns[h] = a
+
+
+def importer_app(conf: CLIConfig, database_connection: pymongo.database.Database, import_file: str,
+                 profile_file: str = None):
+    """
+    An importer sub-application that imports parts from a CSV file.
 
-    Returns:
+    With a profile file, the import runs without asking anything. Otherwise the user is asked for the mapping of each
+    column, and of each new part type text as it is found, and can then save the mapping as a profile
 
+    Args:
+        conf: The CLI configuration
+        database_connection: The database to import into
+        import_file: The CSV file
+        profile_file: Optionally a JSON profile saved from a previous import
     """
+    import e7epd.importer
+
     log = logging.getLogger('importer_app')
 
     if not os.path.isfile(import_file):
@@ -1165,140 +1671,66 @@ def importer_app(conf: CLIConfig, database_connection: pymongo.database.Database
         console.print("[red]The given file is not a CSV[/]")
         return
 
-    todo = questionary.confirm(f"Do you want to import data from {import_file}", auto_enter=False, default=False).ask()
-    if todo is False:
-        console.print("Not importing file")
-        return
-
     db = e7epd.E7EPD(database_connection)
-
-    new_parts = []
-    with open(import_file, 'r') as f:
-        header = f.readline().strip()
-        header = header.split(',')
-        console.print("The following are your headers: (column, header name)")
-        for i, h in enumerate(header):
-            console.print(f"\t{i} --> {h}")
-
-        # Map the columns to a key
-        column_to_key = {}
-        """Maps a column index to a part spec key (stock, resistance, etc)"""
+    resolve_type = None
+    if profile_file is not None:
         try:
-            for i, h in enumerate(header):
-                choices = [questionary.Choice(title=f"{v.showcase_name} (Required)" if v.required else f"{v.showcase_name}", value=i) for i, v in e7epd.spec.BasePartItems.items() if i not in column_to_key.values()]
-                if 'type' not in column_to_key.values():
-                    choices += [questionary.Choice(title=FormattedText([('blue', 'Part Type (Required)')]), value='type')]
-                choices += [questionary.Choice(title=FormattedText([('orange', 'None/Other')]), value='None')]
-                a = questionary.select(f"What database key matches the column {i} ({h})?", choices=choices).unsafe_ask()
-                if a == 'None':
-                    a = None
-                column_to_key[i] = a
-        except KeyboardInterrupt:
-            console.print("[red]Exited[/]")
+            profile = e7epd.ImportProfile.load(profile_file)
+        except e7epd.InputException as e:
+            console.print(f"[red]{e}[/]")
             return
-
-        # Check for all required keys for the base part
-        console.print(f"The following is the mapping between column and database key: {column_to_key}")
-        for c in e7epd.spec.BasePartItems:
-            if e7epd.spec.BasePartItems[c].required and c not in column_to_key.values():
-                console.print(f"Did not select the required key [bold]'{c}'[/bold]")
-                return
-
-        console.print(f"The following is the mapping between column and database key: {column_to_key}")
-
-        # Go through the entire file (kind of stupid, but no easy way around it) to check for all possible types
-        # then ask the user what column will be used for the part parameter
-        csv_type_to_internal_type = {}      # type: typing.Dict[str, e7epd.spec.PartSpec]
-        part_type_choice = [questionary.Choice(i.showcase_name, value=i) for i in db.comp_types]
-        type_col = [i for i in column_to_key if column_to_key[i] == 'type'][0]      # get column where the type keyword exists
-        column_to_key_parts = {}
-        for line_i, line in enumerate(f):
-            line = line.strip().split(',')
-            if len(header) != len(line):
-                console.print(f"[red]Line {line_i} is not the same length as the header. Exiting[/]")
-                return
-            line_item = line[type_col]
-            if line_item not in csv_type_to_internal_type:
-                pt = questionary.select(f"What is the part type for string '{line_item}'?", choices=part_type_choice).unsafe_ask()
-                csv_type_to_internal_type[line_item] = pt
-                column_to_key_parts[pt.db_type_name] = {}
-                # ask the user which columns go with part-specific keys
-                for i, h in enumerate(header):
-                    # if we have the column in the "base part" item mapping, then don't both with the particular column for this
-                    if column_to_key[i] is not None:
-                        continue
-                    choices = [questionary.Choice(title=f"{v.showcase_name} (Required)" if v.required else f"{v.showcase_name}", value=i) for i, v in pt.items.items() if
-                               i not in column_to_key.values() and i not in e7epd.spec.BasePartItems.keys()]
-                    choices += [questionary.Choice(title=prompt_toolkit.formatted_text.FormattedText([('orange', 'None')]), value='None')]
-                    a = questionary.select(f"What database key matches the column {i} ({h})?", choices=choices).unsafe_ask()
-                    if a == 'None':
-                        a = None
-                    column_to_key_parts[pt.db_type_name][i] = a
-
-        console.print(f"The following is the mapping between column and database key: {column_to_key_parts}")
-
-        # Now go back to the beginning of the file for the rest of the import, skipping the header of course!
-        f.seek(0)
-        f.readline()
+    else:
+        todo = questionary.confirm(f"Do you want to import data from {import_file}", auto_enter=False, default=False).ask()
+        if todo is not True:
+            console.print("Not importing file")
+            return
+        with open(import_file, 'r', newline='', encoding='utf-8-sig') as f:
+            header = [h.strip() for h in next(csv.reader(f), [])]
         try:
-            # Go thru, and for each line add it as a part
-            for line_i, line in enumerate(f):
-                new_part = {}
-                line = line.strip().split(',')
-                if len(header) != len(line):
-                    console.print(f"[red]Line {line_i} is not the same length as the header. Exiting[/]")
-                    return
-                # get the type first (to check for type in other params)
-                new_part['type'] = csv_type_to_internal_type[line[type_col]]
-                # for each column in a particular row, add the information to new_part
-                for column_i, line_item in enumerate(line):
-                    if column_to_key[column_i] == 'type':   # we already have the type, don't worry about it again
-                        continue
-
-                    if column_to_key[column_i] is not None:
-                        curr_column_key = column_to_key[column_i]
-                        line_type = e7epd.spec.BasePartItems[curr_column_key].input_type
-                    elif column_i in column_to_key_parts[new_part['type'].db_type_name]:
-                        curr_column_key = column_to_key_parts[new_part['type'].db_type_name][column_i]
-                        line_type = new_part['type'].items[curr_column_key].input_type
-                    else:
-                        continue
-
-                    try:
-                        if line_type in [float, int]:
-                            # shitty attempt at removing any units by removing the last char of a string if it's not a number
-                            for end_unit in ['ohm', 'F', 'H', 'Ω']:
-                                if line_item.endswith(end_unit):
-                                    line_item = line_item[:-(len(end_unit))]
-                                    break
-                            try:
-                                line_item = EngNumber(line_item)
-                            except decimal.InvalidOperation:
-                                console.print(f"[red]Cannot convert {line_item} to Engineering Number in col {column_i} line {line_i+1}[/]")
-                                continue
-                        line_item = line_type(line_item)
-                    except ValueError:
-                        console.print(f"[red]Cannot convert {line_item} to {line_type}[/]")
-                        continue
-
-                    new_part[curr_column_key] = line_item
-                new_parts.append(new_part)
+            profile = _ask_import_columns(header, db)
         except KeyboardInterrupt:
             console.print("[red]Exited[/]")
             return
 
-    console.print(f"The imported parts:")
-    rich.pretty.pprint(new_parts)
-    if questionary.confirm("Would you like to add these parts", default=False).ask() is not True:
-        console.print("Understood, not adding parts")
+        def resolve_type(text: str) -> typing.Union[e7epd.spec.PartSpec, None]:
+            choices = [questionary.Choice(i.showcase_name, value=i) for i in db.comp_types]
+            choices += [questionary.Choice(title=FormattedText([('orange', 'Skip these rows')]), value='None')]
+            part_type = questionary.select(f"What is the part type for string '{text}'?", choices=choices).unsafe_ask()
+            if part_type == 'None':
+                return None
+            if e7epd.importer.get_type_file_name(part_type) not in profile.type_columns:
+                _ask_import_type_columns(header, profile, part_type)
+            return part_type
+
+    last_shown = time.perf_counter()
+
+    def show_progress(p: e7epd.ImportProgress):
+        nonlocal last_shown
+        if time.perf_counter() - last_shown < 1:
+            return
+        last_shown = time.perf_counter()
+        console.print(f"{p.fraction:6.1%}: {p.rows:d} rows read, {p.inserted:d} parts added, {p.errors:d} errors "
+                      f"({p.rows_per_second:.0f} rows/s)")
+
+    try:
+        r = db.import_csv(import_file, profile, resolve_type=resolve_type, progress=show_progress)
+    except e7epd.InputException as e:
+        console.print(f"[red]{e}[/]")
+        return
+    except KeyboardInterrupt:
+        console.print("[red]Exited, the parts read so far were added[/]")
         return
 
-    for part in new_parts:
-        # todo: add error if unable to add
-        try:
-            db.add_new_part(part['type'], part)
-        except e7epd.InputException:
-            log.exception(f"Unable to add part {part}")
+    for err in r.errors:
+        # The row index doesn't count the header, and lines start at 1
+        log.error(f"Unable to add part {err.ipn} (line {err.index+2}): {err.message}")
+    console.print(f"Added {r.inserted} out of {r.rows} parts in {r.elapsed:.1f}s ({r.rows_per_second:.0f} rows/s)")
+
+    if profile_file is None and questionary.confirm("Would you like to save this mapping as a profile?", default=False).ask():
+        path = questionary.path("Where to save the profile:", default='import_profile.json').ask()
+        if path:
+            profile.save(path)
+            console.print(f"Saved the profile. Use it with --profile {path}")
 
 
 def setup_logger(is_debug: bool = False):
@@ -1321,9 +1753,18 @@ def setup_logger(is_debug: bool = False):
 def main():
     parser = argparse.ArgumentParser(description='E7EPD CLI Application')
     parser.add_argument('-v', '--verbose', action='store_true', help='Enable verbose mode', default=False)
-    parser.add_argument('--import_csv', help='Run the importer utility with the given CSV (not fully functional)', default=None)
-    parser.add_argument('--export', action='store_true', help='Exports data in a csv or json format (not functional)', default=None)
+    parser.add_argument('--import_csv', help='Run the importer utility with the given CSV', default=None)
+    parser.add_argument('--profile', metavar='PATH', help='With --import_csv, the saved column mapping profile to import with, without asking anything', default=None)
+    parser.add_argument('--export', action='store_true', help='Exports the parts in a CSV, NDJSON or Parquet format', default=None)
+    parser.add_argument('--export-format', choices=['csv', 'ndjson', 'parquet'], help='With --export, the format to export in', default='csv')
+    parser.add_argument('--export-type', metavar='TYPE', action='append', help='With --export, only export this part type (like resistor, or other). Can be given more than once', default=None)
+    parser.add_argument('--export-path', metavar='PATH', help='With --export, the directory to export into', default=None)
     parser.add_argument('--digikeyBarcode', action='store_true', help='Utility to print your Digikey csv into barcodes', default=None)
+    parser.add_argument('--check-indexes', action='store_true', help='Reports any missing or unused database index', default=None)
+    parser.add_argument('--backup', metavar='PATH', help='Backs up the database into the given directory', default=None)
+    parser.add_argument('--incremental', action='store_true', help='With --backup, only back up the changes since the last backup in the directory', default=False)
+    parser.add_argument('--restore', metavar='PATH', help='Restores the database from the given backup directory', default=None)
+    parser.add_argument('--restore-mode', choices=['merge', 'replace'], help='Whether to add the backup to the database, or replace it', default='merge')
     args = parser.parse_args()
 
     setup_logger(args.verbose)
@@ -1390,15 +1831,28 @@ def main():
             return
 
     if args.import_csv is not None:
-        importer_app(c, db_conn, args.import_csv)
+        importer_app(c, db_conn, args.import_csv, args.profile)
         return
 
     if args.export is not None:
-        exporter_app(c, db_conn)
+        exporter_app(c, db_conn, args.export_path, args.export_format, args.export_type)
+        return
+
+    if args.check_indexes is not None:
+        check_indexes_app(c, db_conn)
+        return
+
+    if args.backup is not None:
+        backup_app(c, db_conn, args.backup, args.incremental)
+        return
+
+    if args.restore is not None:
+        restore_app(c, db_conn, args.restore, args.restore_mode)
         return
 
     c = CLI(config=c, database_connection=db_conn)
     c.main()
+    CLIConfig.close_clients()
 
 
 if __name__ == "__main__":
@@ -77,7 +77,7 @@ Resistor = PartSpec(
     table_display_order=eedata_generic_items_preitems+('resistance', 'tolerance', 'power')+eedata_generic_items_postitems,
     items={
         **BasePartItems,
-        'resistance': SpecLineItem('Resistance', ShowAsEnum.engineering, float, True, f'{UnicodeCharacters.Omega:s}'),
+        'resistance': SpecLineItem('Resistance', ShowAsEnum.engineering, float, True, UnicodeCharacters.Omega.value),
         'tolerance': SpecLineItem('Tolerance', ShowAsEnum.precentage, float, False),
         'power': SpecLineItem('Power Rating', ShowAsEnum.fraction, float, False),
     }
@@ -140,7 +140,7 @@ Crystal = PartSpec(
         **BasePartItems,
         'frequency': SpecLineItem('Frequency', ShowAsEnum.engineering, float, True, 'Hz'),
         'load_c': SpecLineItem('Load Capacitance', ShowAsEnum.engineering, float, False, 'F'),
-        'esr': SpecLineItem('ESR', ShowAsEnum.engineering, float, False, f'{UnicodeCharacters.Omega:s}'),
+        'esr': SpecLineItem('ESR', ShowAsEnum.engineering, float, False, UnicodeCharacters.Omega.value),
         'stability': SpecLineItem('Stability', ShowAsEnum.engineering, float, False, 'ppm'),
     }
 )
@@ -1,18 +1,26 @@
+import copy
 import dataclasses
+import datetime
 import enum
 import logging
 import json
 import os
+import re
 import time
+import bson
 import pymongo
 import pymongo.database
-from engineering_notation import EngNumber
+import pymongo.errors
+import pymongo.collation
 import typing
 
 import e7epd.e707pd_spec as spec
+import e7epd.units
+from e7epd.cache import PartCache
+from e7epd.lookup import IPNIndex, PartNumberIndex, SimilarPart
 
 # Version of the database spec
-database_spec_rev = '0.7-rc1'
+database_spec_rev = '0.7-rc2'
 
 
 class InputException(Exception):
@@ -40,6 +48,17 @@ class NegativeStock(Exception):
         super().__init__('Stock will go to negative')
 
 
+class KitShortfall(Exception):
+    """ Exception that gets raised when there isn't enough stock to build some PCBs. Nothing is taken from the stock
+
+    Attributes:
+        plan (KitPlan): The kitting plan, where the lines without enough stock have a shortfall
+    """
+    def __init__(self, plan):
+        self.plan = plan
+        super().__init__('Not enough stock to build the PCBs')
+
+
 class ComparisonOperators(enum.Enum):
     """ Comparison operators as an enum """
     equal = '=='
@@ -47,6 +66,8 @@ class ComparisonOperators(enum.Enum):
     greater = '>'
     less_equal = '<='
     greater_equal = '>='
+    starts_with = '^='      # Only for strings
+    contains = '~='         # Only for strings, and can not use an index
 
 
 @dataclasses.dataclass
@@ -66,6 +87,1059 @@ operator_to_mongo_comp = {
     ComparisonOperators.greater_equal: '$gte',
 }
 
+# The collation used for case-insensitive string matches. The case-insensitive indexes are built with the same
+# collation, as otherwise they can't be used by the query
+case_insensitive_collation = pymongo.collation.Collation(locale='en',
+                                                         strength=pymongo.collation.CollationStrength.SECONDARY)
+
+# Keys that get a case-insensitive index, which are the ones most likely to be searched by
+case_insensitive_index_keys = ('ipn', 'mfg_part_numb', 'manufacturer', 'package', 'storage')
+
+# The weight of string keys in the text index, where any other string key has a weight of 1
+text_index_weights = {'ipn': 10, 'mfg_part_numb': 10, 'manufacturer': 5, 'package': 3}
+
+# The BSON types allowed in the database's validators for each spec input type. Any key can also be null
+json_schema_bson_types = {
+    int: ['int', 'long'],
+    float: ['double', 'int', 'long'],
+    str: ['string'],
+    list: ['array'],
+}
+
+
+def _get_json_schema_properties(items: typing.Dict[str, spec.SpecLineItem]) -> dict:
+    """ Gets the `$jsonSchema` properties for a spec's items, along with the `_id` """
+    properties = {'_id': {}}
+    for k, i in items.items():
+        properties[k] = {'bsonType': json_schema_bson_types[i.input_type] + ['null']}
+    return properties
+
+
+def make_parts_json_schema(part_classes: typing.Iterable[spec.PartSpec]) -> dict:
+    """
+    Makes the `$jsonSchema` validator for the parts collection, with one schema per part type keyed on the `type` key
+
+    Args:
+        part_classes: The part specs to allow in the collection
+    """
+    one_of = []
+    for c in part_classes:
+        properties = _get_json_schema_properties(c.items)
+        properties['type'] = {'enum': [c.db_type_name]}
+        one_of.append({
+            'properties': properties,
+            'required': ['type'] + [k for k, i in c.items.items() if i.required],
+            'additionalProperties': False,
+        })
+    return {'$jsonSchema': {
+        'bsonType': 'object',
+        'required': ['type'],
+        'properties': {'type': {'enum': [c['properties']['type']['enum'][0] for c in one_of]}},
+        'oneOf': one_of,
+    }}
+
+
+def make_pcbs_json_schema() -> dict:
+    """ Makes the `$jsonSchema` validator for the PCBs collection """
+    line_properties = _get_json_schema_properties({k: i for k, i in spec.PCBPartsItems.items() if k != 'part'})
+    del line_properties['_id']
+    # A line's part is either the IPN, or the spec values with their operator
+    line_properties['part'] = {'bsonType': 'object'}
+    properties = _get_json_schema_properties({k: i for k, i in spec.PCBItems.items() if k != 'parts'})
+    properties['parts'] = {
+        'bsonType': 'array',
+        'items': {
+            'bsonType': 'object',
+            'required': [k for k, i in spec.PCBPartsItems.items() if i.required],
+            'properties': line_properties,
+        },
+    }
+    return {'$jsonSchema': {
+        'bsonType': 'object',
+        'required': [k for k, i in spec.PCBItems.items() if i.required],
+        'properties': properties,
+        'additionalProperties': False,
+    }}
+
+
+@dataclasses.dataclass
+class CompiledQuery:
+    """ Dataclass for a query to send to the database, along with the collation it needs """
+    filter: dict
+    collation: typing.Union[pymongo.collation.Collation, None] = None
+
+
+def compile_query(part_class: typing.Union[spec.PartSpec, None],
+                  to_filter: typing.List[SpecWithOperator] = None) -> CompiledQuery:
+    """
+    Compiles a part type and an optional list of filters into a query that can use the database's indexes
+
+    String values are matched case-insensitively, either exactly, by prefix or by containing it (which can't use an
+    index). Numerical values can have multiple operators for the same key, which get merged into a single range,
+    for example `1k <= resistance <= 10k`.
+
+    Args:
+        part_class: The part spec class, which is used to determine the type. If None, then only the keys common to
+                    all parts can be filtered by
+        to_filter: Optional list of `SpecWithOperator` to filter by
+
+    Raises:
+        InputException: If a key is not part of the spec, an operator can't be used with the value's type, or
+                        the filters for a key conflict with each other
+    """
+    q = {}
+    collation = None
+    string_keys = set()
+    if part_class is not None:
+        q['type'] = part_class.db_type_name
+        spec_items = part_class.items
+    else:
+        spec_items = spec.BasePartItems
+    if to_filter:
+        for f in to_filter:
+            if f.key not in spec_items:
+                raise InputException(f"Input key of {f.key} is not part of the part class's spec")
+            if type(f.val) is str:
+                if f.key in q:
+                    raise InputException(f"Gave conflicting filters for {f.key}")
+                string_keys.add(f.key)
+                if f.operator == ComparisonOperators.equal:
+                    q[f.key] = {'$eq': f.val}
+                    collation = case_insensitive_collation
+                elif f.operator == ComparisonOperators.starts_with:
+                    # With the collation, every string starting with the value sorts between these bounds
+                    q[f.key] = {'$gte': f.val, '$lt': f.val + '\uffff'}
+                    collation = case_insensitive_collation
+                elif f.operator == ComparisonOperators.contains:
+                    q[f.key] = {'$regex': re.escape(f.val), '$options': 'i'}
+                else:
+                    raise InputException("Gave some comparison operator while input is a string")
+            else:
+                if f.operator not in operator_to_mongo_comp:
+                    raise InputException("Gave a string operator while input is not a string")
+                op = operator_to_mongo_comp[f.operator]
+                k_q = q.setdefault(f.key, {})
+                if op in k_q or f.key in string_keys:
+                    raise InputException(f"Gave conflicting filters for {f.key}")
+                k_q[op] = f.val
+    return CompiledQuery(q, collation)
+
+
+@dataclasses.dataclass
+class QueryExplanation:
+    """ Dataclass for how the database ran a query. The counts are None if the server did not report them """
+    query: CompiledQuery
+    uses_index: bool
+    index_names: typing.List[str]
+    docs_examined: typing.Union[int, None] = None
+    keys_examined: typing.Union[int, None] = None
+    returned: typing.Union[int, None] = None
+
+
+@dataclasses.dataclass
+class IndexDefinition:
+    """ Dataclass for an index that the database is expected to have """
+    collection: str
+    name: str
+    keys: typing.List[typing.Tuple[str, typing.Any]]
+    unique: bool = False
+    partial_filter: typing.Union[dict, None] = None
+    collation: typing.Union[pymongo.collation.Collation, None] = None
+    weights: typing.Union[typing.Dict[str, int], None] = None     # For text indexes
+    options: typing.Union[dict, None] = None                        # Any other `create_index` option
+
+    @property
+    def full_name(self) -> str:
+        return f"{self.collection}.{self.name}"
+
+    def create_kwargs(self) -> dict:
+        """ Returns the keyword arguments to pass into `create_index` """
+        kwargs = {'name': self.name}
+        if self.unique:
+            kwargs['unique'] = True
+        if self.partial_filter is not None:
+            kwargs['partialFilterExpression'] = self.partial_filter
+        if self.collation is not None:
+            kwargs['collation'] = self.collation
+        if self.weights is not None:
+            kwargs['weights'] = self.weights
+        if self.options is not None:
+            kwargs.update(self.options)
+        return kwargs
+
+
+@dataclasses.dataclass
+class IndexReport:
+    """
+    Dataclass for the result of building or checking the database's indexes. All indexes are given as
+    `collection.index_name` strings
+    """
+    built: typing.List[str] = dataclasses.field(default_factory=list)
+    existing: typing.List[str] = dataclasses.field(default_factory=list)
+    failed: typing.List[str] = dataclasses.field(default_factory=list)
+    missing: typing.List[str] = dataclasses.field(default_factory=list)
+    unused: typing.List[str] = dataclasses.field(default_factory=list)
+
+
+@dataclasses.dataclass
+class BulkRowError:
+    """ Dataclass for why a single part of a bulk operation failed """
+    index: int                          # The index of the part in the given input
+    ipn: typing.Union[str, None]
+    message: str
+
+
+@dataclasses.dataclass
+class BulkInsertResult:
+    """ Dataclass for the result of a bulk insertion """
+    inserted: int = 0
+    errors: typing.List[BulkRowError] = dataclasses.field(default_factory=list)
+
+
+class SpecValidator:
+    """
+    Validates documents against a spec, like a :class:`PartSpec`'s items or the PCB spec.
+
+    The spec's keys, required keys and types are gathered once when the validator is made, instead of walking the
+    spec for every document. Use :meth:`for_part` and :meth:`for_pcb` to get the shared validator of a spec.
+    """
+    _part_validators = {}       # type: typing.Dict[str, SpecValidator]
+    _pcb_validator = None       # type: typing.Union[SpecValidator, None]
+
+    def __init__(self, items: typing.Dict[str, spec.SpecLineItem]):
+        """
+        Args:
+            items: The spec's items, as the database key to its line item
+        """
+        self.items = items
+        self.keys = frozenset(items)
+        self.types = {k: i.input_type for k, i in items.items()}
+        self.required = frozenset(k for k, i in items.items() if i.required)
+        # The required keys in the spec's order, so missing keys are reported in a consistent order
+        self._required_ordered = tuple(k for k, i in items.items() if i.required)
+
+    @classmethod
+    def for_part(cls, part_class: spec.PartSpec) -> 'SpecValidator':
+        """ Gets the validator for a part spec, making it on the first call """
+        v = cls._part_validators.get(part_class.db_type_name)
+        if v is None or v.items is not part_class.items:
+            v = cls(part_class.items)
+            cls._part_validators[part_class.db_type_name] = v
+        return v
+
+    @classmethod
+    def for_pcb(cls) -> 'SpecValidator':
+        """ Gets the validator for the PCB spec, making it on the first call """
+        if cls._pcb_validator is None or cls._pcb_validator.items is not spec.PCBItems:
+            cls._pcb_validator = cls(spec.PCBItems)
+        return cls._pcb_validator
+
+    def get_errors(self, doc: dict) -> typing.List[str]:
+        """
+        Gets everything wrong with a new document: keys that aren't part of the spec, values of the wrong type
+        (None is allowed for any key), and missing required keys
+
+        Returns: The error messages, which is empty if the document is valid
+        """
+        types = self.types
+        doc_keys = doc.keys()
+        # Most documents are valid, so check that first with set operations and one pass over the values
+        if doc_keys <= self.keys and doc_keys >= self.required:
+            for k, v in doc.items():
+                if v is not None and type(v) is not types[k]:
+                    break
+            else:
+                return []
+        errors = []
+        for k, v in doc.items():
+            t = types.get(k)
+            if t is None:
+                errors.append(f"Given key of {k} is not part of the spec")
+            elif v is not None and type(v) is not t:
+                errors.append(f"Input value of {v} for {k} is not of type {t}")
+        if not doc_keys >= self.required:
+            for k in self._required_ordered:
+                if k not in doc:
+                    errors.append(f"Required key of {k} is not found in the new part dict")
+        return errors
+
+    def get_update_errors(self, new_values: dict) -> typing.List[str]:
+        """
+        Gets everything wrong with the new values of a document being updated: keys that aren't part of the spec, and
+        values that can't be converted to the key's type
+
+        Returns: The error messages, which is empty if the new values are valid
+        """
+        errors = []
+        types = self.types
+        for k, v in new_values.items():
+            t = types.get(k)
+            if t is None:
+                errors.append(f"Given key of {k} is not part of the spec")
+                continue
+            try:
+                t(v)
+            except (ValueError, TypeError):
+                errors.append(f"Input value of {v} for {k} is not of type {t}")
+        return errors
+
+    def validate(self, doc: dict):
+        """
+        Validates a new document
+
+        Raises:
+            InputException: With the first thing wrong with the document
+        """
+        errors = self.get_errors(doc)
+        if len(errors) != 0:
+            raise InputException(errors[0])
+
+    def validate_update(self, new_values: dict):
+        """
+        Validates the new values of a document being updated
+
+        Raises:
+            InputException: With the first thing wrong with the new values
+        """
+        errors = self.get_update_errors(new_values)
+        if len(errors) != 0:
+            raise InputException(errors[0])
+
+    def validate_many(self, docs: typing.Iterable[dict]) -> typing.List[BulkRowError]:
+        """
+        Validates many new documents in one pass
+
+        Args:
+            docs: The documents to validate
+
+        Returns: Every error of every document, with the index of the document in `docs`
+        """
+        ret = []
+        for i, d in enumerate(docs):
+            for e in self.get_errors(d):
+                ret.append(BulkRowError(i, d.get('ipn'), e))
+        return ret
+
+
+# The sort of `E7EPD.page_after`. The `_id` breaks ties between IPNs that are equal when ignoring case
+page_sort = [('ipn', pymongo.ASCENDING), ('_id', pymongo.ASCENDING)]
+# The keys of the part returned by `find_one_and_update` in `E7EPD.update_part`
+part_update_projection = {'_id': 0, 'type': 1, 'stock': 1, 'mfg_part_numb': 1}
+# The keys of the parts returned by `E7EPD.resolve_bom`
+bom_part_keys = ('ipn', 'type', 'stock', 'storage')
+bom_part_projection = {**{k: 1 for k in bom_part_keys}, '_id': 0}
+# The most parts a generic BOM line gets from the shared aggregation, as the parts of all lines are returned in a
+# single document which can't be larger than 16MB
+bom_facet_limit = 1000
+
+
+@dataclasses.dataclass
+class CompiledBOM:
+    """
+    Dataclass for the queries to resolve all lines of a PCB's BOM, see `E7EPD.resolve_bom`
+
+    Specific lines are found with a single `$in` query on the IPNs. Generic lines are found with one aggregation per
+    collation, which first matches any of its generic lines then splits the parts per line with a `$facet`. Each
+    facet returns at most `bom_facet_limit` parts, as all of them must fit in one document. A line with more parts
+    than that is found with its own query instead
+    """
+    ipns: typing.List[str] = dataclasses.field(default_factory=list)
+    specific_lines: typing.Dict[int, str] = dataclasses.field(default_factory=dict)     # Line index to its IPN
+    generic_lines: typing.Dict[int, str] = dataclasses.field(default_factory=dict)      # Line index to its facet
+    # Each aggregation, with the collation of all of its lines
+    pipelines: typing.List[typing.Tuple[typing.List[dict], typing.Union[pymongo.collation.Collation, None]]] = \
+        dataclasses.field(default_factory=list)
+    facet_queries: typing.Dict[str, CompiledQuery] = dataclasses.field(default_factory=dict)     # Facet to its query
+
+    def get_truncated_facets(self, facets: typing.Dict[str, typing.List[dict]]) -> typing.List[str]:
+        """ Gets the facets that hit `bom_facet_limit`, which need to be found with their own query """
+        return [k for k, v in facets.items() if len(v) > bom_facet_limit]
+
+
+@dataclasses.dataclass
+class BOMLineStock:
+    """ Dataclass for how many boards can be built from the stock of a single BOM line """
+    line: int                           # The index of the line in the PCB's parts
+    designator: str
+    qty: int
+    stock: int                          # The total stock of all parts matching the line
+    buildable: int
+    ipns: typing.List[str]              # The IPNs of the parts matching the line
+
+
+@dataclasses.dataclass
+class BuildableReport:
+    """ Dataclass for how many of a PCB can be built from the current stock, see `E7EPD.buildable_quantity` """
+    pcb_id: str
+    rev: str
+    buildable: typing.Union[int, None]
+    limiting: typing.List[BOMLineStock] = dataclasses.field(default_factory=list)     # The lines with the least stock
+
+
+@dataclasses.dataclass
+class KitLine:
+    """ Dataclass for the parts taken from the stock for a single BOM line when building PCBs """
+    line: int                           # The index of the line in the PCB's parts
+    designator: str
+    needed: int
+    take: typing.Dict[str, int] = dataclasses.field(default_factory=dict)     # IPN to how many are taken from it
+    shortfall: int = 0
+
+
+@dataclasses.dataclass
+class KitPlan:
+    """ Dataclass for the parts to take from the stock to build some PCBs, see `E7EPD.kit_build` """
+    pcb_id: str
+    rev: str
+    count: int
+    lines: typing.List[KitLine] = dataclasses.field(default_factory=list)
+    build_id: typing.Union[bson.ObjectId, None] = None     # Set once built, and stored in the stock events
+
+    @property
+    def is_buildable(self) -> bool:
+        return all(i.shortfall == 0 for i in self.lines)
+
+    @property
+    def shortfalls(self) -> typing.List[KitLine]:
+        return [i for i in self.lines if i.shortfall != 0]
+
+    def get_totals(self) -> typing.Dict[str, int]:
+        """ Returns how many are taken from each IPN, over all lines """
+        ret = {}
+        for line in self.lines:
+            for ipn, n in line.take.items():
+                ret[ipn] = ret.get(ipn, 0) + n
+        return ret
+
+
+def _get_buildable_pipeline(pcb_match: dict) -> typing.List[dict]:
+    """
+    Gets the aggregation pipeline, to run on the PCB collection, that calculates how many of each matched PCB can be
+    built. Each BOM line is joined with its parts, where a generic line matches parts the same way as `compile_query`
+
+    Args:
+        pcb_match: The filter for the PCBs to calculate for
+    """
+    # The value of the key being compared in the part, or missing if the part doesn't have it
+    part_value = {'$arrayElemAt': [{'$map': {
+        'input': {'$filter': {'input': {'$objectToArray': '$$ROOT'}, 'as': 'd', 'cond': {'$eq': ['$$d.k', '$$f.k']}}},
+        'as': 'd', 'in': '$$d.v'}}, 0]}
+    is_string = {'$eq': [{'$type': '$$x'}, 'string']}
+    index_of = {'$indexOfCP': [{'$toLower': '$$x'}, {'$toLower': '$$f.v.val'}]}
+    # The comparison for each operator, with strings being compared case-insensitively
+    branches = [
+        {'case': {'$eq': ['$$f.v.op', ComparisonOperators.equal.value]},
+         'then': {'$cond': [{'$eq': [{'$type': '$$f.v.val'}, 'string']},
+                            {'$and': [is_string, {'$eq': [{'$strcasecmp': ['$$x', '$$f.v.val']}, 0]}]},
+                            {'$eq': ['$$x', '$$f.v.val']}]}},
+        {'case': {'$eq': ['$$f.v.op', ComparisonOperators.starts_with.value]},
+         'then': {'$and': [is_string, {'$eq': [index_of, 0]}]}},
+        {'case': {'$eq': ['$$f.v.op', ComparisonOperators.contains.value]},
+         'then': {'$and': [is_string, {'$gte': [index_of, 0]}]}},
+    ]
+    for op, mongo_op in operator_to_mongo_comp.items():
+        if op == ComparisonOperators.equal:
+            continue
+        branches.append({'case': {'$eq': ['$$f.v.op', op.value]},
+                         'then': {'$and': [{'$isNumber': '$$x'}, {mongo_op: ['$$x', '$$f.v.val']}]}})
+    generic_match = {'$allElementsTrue': [{'$map': {
+        'input': {'$filter': {'input': {'$objectToArray': '$$p'}, 'as': 'f', 'cond': {'$ne': ['$$f.v.val', None]}}},
+        'as': 'f',
+        'in': {'$let': {'vars': {'x': part_value}, 'in': {'$switch': {'branches': branches, 'default': False}}}},
+    }}]}
+
+    return [
+        {'$match': pcb_match},
+        {'$unwind': {'path': '$parts', 'includeArrayIndex': 'line'}},
+        # Specific lines, which uses the IPN index
+        {'$lookup': {'from': 'parts', 'localField': 'parts.part.ipn', 'foreignField': 'ipn', 'as': 'specific'}},
+        # Generic lines. The type is None for specific lines, so they don't match anything here
+        {'$lookup': {
+            'from': 'parts',
+            'let': {'p': '$parts.part',
+                    't': {'$cond': [{'$ifNull': ['$parts.part.ipn', False]}, None, '$parts.type']}},
+            'pipeline': [
+                {'$match': {'$expr': {'$eq': ['$type', '$$t']}}},
+                {'$match': {'$expr': generic_match}},
+                {'$project': {'_id': 0, 'ipn': 1, 'stock': 1}},
+            ],
+            'as': 'generic',
+        }},
+        {'$addFields': {'matches': {'$concatArrays': ['$specific', '$generic']}}},
+        {'$addFields': {'line_stock': {'$sum': '$matches.stock'}}},
+        {'$addFields': {'line_buildable': {'$cond': [{'$gt': ['$parts.qty', 0]},
+                                                      {'$floor': {'$divide': ['$line_stock', '$parts.qty']}},
+                                                      None]}}},
+        {'$group': {
+            '_id': {'id': '$id', 'rev': '$rev'},
+            'buildable': {'$min': '$line_buildable'},
+            'lines': {'$push': {
+                'line': '$line', 'designator': '$parts.designator', 'qty': '$parts.qty',
+                'stock': '$line_stock', 'buildable': '$line_buildable', 'ipns': '$matches.ipn',
+            }},
+        }},
+        {'$project': {
+            '_id': 0, 'id': '$_id.id', 'rev': '$_id.rev', 'buildable': 1,
+            'limiting': {'$filter': {'input': '$lines', 'as': 'l', 'cond': {'$eq': ['$$l.buildable', '$buildable']}}},
+        }},
+        {'$sort': {'id': pymongo.ASCENDING, 'rev': pymongo.ASCENDING}},
+    ]
+
+
+@dataclasses.dataclass
+class InventoryGroupStats:
+    """ Dataclass for the statistics of a group of parts, see `E7EPD.inventory_stats` """
+    key: typing.Dict[str, typing.Any]       # The value of each grouped by key for this group
+    count: int
+    stock: int
+    zero_stock: int                         # The number of parts without any stock
+
+
+@dataclasses.dataclass
+class InventoryStats:
+    """ Dataclass for the statistics of all matched parts, see `E7EPD.inventory_stats` """
+    count: int = 0
+    stock: int = 0
+    zero_stock: int = 0
+    null_counts: typing.Dict[str, int] = dataclasses.field(default_factory=dict)  # Parts without a value per key
+    groups: typing.List[InventoryGroupStats] = dataclasses.field(default_factory=list)
+
+
+def make_stock_event(ipn: str, delta: int, stock: typing.Union[int, None] = None, user: str = None,
+                     reason: str = None, build_id: bson.ObjectId = None) -> dict:
+    """
+    Makes a document for the `stock_events` collection
+
+    Args:
+        ipn: The IPN of the part
+        delta: How much the stock changed by
+        stock: The stock after the change, if known
+        user: The user that changed the stock
+        reason: Why the stock was changed
+        build_id: The ID of the PCB build the stock was taken for, if any
+    """
+    d = {'ipn': ipn, 'delta': delta, 'stock': stock, 'user': user, 'reason': reason,
+         'ts': datetime.datetime.now(datetime.timezone.utc)}
+    if build_id is not None:
+        d['build_id'] = build_id
+    return d
+
+
+def _get_projection(keys: typing.Union[typing.List[str], dict, None]) -> typing.Union[dict, None]:
+    """ Converts a list of keys into a Mongo projection, leaving out the `_id` unless it's listed """
+    if keys is None or isinstance(keys, dict):
+        return keys
+    projection = {k: 1 for k in keys}
+    if '_id' not in projection:
+        projection['_id'] = 0
+    return projection
+
+
+def _get_page_filter(q: dict, last_ipn: typing.Union[str, None],
+                     last_id: typing.Union[bson.ObjectId, None]) -> dict:
+    """ Adds the start of the page to a filter, for parts sorted by `page_sort`. See `E7EPD.page_after` """
+    if last_ipn is None:
+        return q
+    if last_id is None:
+        after = {'ipn': {'$gt': last_ipn}}
+    else:
+        after = {'$or': [{'ipn': {'$gt': last_ipn}}, {'ipn': last_ipn, '_id': {'$gt': last_id}}]}
+    return {'$and': [q, after]} if len(q) != 0 else after
+
+
+def _stock_adjust_filter(ipn: str, delta: int) -> dict:
+    """ The filter for changing a part's stock by `delta`, which doesn't match if the stock would go negative """
+    q = {'ipn': ipn}
+    if delta < 0:
+        q['stock'] = {'$gte': -delta}
+    return q
+
+
+def _stock_adjust_update(delta: int) -> typing.List[dict]:
+    """ The update for changing a part's stock by `delta`. Unlike `$inc`, this works when the stock is None """
+    return [{'$set': {'stock': {'$add': [{'$ifNull': ['$stock', 0]}, delta]}}}]
+
+
+def _snapshot_stock_pipeline() -> typing.List[dict]:
+    """ The aggregation pipeline on the parts collection that saves a stock snapshot, see `E7EPD.snapshot_stock` """
+    return [
+        # Using `let` instead of `localField` with a pipeline, which needs MongoDB 5.0
+        {'$lookup': {'from': 'stock_events', 'let': {'ipn': '$ipn'}, 'as': 'after',
+                     'pipeline': [{'$match': {'$expr': {'$and': [{'$eq': ['$ipn', '$$ipn']},
+                                                                 {'$gt': ['$ts', '$$NOW']}]}}},
+                                  {'$project': {'_id': 0, 'delta': 1}}]}},
+        {'$project': {'_id': 0, 'ipn': 1, 'ts': '$$NOW',
+                      'stock': {'$subtract': [{'$ifNull': ['$stock', 0]}, {'$sum': '$after.delta'}]}}},
+        {'$merge': {'into': 'stock_snapshots', 'whenMatched': 'fail', 'whenNotMatched': 'insert'}},
+    ]
+
+
+def _prepare_bulk_part(part_class: typing.Union[spec.PartSpec, None], part: dict,
+                       validate: bool = True) -> dict:
+    """
+    Validates one of the parts given to `E7EPD.add_new_parts`, if `validate` is True
+
+    Returns: A copy of the part, with its `type` set to the database type name
+
+    Raises:
+        InputException: If the part's type is not given or unknown, or the part is not valid for its spec
+    """
+    new_part = dict(part)
+    if part_class is None:
+        if 'type' not in new_part:
+            raise InputException("No part type is given")
+        part_class = new_part['type']
+        if not isinstance(part_class, spec.PartSpec):
+            part_class = E7EPD.get_part_spec_by_db_name(part_class)
+    new_part.pop('type', None)
+    if validate:
+        SpecValidator.for_part(part_class).validate(new_part)
+    new_part['type'] = part_class.db_type_name
+    return new_part
+
+
+def _iter_bulk_batches(part_class: typing.Union[spec.PartSpec, None], parts: typing.Iterable[dict],
+                       ordered: bool, batch_size: int, validate: bool,
+                       result: BulkInsertResult) -> typing.Iterator[typing.List[typing.Tuple[int, dict]]]:
+    """
+    Prepares the parts given to `E7EPD.add_new_parts`, and groups them into batches of (row index, part) to insert.
+    Invalid parts are added to the result's errors. If `ordered`, the batch before the first invalid part is
+    the last one
+    """
+    batch = []      # type: typing.List[typing.Tuple[int, dict]]
+    for row_i, part in enumerate(parts):
+        try:
+            new_part = _prepare_bulk_part(part_class, part, validate)
+        except InputException as e:
+            result.errors.append(BulkRowError(row_i, part.get('ipn'), str(e)))
+            if ordered:
+                # Still add the parts before this one
+                if len(batch) != 0:
+                    yield batch
+                return
+            continue
+        batch.append((row_i, new_part))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if len(batch) != 0:
+        yield batch
+
+
+def _get_bulk_row_errors(batch: typing.List[typing.Tuple[int, dict]], details: dict) -> typing.List[BulkRowError]:
+    """ Maps the write errors of an `insert_many` back to the rows given to `E7EPD.add_new_parts` """
+    ret = []
+    for w in details['writeErrors']:
+        row_i, part = batch[w['index']]
+        if w['code'] == 11000:
+            msg = f"IPN {part.get('ipn')} already exists in the database"
+        elif w['code'] == 121:
+            msg = f"Part did not pass the database's validator: {w.get('errInfo', w['errmsg'])}"
+        else:
+            msg = w['errmsg']
+        ret.append(BulkRowError(row_i, part.get('ipn'), msg))
+    return ret
+
+
+def _get_inserted_parts(batch: typing.List[typing.Tuple[int, dict]], ordered: bool,
+                        details: dict) -> typing.List[dict]:
+    """ Gets the parts of a batch that did get inserted, from the details of an `insert_many` error """
+    failed = {w['index'] for w in details['writeErrors']}
+    if ordered and len(failed) != 0:
+        # Nothing after the first error was inserted
+        failed.update(range(min(failed), len(batch)))
+    return [p for i, (_, p) in enumerate(batch) if i not in failed]
+
+
+def _add_failed_batch(batch: typing.List[typing.Tuple[int, dict]], ordered: bool, details: dict,
+                      result: BulkInsertResult) -> typing.List[dict]:
+    """
+    Adds the outcome of a batch whose `insert_many` failed to the result
+
+    Returns: The parts of the batch that did get inserted
+    """
+    result.inserted += details['nInserted']
+    result.errors.extend(_get_bulk_row_errors(batch, details))
+    return _get_inserted_parts(batch, ordered, details)
+
+
+def _get_added_events(parts: typing.Iterable[dict], user: typing.Union[str, None]) -> typing.List[dict]:
+    """ Makes the stock events for newly added parts """
+    return [make_stock_event(p['ipn'], p.get('stock') or 0, p.get('stock'), user, 'added') for p in parts]
+
+
+def _prepare_part_update(part_class: typing.Union[spec.PartSpec, None], ipn: str,
+                         new_values: dict) -> dict:
+    """
+    Validates the new values given to `E7EPD.update_part`, if the part class is given
+
+    Returns: The filter for the part to update
+    """
+    if part_class is not None:
+        SpecValidator.for_part(part_class).validate_update(new_values)
+    q = {'ipn': ipn}
+    if part_class is not None:
+        q['type'] = part_class.db_type_name
+    return q
+
+
+def _get_update_events(old: typing.Union[dict, None], ipn: str, new_values: dict, user: typing.Union[str, None],
+                       reason: typing.Union[str, None]) -> typing.List[dict]:
+    """ Makes the stock event for `E7EPD.update_part`, if the part was found and its stock changed """
+    if old is None or 'stock' not in new_values or new_values['stock'] == old.get('stock'):
+        return []
+    delta = (new_values['stock'] or 0) - (old.get('stock') or 0)
+    return [make_stock_event(new_values.get('ipn', ipn), delta, new_values['stock'], user, reason)]
+
+
+def _get_stock_changes(deltas: typing.Dict[str, int],
+                       found: typing.Iterable[dict]) -> typing.Dict[str, typing.Tuple[int, int]]:
+    """
+    Gets which parts `E7EPD.bulk_adjust_stock` changes, which are the found parts that have enough stock
+
+    Returns: A dict of IPN to its delta and new stock
+    """
+    stocks = {d['ipn']: d.get('stock') or 0 for d in found}
+    return {ipn: (delta, stocks[ipn] + delta) for ipn, delta in deltas.items()
+            if ipn in stocks and stocks[ipn] + delta >= 0}
+
+
+def _get_stock_change_ops(changes: typing.Dict[str, typing.Tuple[int, int]]) -> typing.List[pymongo.UpdateOne]:
+    """ The bulk write for the changes from `_get_stock_changes` """
+    return [pymongo.UpdateOne(_stock_adjust_filter(ipn, delta), _stock_adjust_update(delta))
+            for ipn, (delta, _) in changes.items()]
+
+
+def _get_stock_change_events(changes: typing.Dict[str, typing.Tuple[int, int]], user: typing.Union[str, None],
+                             reason: typing.Union[str, None]) -> typing.List[dict]:
+    """ Makes the stock events for the changes from `_get_stock_changes` """
+    return [make_stock_event(ipn, delta, stock, user, reason) for ipn, (delta, stock) in changes.items()]
+
+
+def _get_pcb_part_filter(part: dict) -> typing.List[SpecWithOperator]:
+    """ Converts a generic PCB part, as a dict of key to its value and operator, into a list of filters """
+    spec_search = []
+    for k in part:
+        if part[k]['val'] is None:
+            continue
+        spec_search.append(SpecWithOperator(key=k, val=part[k]['val'],
+                                            operator=ComparisonOperators(part[k]['op'])))
+    return spec_search
+
+
+def _compile_bom(pcb: dict) -> CompiledBOM:
+    """ Compiles the queries to find the parts of every line in a PCB's BOM, see `E7EPD.resolve_bom` """
+    c = CompiledBOM()
+    # The lines are grouped by their collation, as a collation applies to a whole aggregation
+    groups = {}         # type: typing.Dict[str, typing.Tuple[typing.Union[pymongo.collation.Collation, None], typing.List[dict], dict]]
+    facet_by_filter = {}
+    for line_i, line in enumerate(pcb['parts']):
+        part = line['part']
+        if 'ipn' in part:
+            c.specific_lines[line_i] = part['ipn']
+            if part['ipn'] not in c.ipns:
+                c.ipns.append(part['ipn'])
+            continue
+        q = compile_query(E7EPD.get_part_spec_by_db_name(line['type']), _get_pcb_part_filter(part))
+        collation_k = None if q.collation is None else repr(sorted(q.collation.document.items()))
+        # Lines for the same part share a facet
+        k = repr((q.filter, collation_k))
+        if k not in facet_by_filter:
+            facet_by_filter[k] = f"l{line_i}"
+            _, or_filters, facets = groups.setdefault(collation_k, (q.collation, [], {}))
+            # One more than the limit, to know when a line has too many parts
+            facets[facet_by_filter[k]] = [{'$match': q.filter}, {'$limit': bom_facet_limit + 1},
+                                          {'$project': bom_part_projection}]
+            or_filters.append(q.filter)
+            c.facet_queries[facet_by_filter[k]] = q
+        c.generic_lines[line_i] = facet_by_filter[k]
+    for collation, or_filters, facets in groups.values():
+        # Only the keys that are returned or matched by a line go into the facets
+        projection = {**bom_part_projection, **{k: 1 for f in or_filters for k in f}}
+        c.pipelines.append(([
+            {'$match': {'$or': or_filters}},
+            {'$sort': {'ipn': pymongo.ASCENDING}},
+            {'$project': projection},
+            {'$facet': facets},
+        ], collation))
+    return c
+
+
+def _assemble_bom(pcb: dict, c: CompiledBOM, parts_by_ipn: typing.Dict[str, dict],
+                  facets: typing.Dict[str, typing.List[dict]]) -> typing.List[typing.List[dict]]:
+    """ Splits the results of the queries from `_compile_bom` back into each BOM line """
+    ret = []
+    for line_i in range(len(pcb['parts'])):
+        if line_i in c.specific_lines:
+            p = parts_by_ipn.get(c.specific_lines[line_i])
+            ret.append([] if p is None else [copy.deepcopy(p)])
+        else:
+            ret.append(copy.deepcopy(facets[c.generic_lines[line_i]]))
+    return ret
+
+
+def _to_buildable_report(d: dict) -> BuildableReport:
+    """ Converts a document from the buildable pipeline into a report """
+    buildable = d['buildable']
+    return BuildableReport(d['id'], d['rev'], None if buildable is None else int(buildable),
+                           [BOMLineStock(line=i['line'], designator=i['designator'], qty=i['qty'],
+                                         stock=i['stock'], buildable=int(i['buildable']), ipns=i['ipns'])
+                            for i in d['limiting'] if i['buildable'] is not None])
+
+
+def _plan_kit(pcb: dict, all_matches: typing.List[typing.List[dict]], count: int,
+              allocation: typing.Union[typing.Dict[int, str], None]) -> KitPlan:
+    """
+    Plans which parts to take from the stock, from the parts matching each line of the PCB's BOM. See `E7EPD.plan_kit`
+
+    Raises:
+        InputException: If an allocated IPN doesn't match its BOM line
+    """
+    if allocation is None:
+        allocation = {}
+    plan = KitPlan(pcb['id'], pcb['rev'], count)
+    remaining = {p['ipn']: p.get('stock') or 0 for matches in all_matches for p in matches}
+    for line_i, (line, matches) in enumerate(zip(pcb['parts'], all_matches)):
+        kit_line = KitLine(line_i, line['designator'], line['qty'] * count)
+        if line_i in allocation:
+            matches = [p for p in matches if p['ipn'] == allocation[line_i]]
+            if len(matches) == 0:
+                raise InputException(f"IPN {allocation[line_i]} does not match line {line['designator']}")
+        # Take from the parts with the most stock first, to take from as few different parts as possible
+        left = kit_line.needed
+        for p in sorted(matches, key=lambda x: remaining[x['ipn']], reverse=True):
+            n = min(left, remaining[p['ipn']])
+            if n <= 0:
+                continue
+            kit_line.take[p['ipn']] = n
+            remaining[p['ipn']] -= n
+            left -= n
+        kit_line.shortfall = left
+        plan.lines.append(kit_line)
+    return plan
+
+
+def _get_kit_writes(plan: KitPlan, build_id: bson.ObjectId, user: typing.Union[str, None]) -> \
+        typing.Tuple[typing.List[pymongo.UpdateOne], typing.List[dict], dict, dict]:
+    """
+    Gets the writes of `E7EPD.kit_build`
+
+    Returns: The bulk write taking the parts' stock, their stock events, and the PCB's filter and update
+    """
+    totals = plan.get_totals()
+    reason = f"Built {plan.count} of {plan.pcb_id} rev {plan.rev}"
+    ops = [pymongo.UpdateOne(_stock_adjust_filter(ipn, -n), _stock_adjust_update(-n))
+           for ipn, n in totals.items()]
+    events = [make_stock_event(ipn, -n, None, user, reason, build_id) for ipn, n in totals.items()]
+    return ops, events, {'id': plan.pcb_id, 'rev': plan.rev}, {'$inc': {'stock': plan.count}}
+
+
+def _compile_inventory_stats(group_by: typing.Sequence[str], part_class: typing.Union[spec.PartSpec, None],
+                             to_filter: typing.Union[typing.List[SpecWithOperator], None]) -> \
+        typing.Tuple[typing.List[dict], typing.Union[pymongo.collation.Collation, None]]:
+    """
+    Compiles the aggregation of `E7EPD.inventory_stats`
+
+    Returns: The pipeline, and its collation
+
+    Raises:
+        InputException: If a group by key is not part of the spec
+    """
+    spec_items = part_class.items if part_class is not None else spec.BasePartItems
+    for k in group_by:
+        if k != 'type' and k not in spec_items:
+            raise InputException(f"Group by key of {k} is not part of the part class's spec")
+    q = compile_query(part_class, to_filter)
+    counters = {
+        'count': {'$sum': 1},
+        'stock': {'$sum': '$stock'},
+        'zero_stock': {'$sum': {'$cond': [{'$gt': ['$stock', 0]}, 0, 1]}},
+    }
+    null_counters = {f"null_{i}": {'$sum': {'$cond': [{'$eq': [{'$ifNull': [f"${k}", None]}, None]}, 1, 0]}}
+                     for i, k in enumerate(spec_items)}
+    pipeline = [
+        {'$match': q.filter},
+        {'$facet': {
+            'totals': [{'$group': {'_id': None, **counters, **null_counters}}],
+            'groups': [
+                {'$group': {'_id': {f"k{i}": f"${k}" for i, k in enumerate(group_by)}, **counters}},
+                {'$sort': {'count': pymongo.DESCENDING}},
+            ],
+        }},
+    ]
+    return pipeline, q.collation
+
+
+def _to_inventory_stats(d: dict, group_by: typing.Sequence[str],
+                        part_class: typing.Union[spec.PartSpec, None]) -> InventoryStats:
+    """ Converts the document from the `E7EPD.inventory_stats` aggregation into the statistics """
+    spec_items = part_class.items if part_class is not None else spec.BasePartItems
+    ret = InventoryStats()
+    if len(d['totals']) == 0:
+        return ret
+    t = d['totals'][0]
+    ret.count, ret.stock, ret.zero_stock = t['count'], t['stock'], t['zero_stock']
+    ret.null_counts = {k: t[f"null_{i}"] for i, k in enumerate(spec_items)}
+    for g in d['groups']:
+        ret.groups.append(InventoryGroupStats(key={k: g['_id'].get(f"k{i}") for i, k in enumerate(group_by)},
+                                              count=g['count'], stock=g['stock'], zero_stock=g['zero_stock']))
+    return ret
+
+
+def _get_validators(part_classes: typing.Iterable[spec.PartSpec]) -> typing.Dict[str, dict]:
+    """
+    Gets the collection options with the `$jsonSchema` validators of the parts and PCBs, see `E7EPD.install_validators`
+    """
+    return {
+        'parts': {'validator': make_parts_json_schema(part_classes), 'validationLevel': 'moderate'},
+        'pcbs': {'validator': make_pcbs_json_schema(), 'validationLevel': 'moderate'},
+    }
+
+
+class E7EPDIndexManager:
+    """
+    Handles the indexes for the parts, pcbs, user and config collections.
+
+    Other than the unique lookup indexes, a partial index (filtered by `type`) is made for each part spec's required
+    numerical value, like the resistance for resistors.
+    """
+    def __init__(self, db_conn: pymongo.database.Database, comp_types: typing.List[spec.PartSpec]):
+        self.log = logging.getLogger('indexes')
+        self.db = db_conn
+        self.definitions = self.get_index_definitions(comp_types)
+
+    @staticmethod
+    def get_index_definitions(comp_types: typing.List[spec.PartSpec]) -> typing.List[IndexDefinition]:
+        """
+        Gets all index definitions for the database
+
+        Args:
+            comp_types: The list of part specs, used to create the per-type indexes
+        """
+        ret = [
+            IndexDefinition('parts', 'ipn_unique', [('ipn', pymongo.ASCENDING)], unique=True),
+            IndexDefinition('parts', 'type_ipn', [('type', pymongo.ASCENDING), ('ipn', pymongo.ASCENDING)]),
+            IndexDefinition('pcbs', 'id_rev_unique', [('id', pymongo.ASCENDING), ('rev', pymongo.ASCENDING)], unique=True),
+            IndexDefinition('user', 'name_unique', [('name', pymongo.ASCENDING)], unique=True),
+            IndexDefinition('config', 'key_unique', [('key', pymongo.ASCENDING)], unique=True),
+            IndexDefinition('stock_events', 'ipn_ts', [('ipn', pymongo.ASCENDING), ('ts', pymongo.ASCENDING)]),
+            IndexDefinition('stock_events', 'build_id', [('build_id', pymongo.ASCENDING)],
+                            partial_filter={'build_id': {'$exists': True}}),
+            IndexDefinition('stock_snapshots', 'ipn_ts', [('ipn', pymongo.ASCENDING), ('ts', pymongo.ASCENDING)]),
+        ]
+        for k in case_insensitive_index_keys:
+            ret.append(IndexDefinition('parts', f"ci_type_{k}", [('type', pymongo.ASCENDING), (k, pymongo.ASCENDING)],
+                                       collation=case_insensitive_collation))
+        # A single text index over all string keys of all part types. There is no language, so part numbers
+        # don't get stemmed and no word is ignored
+        text_keys = []
+        for items in [spec.BasePartItems] + [c.items for c in comp_types]:
+            for k, v in items.items():
+                if v.input_type is str and k not in text_keys:
+                    text_keys.append(k)
+        ret.append(IndexDefinition('parts', 'text', [(k, pymongo.TEXT) for k in text_keys],
+                                   weights={k: text_index_weights.get(k, 1) for k in text_keys},
+                                   options={'default_language': 'none'}))
+        for c in comp_types:
+            # Misc parts don't have a type to filter by
+            if c.db_type_name is None:
+                continue
+            for k, v in c.items.items():
+                if k in spec.BasePartItems or not v.required or v.input_type not in [int, float]:
+                    continue
+                ret.append(IndexDefinition('parts', f"{c.db_type_name}_{k}", [(k, pymongo.ASCENDING)],
+                                           partial_filter={'type': c.db_type_name}))
+        return ret
+
+    @staticmethod
+    def get_collections(definitions: typing.List[IndexDefinition]) -> typing.List[str]:
+        """ Gets the names of the collections that have an index definition """
+        return list(dict.fromkeys(i.collection for i in definitions))
+
+    @staticmethod
+    def get_missing(definitions: typing.List[IndexDefinition], existing: typing.Dict[str, typing.List[str]],
+                    report: IndexReport) -> typing.List[IndexDefinition]:
+        """
+        Adds the indexes that already exist to a report
+
+        Args:
+            definitions: The index definitions
+            existing: A dict of collection name to the list of index names in it
+            report: The report to add the existing indexes to
+
+        Returns: The definitions of the missing indexes
+        """
+        ret = []
+        for i in definitions:
+            if i.name in existing[i.collection]:
+                report.existing.append(i.full_name)
+            else:
+                ret.append(i)
+        return ret
+
+    @staticmethod
+    def add_build_result(log: logging.Logger, report: IndexReport, definition: IndexDefinition,
+                         error: typing.Union[pymongo.errors.OperationFailure, None]):
+        """ Logs and adds to a report whether an index got built """
+        if error is not None:
+            # Most likely due to duplicate entries for a unique index
+            log.error(f"Unable to build index {definition.full_name}", exc_info=error)
+            report.failed.append(definition.full_name)
+        else:
+            log.info(f"Built index {definition.full_name}")
+            report.built.append(definition.full_name)
+
+    @staticmethod
+    def log_report(log: logging.Logger, report: IndexReport):
+        """ Logs a summary of the report from `ensure_indexes`, with the indexes that were skipped as they exist """
+        log.info(f"Indexes: {len(report.built)} built, {len(report.existing)} already existed, "
+                 f"{len(report.failed)} failed")
+        if len(report.existing) != 0:
+            log.debug(f"Skipped the existing indexes {', '.join(report.existing)}")
+
+    def _get_existing_indexes(self) -> typing.Dict[str, typing.List[str]]:
+        """ Returns a dict of collection name to the list of index names in it """
+        return {c: [d['name'] for d in self.db[c].list_indexes()] for c in self.get_collections(self.definitions)}
+
+    def ensure_indexes(self) -> IndexReport:
+        """
+        Creates any missing index. This is safe to call multiple times, as existing indexes (by name) are skipped
+
+        Returns: A report of what was built, what already existed, and what failed to build
+        """
+        report = IndexReport()
+        for i in self.get_missing(self.definitions, self._get_existing_indexes(), report):
+            try:
+                self.db[i.collection].create_index(i.keys, **i.create_kwargs())
+            except pymongo.errors.OperationFailure as e:
+                self.add_build_result(self.log, report, i, e)
+            else:
+                self.add_build_result(self.log, report, i, None)
+        return report
+
+    def check_indexes(self) -> IndexReport:
+        """
+        Checks for any missing index, and for any index that has not been used.
+
+        .. note::
+            The usage count comes from `$indexStats`, which gets reset when the server restarts
+
+        Returns: A report with the missing, existing and unused indexes
+        """
+        report = IndexReport()
+        existing = self._get_existing_indexes()
+        report.missing = [i.full_name for i in self.get_missing(self.definitions, existing, report)]
+        for coll in existing:
+            try:
+                stats = list(self.db[coll].aggregate([{'$indexStats': {}}]))
+            except pymongo.errors.OperationFailure:
+                self.log.exception(f"Unable to get the index stats for {coll}")
+                continue
+            for s in stats:
+                if s['name'] != '_id_' and s['accesses']['ops'] == 0:
+                    report.unused.append(f"{coll}.{s['name']}")
+        return report
+
 
 class E7EPDConfigTable:
     """
@@ -122,7 +1196,15 @@ class E7EPD:
         spec.Others
     ]
 
-    def __init__(self, db_client: pymongo.database.Database):
+    def __init__(self, db_client: pymongo.database.Database, ensure_indexes: bool = True,
+                 cache: typing.Union[PartCache, None] = None):
+        """
+        Args:
+            db_client: The Mongo database to use
+            ensure_indexes: Whether to create any missing index on startup
+            cache: An optional cache for parts lookups. If the database is a replica set, the cache is invalidated
+                   by a change stream, otherwise its entries expire after a while
+        """
         self.log = logging.getLogger('E7EPD')
 
         self.db = db_client
@@ -133,10 +1215,137 @@ class E7EPD:
         self.part_coll = self.db['parts']
         self.pcb_coll = self.db['pcbs']
         self.users_coll = self.db['user']
+        # Every change to a part's stock, and the periodic snapshots of all parts' stock
+        self.events_coll = self.db['stock_events']
+        self.snapshots_coll = self.db['stock_snapshots']
+
+        # The user that's put in the stock events, if not given when changing the stock
+        self.user = None        # type: typing.Union[str, None]
+
+        self.indexes = E7EPDIndexManager(self.db, self.comp_types)
+        self.index_report = None        # type: typing.Union[IndexReport, None]
+        if ensure_indexes:
+            self.index_report = self.indexes.ensure_indexes()
+            self.indexes.log_report(self.log, self.index_report)
 
-        # If the DB version is None (if the config table was just created), then populate the current version
+        # If the DB version is None (if the config table was just created), then set it up at the current version
         if self.config.get_db_version() is None:
-            self.config.store_current_db_version()
+            self.update_database()
+
+        self._is_replica_set = None     # type: typing.Union[bool, None]
+        self._ipn_index = None          # type: typing.Union[IPNIndex, None]
+        self._part_number_index = None  # type: typing.Union[PartNumberIndex, None]
+        self.cache = cache
+        if self.cache is not None and self.is_replica_set():
+            self.cache.start_change_stream(self.part_coll)
+
+    def is_replica_set(self) -> bool:
+        """
+        Returns whether the database is part of a replica set (or a sharded cluster), which is needed for change
+        streams and transactions
+        """
+        if self._is_replica_set is None:
+            r = self.db.client.admin.command('hello')
+            self._is_replica_set = 'setName' in r or r.get('msg') == 'isdbgrid'
+        return self._is_replica_set
+
+    def _cached(self, key: tuple, func: typing.Callable[[], typing.Any]) -> typing.Any:
+        """ Gets a value from the cache if enabled, otherwise from the given function """
+        if self.cache is None:
+            return func()
+        found, value = self.cache.get(key)
+        if found:
+            return value
+        generation = self.cache.generation
+        value = func()
+        self.cache.put(key, value, generation)
+        return value
+
+    def get_ipn_index(self) -> IPNIndex:
+        """
+        Gets an in-memory index of all IPNs and their type, for autocompletion. This is built on the first call, then
+        kept up to date with any part added, deleted or edited through this object
+        """
+        if self._ipn_index is None:
+            self._ipn_index = IPNIndex(self.part_coll.find({}, {'_id': 0, 'ipn': 1, 'type': 1}))
+        return self._ipn_index
+
+    def get_part_number_index(self) -> PartNumberIndex:
+        """
+        Gets an in-memory trigram index of all IPNs and manufacturer part numbers, for finding similar parts. Like
+        :meth:`get_ipn_index`, this is built on the first call then kept up to date
+        """
+        if self._part_number_index is None:
+            self._part_number_index = PartNumberIndex(self.part_coll.find({}, {'_id': 0, 'ipn': 1,
+                                                                               'mfg_part_numb': 1}))
+        return self._part_number_index
+
+    def find_similar_parts(self, pn: typing.Union[str, None], k: int = 5,
+                           min_similarity: float = 0.3) -> typing.List[SimilarPart]:
+        """
+        Finds the parts with an IPN or manufacturer part number similar to a part number, ignoring case, punctuation
+        and packaging suffixes like ``-TR``. Meant for warning about near duplicates before adding a part
+
+        Args:
+            pn: The part number to look for
+            k: The maximum number of parts to return
+            min_similarity: The minimum similarity, from 0 to 1, for a part to be returned
+
+        Returns: The most similar parts, most similar first. Empty if the part number is empty or None
+        """
+        if not pn:
+            return []
+        return self.get_part_number_index().find(pn, k, min_similarity)
+
+    def _add_to_lookup_indexes(self, part: dict):
+        """ Adds a new part to the in-memory lookup indexes that were already built """
+        if self._ipn_index is not None:
+            self._ipn_index.add(part['ipn'], part['type'])
+        if self._part_number_index is not None:
+            self._part_number_index.add(part['ipn'], part.get('mfg_part_numb'))
+
+    def _remove_from_lookup_indexes(self, ipn: str):
+        """ Removes a part from the in-memory lookup indexes that were already built """
+        if self._ipn_index is not None:
+            self._ipn_index.remove(ipn)
+        if self._part_number_index is not None:
+            self._part_number_index.remove(ipn)
+
+    def _reset_lookup_indexes(self):
+        """ Makes the in-memory lookup indexes get re-built when next needed """
+        self._ipn_index = None
+        self._part_number_index = None
+
+    def _invalidate_part(self, ipn: str = None):
+        """ Invalidates a part in the cache, if enabled. If the IPN is not given, all parts are invalidated """
+        if self.cache is None:
+            return
+        if ipn is None:
+            self.cache.clear()
+        else:
+            self.cache.invalidate_part(ipn)
+
+    def _run_stock_change(self, func: typing.Callable[[typing.Any], typing.Any]) -> typing.Any:
+        """
+        Runs a stock change, which gets a session to pass to the database calls. On a replica set this is a
+        transaction, so the change and its stock events are written together. Otherwise, the session is None
+        """
+        if self.is_replica_set():
+            with self.db.client.start_session() as s:
+                return s.with_transaction(func)
+        return func(None)
+
+    def _get_user(self, user: typing.Union[str, None]) -> typing.Union[str, None]:
+        """ The user for a stock event, which defaults to the `user` attribute """
+        return user if user is not None else self.user
+
+    def _make_stock_event(self, ipn: str, delta: int, stock: typing.Union[int, None] = None, user: str = None,
+                          reason: str = None) -> dict:
+        return make_stock_event(ipn, delta, stock, self._get_user(user), reason)
+
+    def _log_stock_events(self, events: typing.List[dict], session=None):
+        if len(events) != 0:
+            self.events_coll.insert_many(events, ordered=False, session=session)
 
     def get_autocomplete_list(self, part_spec: spec.PartSpec, item_key: str) -> typing.Union[None, list]:
         """
@@ -176,7 +1385,7 @@ class E7EPD:
         # elif db_name == 'package' and (table_name == 'resistor' or table_name == 'capacitor' or table_name == 'inductor'):
         #     autocomplete_choices = autofill_helpers['passive_packages']
         if item_key == 'ipn':
-            autocomplete_choices = self.get_all_parts_by_keys(part_spec, 'ipn')
+            autocomplete_choices = self.get_ipn_index().ipns(part_spec)
         elif item_key == 'package' and (part_spec in [spec.Resistor]):
             autocomplete_choices = autofill_helpers['passive_packages']
 
@@ -194,20 +1403,7 @@ class E7EPD:
                             See specific exception message as to what
 
         """
-        # Validate that all given keys are part of the spec, and the type matches
-        for d in pcb_data:
-            if d not in spec.PCBItems.keys():
-                raise InputException(f"Given key of {d} is not part of the spec")
-            if type(pcb_data[d]) not in [type(None), spec.PCBItems[d].input_type]:
-                raise InputException(f"Input value of {pcb_data[d]} for {d} is not of "
-                                     f"type {spec.PCBItems[d].input_type}. Instead is {type(pcb_data[d])}")
-        # todo: add verification of parts
-        # Check if all required keys are matched
-        for d in spec.PCBItems:
-            self._check_spec_required(d, spec.PCBItems[d], pcb_data)
-            # if spec.PCBItems[d].required:
-            #     if d not in pcb_data:
-            #         raise InputException(f"Required key of {d} is not found in the new part dict")
+        self._validate_new_pcb(pcb_data)
         # Check for any duplicates
         if self.pcb_coll.count_documents({'id': pcb_data['id'], 'rev': pcb_data['rev']}) != 0:
             raise InputException("PCB ID already exists in the database")
@@ -233,15 +1429,145 @@ class E7EPD:
             if p is not None:
                 return [p]
         else:
-            spec_search = []
-            for k in part:
-                if part[k]['val'] is None:
-                    continue
-                spec_search.append(SpecWithOperator(key=k, val=part[k]['val'],
-                                                    operator=ComparisonOperators(part[k]['op'])))
-            return self.get_parts(self.get_part_spec_by_db_name(part_type), spec_search)
+            return self.get_parts(self.get_part_spec_by_db_name(part_type), _get_pcb_part_filter(part))
         return []
 
+    def resolve_bom(self, pcb: dict) -> typing.List[typing.List[dict]]:
+        """
+        Finds the parts for every line of a PCB's BOM, like calling `find_pcb_part` for each line but in a few
+        database requests instead of one per line: one for the specific lines, and usually one for the generic lines.
+        Only a generic line matching more than `bom_facet_limit` parts gets its own request
+
+        Args:
+            pcb: The PCB, as returned by `get_pcb`
+
+        Returns: A list with the matching parts for each line of the PCB's parts, in the same order. Each part only
+                 has the keys in `bom_part_keys`
+        """
+        c = _compile_bom(pcb)
+        parts_by_ipn = {}
+        if len(c.ipns) != 0:
+            parts_by_ipn = {p['ipn']: p for p in self.part_coll.find({'ipn': {'$in': c.ipns}}, bom_part_projection)}
+        facets = {}
+        for pipeline, collation in c.pipelines:
+            facets.update(next(self.part_coll.aggregate(pipeline, collation=collation)))
+        for k in c.get_truncated_facets(facets):
+            q = c.facet_queries[k]
+            facets[k] = list(self.part_coll.find(q.filter, bom_part_projection, collation=q.collation)
+                             .sort('ipn', pymongo.ASCENDING))
+        return _assemble_bom(pcb, c, parts_by_ipn, facets)
+
+    def buildable_quantity(self, pcb_id: str, rev: str) -> BuildableReport:
+        """
+        Calculates how many of a PCB can be built with the current stock. This is done by the database, joining each
+        line of the PCB's BOM with its parts. A generic line can use the stock of all parts that match it
+
+        Args:
+            pcb_id: The PCB's ID
+            rev: The PCB's revision
+
+        Returns: How many PCBs can be built, and the BOM lines limiting it. If the PCB doesn't have any parts,
+                 the buildable quantity is None
+
+        Raises:
+            EmptyInDatabase: If the PCB is not in the database
+        """
+        r = list(self.pcb_coll.aggregate(_get_buildable_pipeline({'id': pcb_id, 'rev': rev})))
+        if len(r) == 0:
+            if self.pcb_coll.count_documents({'id': pcb_id, 'rev': rev}) == 0:
+                raise EmptyInDatabase()
+            return BuildableReport(pcb_id, rev, None)
+        return _to_buildable_report(r[0])
+
+    def buildable_report(self) -> typing.List[BuildableReport]:
+        """
+        Calculates how many of each PCB can be built with the current stock, in a single database request.
+        See `buildable_quantity`
+
+        Returns: The report for each PCB that has parts, sorted by ID then revision
+        """
+        return [_to_buildable_report(d) for d in self.pcb_coll.aggregate(_get_buildable_pipeline({}))]
+
+    def plan_kit(self, pcb_id: str, rev: str, count: int,
+                 allocation: typing.Dict[int, str] = None) -> KitPlan:
+        """
+        Plans which parts to take from the stock to build some PCBs, without changing anything. See `kit_build`
+
+        Raises:
+            EmptyInDatabase: If the PCB is not in the database
+            InputException: If the count is not positive, or an allocated IPN doesn't match its BOM line
+        """
+        if count <= 0:
+            raise InputException("The number of PCBs to build must be positive")
+        pcb = self.get_pcb(pcb_id, rev)
+        if pcb is None:
+            raise EmptyInDatabase()
+        return _plan_kit(pcb, self.resolve_bom(pcb), count, allocation)
+
+    def kit_build(self, pcb_id: str, rev: str, count: int, allocation: typing.Dict[int, str] = None,
+                  dry_run: bool = False, user: str = None) -> KitPlan:
+        """
+        Builds some PCBs, by taking all of their parts from the stock and adding to the PCB's stock in one go.
+
+        On a replica set this is done in a single transaction. Otherwise, the parts are taken one at a time, and
+        given back if one of them doesn't have enough stock anymore.
+
+        Args:
+            pcb_id: The PCB's ID
+            rev: The PCB's revision
+            count: How many PCBs to build
+            allocation: Optionally, which IPN to use for a BOM line, as a dict of the line's index to the IPN. Lines
+                        that are not given take from the matching parts with the most stock first
+            dry_run: If True, only return the plan without changing anything, even if there isn't enough stock
+            user: The user for the stock events. Defaults to the `user` attribute
+
+        Returns: The plan of which parts were taken from the stock, with the build ID used in the stock events
+
+        Raises:
+            KitShortfall: If there isn't enough stock for any line. Nothing is taken from the stock
+            EmptyInDatabase: If the PCB is not in the database
+            InputException: If the count is not positive, or an allocated IPN doesn't match its BOM line
+        """
+        plan = self.plan_kit(pcb_id, rev, count, allocation)
+        if dry_run:
+            return plan
+        if not plan.is_buildable:
+            raise KitShortfall(plan)
+        build_id = bson.ObjectId()
+        ops, events, pcb_q, pcb_update = _get_kit_writes(plan, build_id, self._get_user(user))
+        self.log.debug(f"Building {count} of {pcb_q}, taking {plan.get_totals()}")
+        try:
+            if self.is_replica_set():
+                def build(session):
+                    if len(ops) != 0:
+                        r = self.part_coll.bulk_write(ops, ordered=False, session=session)
+                        if r.matched_count != len(ops):
+                            # The stock was changed since the plan was made. Raising aborts the transaction
+                            raise KitShortfall(plan)
+                    self._log_stock_events(events, session)
+                    self.pcb_coll.update_one(pcb_q, pcb_update, session=session)
+
+                with self.db.client.start_session() as s:
+                    s.with_transaction(build)
+            else:
+                done = []
+                for ipn, n in plan.get_totals().items():
+                    r = self.part_coll.update_one(_stock_adjust_filter(ipn, -n), _stock_adjust_update(-n))
+                    if r.matched_count != 1:
+                        for done_ipn, done_n in done:
+                            self.part_coll.update_one({'ipn': done_ipn}, _stock_adjust_update(done_n))
+                        raise KitShortfall(plan)
+                    done.append((ipn, n))
+                self._log_stock_events(events)
+                self.pcb_coll.update_one(pcb_q, pcb_update)
+        except KitShortfall:
+            # Give a plan with the current stock
+            raise KitShortfall(self.plan_kit(pcb_id, rev, count, allocation))
+        finally:
+            self._invalidate_part()
+        plan.build_id = build_id
+        return plan
+
     def add_user(self, u: spec.UserSpec):
         # Do a check to ensure the same name does not exist
         co = self.users_coll.count_documents({'name': u.name})
@@ -261,7 +1587,8 @@ class E7EPD:
         """
         Call this when exiting your program
         """
-        pass
+        if self.cache is not None:
+            self.cache.close()
 
     def check_if_already_in_db_by_ipn(self, ipn: str) -> bool:
         """
@@ -291,8 +1618,7 @@ class E7EPD:
 
         Returns: The part's info
         """
-        d = self.part_coll.find_one({'ipn': ipn})
-        return d
+        return self._cached(('ipn', ipn), lambda: self.part_coll.find_one({'ipn': ipn}))
 
     def get_number_of_parts_in_db(self, part_class: spec.PartSpec) -> int:
         """
@@ -302,8 +1628,8 @@ class E7EPD:
 
         Returns: The number of documents in the database
         """
-        d = self.part_coll.count_documents({'type': part_class.db_type_name})
-        return d
+        return self._cached(('query', 'count', part_class.db_type_name),
+                            lambda: self.part_coll.count_documents({'type': part_class.db_type_name}))
 
     def get_parts(self, part_class: spec.PartSpec,
                   to_filter: typing.List[SpecWithOperator] = None) -> typing.List[dict]:
@@ -315,44 +1641,190 @@ class E7EPD:
 
         Returns: A dist of all part's data of the specific type
         """
-        q = {}
-        if part_class is not None:
-            q['type'] = part_class.db_type_name
-        # Go through parts to filter
-        if to_filter:
-            for f in to_filter:
-                if f.operator != ComparisonOperators.equal and type(f.val) is str:
-                    raise InputException("Gave some comparison operator while input is a string")
-                if f.key not in part_class.items:
-                    raise InputException(f"Input key of {f.key} is not part of the part class's spec")
+        key = ('query', 'parts', repr(compile_query(part_class, to_filter)))
+        return self._cached(key, lambda: list(self.iter_parts(part_class, to_filter)))
+
+    def iter_parts(self, part_class: typing.Union[spec.PartSpec, None],
+                   to_filter: typing.List[SpecWithOperator] = None,
+                   sort: typing.Union[str, typing.List[typing.Tuple[str, int]], None] = None,
+                   batch_size: int = None, limit: int = None, skip: int = None,
+                   projection: typing.Union[typing.List[str], dict, None] = None) -> typing.Iterator[dict]:
+        """
+        Iterates through parts in the database, optionally filtering by the part type. Unlike `get_parts`, the parts
+        are only fetched from the database as they are iterated over, in batches
 
-                if type(f.val) is str:
-                    q[f.key] = {'$regex': f.val, '$options': 'i'}
-                else:
-                    q[f.key] = {operator_to_mongo_comp[f.operator]: f.val}
+        Args:
+            part_class: The part spec class, which is used to determine the type
+            to_filter: Optional list of `SpecWithOperator` to filter by
+            sort: Optional key or list of (key, direction) to sort by
+            batch_size: How many parts to get from the database at once
+            limit: The maximum number of parts to return
+            skip: How many parts to skip over first
+            projection: Optionally only get these keys from the database, either as a list of keys (where `_id` is
+                        left out unless listed) or as a Mongo projection
+
+        Yields: Each part's data
+        """
+        q = compile_query(part_class, to_filter)
+        self.log.debug(f"Getting parts with {q}")
+        cursor = self.part_coll.find(q.filter, _get_projection(projection), collation=q.collation)
+        if sort is not None:
+            cursor = cursor.sort(sort)
+        if batch_size is not None:
+            cursor = cursor.batch_size(batch_size)
+        if skip is not None:
+            cursor = cursor.skip(skip)
+        if limit is not None:
+            cursor = cursor.limit(limit)
+        try:
+            yield from cursor
+        finally:
+            cursor.close()
+
+    def page_after(self, part_class: typing.Union[spec.PartSpec, None], last_ipn: typing.Union[str, None] = None,
+                   page_size: int = 50, to_filter: typing.List[SpecWithOperator] = None,
+                   last_id: typing.Union[bson.ObjectId, None] = None) -> typing.List[dict]:
+        """
+        Gets a page of parts sorted by IPN, then by `_id`. As the page starts after the last part instead of skipping
+        parts, getting any page is as fast as getting the first one
+
+        Args:
+            part_class: The part spec class, which is used to determine the type
+            last_ipn: The last IPN of the previous page, or None for the first page
+            page_size: The number of parts per page
+            to_filter: Optional list of `SpecWithOperator` to filter by
+            last_id: The `_id` of the last part of the previous page. This is needed when filtering on a string, as
+                     the filter then ignores case and IPNs that only differ by case are equal, so the page starts
+                     after the part with the last IPN and `_id` instead of after all parts with the last IPN
+
+        Returns: The parts in the page. A page shorter than `page_size` is the last one
+        """
+        q = compile_query(part_class, to_filter)
+        page_filter = _get_page_filter(q.filter, last_ipn, last_id)
+        self.log.debug(f"Getting a page of parts with {page_filter}")
+        cursor = self.part_coll.find(page_filter, collation=q.collation)
+        return list(cursor.sort(page_sort).limit(page_size))
+
+    def iter_pages(self, part_class: typing.Union[spec.PartSpec, None], page_size: int = 50,
+                   to_filter: typing.List[SpecWithOperator] = None) -> typing.Iterator[typing.List[dict]]:
+        """
+        Iterates through pages of parts sorted by IPN, see `page_after`
 
-        print(q)
-        d = self.part_coll.find(q)
-        return list(d)
+        Yields: Each non-empty page of parts
+        """
+        last_ipn, last_id = None, None
+        while 1:
+            page = self.page_after(part_class, last_ipn, page_size, to_filter, last_id)
+            if len(page) != 0:
+                yield page
+            if len(page) < page_size:
+                break
+            last_ipn, last_id = page[-1]['ipn'], page[-1]['_id']
 
     def get_all_parts_by_keys(self, part_class: typing.Union[spec.PartSpec, None],
-                              ret_key: typing.Union[str, list]) -> list:
+                              ret_key: typing.Union[str, list], unique: bool = False) -> list:
         """
-        Returns all parts in the database, but filtered to only return one key
+        Returns all parts in the database, but filtered to only return one key.
+
+        Only the requested keys are sent back by the database.
+
         Args:
             part_class: The part spec class, which is used to determine the type
-            ret_key: The key to return
+            ret_key: The key to return, or a list of keys
+            unique: For a single key, only return its unique values (with `distinct`) instead of one value per part.
+                    The values are then not in the parts' order, and parts without the key are left out
 
-        Returns: A list of all part's value per the given key
+        Returns: A list of every part's value for the given key (None if a part doesn't have it), or a list of dicts
+                 if a list of keys is given
         """
-        ret = []
-        d = self.get_parts(part_class)
-        for d_i in d:
-            if type(ret_key) is list:
-                ret.append({i: d_i[i] for i in ret_key})
-            else:
-                ret.append(d_i[ret_key])
-        return ret
+        q = compile_query(part_class)
+        if type(ret_key) is list:
+            projection = _get_projection(ret_key)
+            return self._cached(('query', 'keys', repr(q), tuple(ret_key)),
+                                lambda: [{i: d_i.get(i) for i in ret_key}
+                                         for d_i in self.part_coll.find(q.filter, projection)])
+        elif unique:
+            return self._cached(('query', 'distinct', repr(q), ret_key),
+                                lambda: self.part_coll.distinct(ret_key, q.filter))
+        else:
+            projection = _get_projection([ret_key])
+            return self._cached(('query', 'values', repr(q), ret_key),
+                                lambda: [d.get(ret_key) for d in self.part_coll.find(q.filter, projection)])
+
+    def search(self, text: str, limit: int = 50) -> typing.List[dict]:
+        """
+        Searches all string keys of all parts for some words, using the database's text index. Matches in the IPN
+        and manufacturer part number are ranked higher than in the comments for example
+
+        Args:
+            text: The words to search for. A quoted phrase must match as a whole, and a word starting with `-` must not
+                  be in the part
+            limit: The maximum number of parts to return
+
+        Returns: The matching parts, best match first
+        """
+        self.log.debug(f"Searching for {text}")
+        score = {'$meta': 'textScore'}
+        parts = list(self.part_coll.find({'$text': {'$search': text}}, {'_score': score})
+                     .sort([('_score', score)]).limit(limit))
+        for p in parts:
+            p.pop('_score')
+        return parts
+
+    def inventory_stats(self, group_by: typing.Sequence[str] = ('type',),
+                        part_class: typing.Union[spec.PartSpec, None] = None,
+                        to_filter: typing.List[SpecWithOperator] = None) -> InventoryStats:
+        """
+        Gets statistics about the parts, calculated by the database in a single request
+
+        Args:
+            group_by: The keys to group the parts by, like `type`, `storage` or `manufacturer`
+            part_class: Optionally only get the statistics for a part type
+            to_filter: Optional list of `SpecWithOperator` to filter by
+
+        Returns: The number of parts, their total stock, how many have no stock and how many don't have a value for
+                 each key. The same is given for each group, sorted by the number of parts, without the null counts
+
+        Raises:
+            InputException: If a group by key is not part of the spec
+        """
+        pipeline, collation = _compile_inventory_stats(group_by, part_class, to_filter)
+        self.log.debug(f"Getting the inventory statistics with {pipeline}")
+        return _to_inventory_stats(next(self.part_coll.aggregate(pipeline, collation=collation)), group_by,
+                                        part_class)
+
+    def explain_query(self, part_class: typing.Union[spec.PartSpec, None],
+                      to_filter: typing.List[SpecWithOperator] = None) -> QueryExplanation:
+        """
+        Explains how the database runs a parts query, mostly to check whether it uses an index
+
+        Args:
+            part_class: The part spec class, which is used to determine the type
+            to_filter: Optional list of `SpecWithOperator` to filter by
+
+        Returns: The compiled query, and the indexes and number of documents the database went through
+        """
+        q = compile_query(part_class, to_filter)
+        e = self.part_coll.find(q.filter, collation=q.collation).explain()
+
+        index_names = []
+
+        def find_indexes(plan):
+            if isinstance(plan, dict):
+                if 'indexName' in plan:
+                    index_names.append(plan['indexName'])
+                for v in plan.values():
+                    find_indexes(v)
+            elif isinstance(plan, list):
+                for v in plan:
+                    find_indexes(v)
+
+        find_indexes(e['queryPlanner']['winningPlan'])
+        stats = e.get('executionStats', {})
+        return QueryExplanation(query=q, uses_index=len(index_names) != 0, index_names=index_names,
+                                docs_examined=stats.get('totalDocsExamined'),
+                                keys_examined=stats.get('totalKeysExamined'),
+                                returned=stats.get('nReturned'))
 
     def add_new_part(self, part_class: spec.PartSpec, new_part: dict):
         """
@@ -361,32 +1833,83 @@ class E7EPD:
             part_class: The part spec class, which is used to determine the type
             new_part: A dictionary storing all the values for the new part
         """
-        # Validate that all given keys are part of the spec, and the type matches
-        for d in new_part:
-            if d not in part_class.items.keys():
-                raise InputException(f"Given key of {d} is not part of the spec")
-            if new_part[d] is not None:
-                if type(new_part[d]) != part_class.items[d].input_type:
-                    raise InputException(f"Input value of {new_part[d]} for {d} is "
-                                         f"not of type {part_class.items[d].input_type}")
+        self._validate_new_part(part_class, new_part)
         # Set type
         new_part['type'] = part_class.db_type_name
-        # Check if all required keys are matched
-        for d in part_class.items:
-            self._check_spec_required(d, part_class.items[d], new_part)
-            # if part_class.items[d].required:
-            #     if d not in new_part:
-            #         raise InputException(f"Required key of {d} is not found in the new part dict")
         # Add part to DB
         self.log.debug(f"Writing to database: {new_part}")
-        self.part_coll.insert_one(new_part)
+
+        def add(session):
+            self.part_coll.insert_one(new_part, session=session)
+            self._log_stock_events(_get_added_events([new_part], self.user), session)
+
+        self._run_stock_change(add)
+        self._invalidate_part(new_part['ipn'])
+        self._add_to_lookup_indexes(new_part)
+
+    def add_new_parts(self, part_class: typing.Union[spec.PartSpec, None], parts: typing.Iterable[dict],
+                      ordered: bool = False, batch_size: int = 1000, validate: bool = True) -> BulkInsertResult:
+        """
+        Adds multiple new parts to the database, sent in batches instead of one part at a time
+
+        Args:
+            part_class: The part spec class for all parts. If None, each part must have a `type` key with either
+                        the part spec class or its database type name
+            parts: The parts to add
+            ordered: If True, stop at the first part that could not be added. Otherwise, skip over any invalid part
+            batch_size: How many parts to send to the database at once
+            validate: Whether to validate the parts before sending them. Only turn this off for trusted parts, like
+                      ones already checked with :meth:`SpecValidator.validate_many`, as the database's validator
+                      (see :meth:`install_validators`) would then be the only check
+
+        Returns: The number of inserted parts, and the error for each part that was not added
+        """
+        result = BulkInsertResult()
+        for batch in _iter_bulk_batches(part_class, parts, ordered, batch_size, validate, result):
+            if not self._insert_parts_batch(batch, ordered, result) and ordered:
+                break
+        return result
+
+    def _insert_parts_batch(self, batch: typing.List[typing.Tuple[int, dict]], ordered: bool,
+                            result: BulkInsertResult) -> bool:
+        """
+        Inserts a batch of already validated parts, adding the outcome to `result`
+
+        Returns: True if all parts were inserted
+        """
+        self.log.debug(f"Writing {len(batch)} parts to the database")
+        try:
+            r = self.part_coll.insert_many([p for _, p in batch], ordered=ordered)
+        except pymongo.errors.BulkWriteError as e:
+            self._invalidate_part()
+            # Re-build the lookup indexes when next needed, instead of figuring out which parts did get added
+            self._reset_lookup_indexes()
+            inserted = _add_failed_batch(batch, ordered, e.details, result)
+            self._log_stock_events(_get_added_events(inserted, self.user))
+            return False
+        self._log_stock_events(_get_added_events([p for _, p in batch], self.user))
+        self._invalidate_part()
+        for _, p in batch:
+            self._add_to_lookup_indexes(p)
+        result.inserted += len(r.inserted_ids)
+        return True
 
     def delete_part(self, part_class: spec.PartSpec, ipn: str):
-        q = {'type': part_class.db_type_name, 'ipn': ipn}
+        q = {'ipn': ipn, 'type': part_class.db_type_name}
         self.log.debug(f"Deleting: {q}")
-        self.part_coll.delete_one(q)
 
-    def update_part(self, part_class: typing.Union[spec.PartSpec, None], ipn: str, new_values: dict):
+        def delete(session):
+            d = self.part_coll.find_one_and_delete(q, projection={'_id': 0, 'stock': 1}, session=session)
+            if d is not None:
+                self._log_stock_events([self._make_stock_event(ipn, -(d.get('stock') or 0), 0, reason='deleted')],
+                                       session)
+
+        self._run_stock_change(delete)
+        self._invalidate_part(ipn)
+        self._remove_from_lookup_indexes(ipn)
+
+    def update_part(self, part_class: typing.Union[spec.PartSpec, None], ipn: str, new_values: dict,
+                    user: str = None, reason: str = None):
         """
         Updates a part with a certain type and IPN with some new values given as a dictionary
 
@@ -395,34 +1918,135 @@ class E7EPD:
                         new_values is not done (thus recommended!!)
             ipn: The IPN of the part to update
             new_values: The new dictionary key-values to update the part with
+            user: The user for the stock event, if the stock is changed. Defaults to the `user` attribute
+            reason: The reason for the stock event, if the stock is changed
         """
-        q = {'ipn': ipn}
-        if part_class is not None:
-            q['type'] = part_class.db_type_name
-            for d in new_values:
-                if d not in part_class.items.keys():
-                    raise InputException(f"Given key of {d} is not part of the spec")
-                try:
-                    part_class.items[d].input_type(new_values[d])
-                except ValueError:
-                    raise InputException(f"Input value of {new_values[d]} for {d} is not "
-                                         f"of type {part_class.items[d].input_type}")
+        q = _prepare_part_update(part_class, ipn, new_values)
         self.log.debug(f"Updating {q} with {new_values}")
-        self.part_coll.find_one_and_update(q, {"$set": new_values})
 
-    def update_part_stock(self, ipn: str, new_qty: int):
+        def update(session):
+            d = self.part_coll.find_one_and_update(q, {"$set": new_values}, projection=part_update_projection,
+                                                   session=session)
+            if d is not None and new_values.get('ipn', ipn) != ipn:
+                # Keep the part's stock history
+                rename = {'$set': {'ipn': new_values['ipn']}}
+                self.events_coll.update_many({'ipn': ipn}, rename, session=session)
+                self.snapshots_coll.update_many({'ipn': ipn}, rename, session=session)
+            self._log_stock_events(_get_update_events(d, ipn, new_values, self._get_user(user), reason), session)
+            return d
+
+        old = self._run_stock_change(update)
+        self._invalidate_part(ipn)
+        if new_values.get('ipn', ipn) != ipn:
+            self._invalidate_part(new_values['ipn'])
+        if old is not None and ('ipn' in new_values or 'mfg_part_numb' in new_values):
+            self._remove_from_lookup_indexes(ipn)
+            self._add_to_lookup_indexes({**old, **new_values, 'ipn': new_values.get('ipn', ipn)})
+
+    def update_part_stock(self, ipn: str, new_qty: int, user: str = None, reason: str = None):
         """
         Function to purely update a part's stock
 
         Args:
             ipn: The IPN to update the part for
             new_qty: The new part quantity
+            user: The user for the stock event. Defaults to the `user` attribute
+            reason: The reason for the stock event
         """
-        self.update_part(None, ipn, {'stock': new_qty})
+        self.update_part(None, ipn, {'stock': new_qty}, user, reason)
         # self.part_coll.find_one_and_update({'ipn': ipn}, {"$set": {'stock': new_qty}})
 
-    def get_part_spec_by_db_name(self, db_name: str):
-        for i in self.comp_types:
+    def adjust_stock(self, ipn: str, delta: int, user: str = None, reason: str = None) -> int:
+        """
+        Adds to or removes from a part's stock. This is done atomically by the database, so concurrent changes to
+        the same part are not lost
+
+        Args:
+            ipn: The IPN of the part
+            delta: How much to change the stock by, negative to remove stock
+            user: The user for the stock event. Defaults to the `user` attribute
+            reason: The reason for the stock event
+
+        Returns: The part's new stock
+
+        Raises:
+            NegativeStock: If removing the stock will make it negative. The stock is left unchanged
+            EmptyInDatabase: If the part is not in the database
+        """
+        q = _stock_adjust_filter(ipn, delta)
+        self.log.debug(f"Adjusting stock of {ipn} by {delta}")
+
+        def adjust(session):
+            r = self.part_coll.find_one_and_update(q, _stock_adjust_update(delta),
+                                                   projection={'_id': 0, 'stock': 1},
+                                                   return_document=pymongo.ReturnDocument.AFTER, session=session)
+            if r is not None:
+                self._log_stock_events([self._make_stock_event(ipn, delta, r['stock'], user, reason)], session)
+            return r
+
+        d = self._run_stock_change(adjust)
+        self._invalidate_part(ipn)
+        if d is None:
+            # Find out why the part was not updated
+            d = self.part_coll.find_one({'ipn': ipn}, projection={'_id': 0, 'stock': 1})
+            if d is None:
+                raise EmptyInDatabase()
+            raise NegativeStock(d.get('stock') or 0)
+        return d['stock']
+
+    def bulk_adjust_stock(self, deltas: typing.Dict[str, int], user: str = None, reason: str = None) -> int:
+        """
+        Adds to or removes from multiple parts' stock, see `adjust_stock`. On a replica set this is a single write in
+        a transaction. Otherwise, each part is changed with its own atomic update, so the stock events are only for
+        the parts that did change, with their stock after the change
+
+        Any part where removing the stock would make it negative is left unchanged. Use `adjust_stock` for when
+        the reason for a part not being changed is needed
+
+        Args:
+            deltas: A dict of IPN to how much to change its stock by
+            user: The user for the stock events. Defaults to the `user` attribute
+            reason: The reason for the stock events
+
+        Returns: The number of parts whose stock was changed
+        """
+        if len(deltas) == 0:
+            return 0
+        self.log.debug(f"Adjusting stock of {deltas}")
+
+        def adjust(session):
+            if session is None:
+                # Without a transaction the stock can change between reading and writing it, so only the parts that
+                # the updates did change get a stock event
+                events = []
+                for ipn, delta in deltas.items():
+                    r = self.part_coll.find_one_and_update(_stock_adjust_filter(ipn, delta),
+                                                           _stock_adjust_update(delta),
+                                                           projection={'_id': 0, 'stock': 1},
+                                                           return_document=pymongo.ReturnDocument.AFTER)
+                    if r is not None:
+                        events.append(self._make_stock_event(ipn, delta, r['stock'], user, reason))
+                self._log_stock_events(events)
+                return len(events)
+            # Only change the parts that have enough stock, so the stock events are only for those
+            changes = _get_stock_changes(deltas, self.part_coll.find({'ipn': {'$in': list(deltas)}},
+                                                                          {'_id': 0, 'ipn': 1, 'stock': 1},
+                                                                          session=session))
+            if len(changes) == 0:
+                return 0
+            r = self.part_coll.bulk_write(_get_stock_change_ops(changes), ordered=False, session=session)
+            self._log_stock_events(_get_stock_change_events(changes, self._get_user(user), reason), session)
+            return r.matched_count
+
+        matched = self._run_stock_change(adjust)
+        self._invalidate_part()
+        if matched != len(deltas):
+            self.log.warning(f"Only changed the stock of {matched} out of {len(deltas)} parts")
+        return matched
+
+    @classmethod
+    def get_part_spec_by_db_name(cls, db_name: str):
+        for i in cls.comp_types:
             if db_name == i.db_type_name:
                 return i
         raise InputException(f"Cannot find part type from db_name of {db_name}")
@@ -436,6 +2060,88 @@ class E7EPD:
 
         """
         self.part_coll.drop()
+        self.events_coll.drop()
+        self.snapshots_coll.drop()
+        self._invalidate_part()
+        self._reset_lookup_indexes()
+
+    def get_stock_events(self, ipn: str, since: datetime.datetime = None,
+                         until: datetime.datetime = None) -> typing.List[dict]:
+        """
+        Gets the changes to a part's stock, oldest first
+
+        Args:
+            ipn: The IPN of the part
+            since: Optionally only get the events after this time
+            until: Optionally only get the events up to this time
+        """
+        q = {'ipn': ipn}
+        if since is not None:
+            q.setdefault('ts', {})['$gt'] = since
+        if until is not None:
+            q.setdefault('ts', {})['$lte'] = until
+        return list(self.events_coll.find(q, {'_id': 0}).sort('ts', pymongo.ASCENDING))
+
+    def _sum_stock_events(self, q: dict) -> int:
+        r = list(self.events_coll.aggregate([{'$match': q}, {'$group': {'_id': None, 'delta': {'$sum': '$delta'}}}]))
+        return r[0]['delta'] if len(r) != 0 else 0
+
+    def stock_at(self, ipn: str, ts: datetime.datetime) -> typing.Union[int, None]:
+        """
+        Gets what a part's stock was at a point in time. This reads the latest stock snapshot before then, plus the
+        stock events after it. If there isn't a snapshot, the stock events since then are removed from the current
+        stock instead
+
+        Args:
+            ipn: The IPN of the part
+            ts: The point in time
+
+        Returns: The part's stock at that time, or None if the part is not in the database and has no stock events
+        """
+        snap = self.snapshots_coll.find_one({'ipn': ipn, 'ts': {'$lte': ts}}, sort=[('ts', pymongo.DESCENDING)])
+        if snap is not None:
+            after = self._sum_stock_events({'ipn': ipn, 'ts': {'$gt': snap['ts'], '$lte': ts}})
+            return (snap.get('stock') or 0) + after
+        part = self.part_coll.find_one({'ipn': ipn}, {'_id': 0, 'stock': 1})
+        if part is None:
+            if self.events_coll.count_documents({'ipn': ipn}, limit=1) == 0:
+                return None
+            # The part got deleted, which left it with no stock
+            part = {'stock': 0}
+        return (part.get('stock') or 0) - self._sum_stock_events({'ipn': ipn, 'ts': {'$gt': ts}})
+
+    def snapshot_stock(self) -> datetime.datetime:
+        """
+        Saves the current stock of all parts as a snapshot, which is done by the database. Snapshots make `stock_at`
+        faster, as fewer stock events need to be added up
+
+        The snapshot's time is the database's time when it started (`$$NOW`). A part's stock can change while the
+        snapshot is being taken, so the stock events after that time which were already read into the part's stock
+        are removed from it, which keeps `stock_at` from adding them twice
+
+        Returns: The time of the snapshot
+        """
+        self.log.debug("Taking a snapshot of all parts' stock")
+        self.part_coll.aggregate(_snapshot_stock_pipeline()).close()
+        snap = self.snapshots_coll.find_one({}, {'_id': 0, 'ts': 1}, sort=[('ts', pymongo.DESCENDING)])
+        ts = snap['ts'] if snap is not None else datetime.datetime.now(datetime.timezone.utc)
+        self.config.set('last_stock_snapshot', ts)
+        return ts
+
+    def snapshot_stock_if_due(self, interval: datetime.timedelta = datetime.timedelta(days=7)) -> bool:
+        """
+        Saves a stock snapshot if the last one is older than the interval, see `snapshot_stock`
+
+        Returns: Whether a snapshot was taken
+        """
+        last = self.config.get('last_stock_snapshot')
+        if last is not None:
+            if last.tzinfo is None:
+                last = last.replace(tzinfo=datetime.timezone.utc)
+            if datetime.datetime.now(datetime.timezone.utc) - last < interval:
+                return False
+        self.snapshot_stock()
+        return True
 
     def update_database(self):
         """
@@ -445,9 +2151,27 @@ class E7EPD:
         For 0.6.0 to 0.7.0, use migration.py
         """
         v = self.config.get_db_version()
-        # note: no new version to upgrade to yet
+        self.log.info(f"Updating the database from {v} to {database_spec_rev}")
+        # 0.7-rc1 to 0.7-rc2: the parts and PCBs are validated by the database
+        self.install_validators()
         self.config.store_current_db_version()
 
+    def install_validators(self):
+        """
+        Installs or upgrades the `$jsonSchema` validators of the parts and PCBs collections, made from the specs, so
+        the database rejects any malformed part or PCB no matter who writes it.
+
+        The validation level is `moderate`, so parts that were already invalid can still be updated
+        """
+        for coll_name, options in _get_validators(self.comp_types).items():
+            try:
+                self.db.command('collMod', coll_name, **options)
+            except pymongo.errors.OperationFailure as e:
+                # NamespaceNotFound, if the collection doesn't exist yet
+                if e.code != 26:
+                    raise
+                self.db.create_collection(coll_name, **options)
+
     def is_latest_database(self) -> bool:
         """
             Returns whether the database is matched with the latest rev
@@ -458,27 +2182,172 @@ class E7EPD:
             return False
         return True
 
-    def backup_db(self):
+    def backup_db(self, path: str = None, fmt: str = 'ndjson', compression: typing.Union[str, None] = 'auto',
+                  workers: int = 4):
         """
-            Backs up the database under a new backup file
+        Backs up the database into an archive: a directory with one compressed file per collection, streamed from the
+        database so the memory used doesn't depend on the database's size, and a `manifest.json` with the number of
+        documents and SHA-256 of each file. The collections are backed up concurrently
+
+        If the database is a replica set, the backup also records a change stream position, so it can be followed by
+        incremental backups with :meth:`backup_db_incremental`
+
+        If the backup fails, the files it wrote are removed, along with the directory if it was made for the backup,
+        so it can be retried into the same path
+
+        Args:
+            path: The directory to back up into. Defaults to `partdb_backup_<date and time>` in the current directory
+            fmt: Either `ndjson` for canonical extended JSON with one document per line, or `bson`
+            compression: Either `zstd` (which needs the `zstandard` package), `gzip`, None for no compression, or
+                         `auto` for zstd if available otherwise gzip
+            workers: How many collections to back up at once
+
+        Returns:
+            BackupManifest: The manifest of the backup
+
+        Raises:
+            InputException: If the format or compression is unknown, or the path already has a backup
+        """
+        import e7epd.backup
+
+        if path is None:
+            path = os.path.abspath(f"partdb_backup_{time.strftime('%y%m%d%H%M%S')}")
+        return e7epd.backup.backup_database(self, path, fmt, compression, workers=workers)
+
+    def backup_db_incremental(self, path: str):
         """
-        # todo: this
-        # new_db_file = os.path.dirname(os.path.abspath(__file__)) + '/partdb_backup_%s.json' % time.strftime('%y%m%d%H%M%S')
-        # self.log.info("Backing database under %s" % new_db_file)
-        # # https://stackoverflow.com/questions/47307873/read-entire-database-with-sqlalchemy-and-dump-as-json
-        # meta = sqlalchemy.MetaData()
-        # meta.reflect(bind=self.db_conn)  # http://docs.sqlalchemy.org/en/rel_0_9/core/reflection.html
-        # result = {}
-        # for table in meta.sorted_tables:
-        #     result[table.name] = [dict(row) for row in self.db_conn.execute(table.select())]
-        # with open(new_db_file, 'x') as f:
-        #     json.dump(result, f, indent=4)
+        Adds an incremental backup to an archive made by :meth:`backup_db`, with only the documents changed or deleted
+        since the archive's latest backup. The changes are read from a change stream, starting from the position
+        recorded in the archive's manifest, so the database must be a replica set (a single-node one is enough).
+
+        Each changed document is written once as its latest version, or as deleted, in a new `delta_NNNN` file. The
+        change stream position after it is saved in the manifest for the next incremental backup.
+        :meth:`restore` replays these in order after the full backup
+
+        Args:
+            path: The archive's directory
+
+        Returns:
+            BackupDelta: The new incremental backup, or None if nothing changed
+
+        Raises:
+            InputException: If the archive has no change stream position, or the changes since it are no longer in
+                            the oplog (in which case a new full backup is needed)
+        """
+        import e7epd.backup
+
+        return e7epd.backup.backup_database_incremental(self, path)
+
+    def restore(self, path: str, mode: str = 'merge', batch_size: int = 1000, workers: int = 4):
+        """
+        Restores the database from an archive made by :meth:`backup_db`.
+
+        The archive's checksums are checked first, then each collection is streamed from its file. Parts and PCBs
+        are validated against their spec, and any invalid document is skipped and reported. Documents are inserted
+        in unordered batches by a pool of workers. Any incremental backup is then replayed in order.
+
+        The progress is saved in a checkpoint file in the archive, so if a restore gets interrupted, calling this
+        again with the same archive and mode continues where it stopped. The checkpoint is removed once done
+
+        Args:
+            path: The archive's directory
+            mode: Either `merge` to add the archive's documents to the database, skipping the ones already in it
+                  (and not restoring the config), or `replace` to first drop the collections in the archive
+            batch_size: How many documents to insert at once
+            workers: How many batches to insert at once
+
+        Returns:
+            RestoreResult: The number of inserted and skipped documents, and the errors, per collection
+
+        Raises:
+            InputException: If the mode is unknown, or the archive is incomplete or doesn't match its checksums
+        """
+        import e7epd.backup
+
+        r = e7epd.backup.restore_database(self, path, mode, batch_size, workers)
+        self._invalidate_part()
+        self._reset_lookup_indexes()
+        return r
+
+    def export_parts(self, path: str, fmt: str = 'csv', part_classes: typing.Iterable[spec.PartSpec] = None,
+                     batch_size: int = 5000):
+        """
+        Exports the parts into a directory. The parts are streamed from the database with only the exported keys,
+        so the memory used doesn't depend on the number of parts.
+
+        The formats are:
+
+        * `csv`: One `<type>.csv` file per part type (`other.csv` for parts without a type), with the type's keys as
+          columns in its display order
+        * `ndjson`: One `parts.ndjson` file with one JSON object per part
+        * `parquet`: One `<type>.parquet` file per part type, typed from the spec and written in record batches.
+          This needs the optional `pyarrow` package
+
+        Args:
+            path: The directory to export into, which gets created if needed
+            fmt: The format, either `csv`, `ndjson` or `parquet`
+            part_classes: Optionally only export these part types. Defaults to all of them
+            batch_size: How many parts to get from the database (and, for Parquet, write) at once
+
+        Returns:
+            ExportResult: The exported files, and how many parts are in each
+
+        Raises:
+            InputException: If the format is unknown, or Parquet is asked for without pyarrow
+        """
+        import e7epd.exporter
+
+        return e7epd.exporter.export_parts(self, path, fmt, part_classes, batch_size)
+
+    def import_csv(self, path: str, profile, chunk_size: int = 1000,
+                   resolve_type: typing.Callable[[str], typing.Union[spec.PartSpec, None]] = None,
+                   progress: typing.Callable = None):
+        """
+        Imports parts from a CSV file, with its columns mapped to part keys by an :class:`ImportProfile`.
+
+        The file is read once, one row at a time. Every `chunk_size` rows, the parts are validated per part type
+        with :meth:`SpecValidator.validate_many`, and the valid ones are added in one batch. Rows that can't be
+        converted or are invalid are skipped and reported
+
+        Args:
+            path: The CSV file, with a header
+            profile: How the file's columns and part type text map to parts
+            chunk_size: How many rows to validate and add at once
+            resolve_type: Called with any part type text that's not in the profile, returning its part spec or None
+                          to skip the row. It may add the part type's columns to the profile. If not given, rows
+                          with an unknown part type are skipped
+            progress: Called with an :class:`ImportProgress` after each chunk
+
+        Returns:
+            ImportResult: The number of rows and added parts, and the error for each row that was not added
+
+        Raises:
+            InputException: If the file can't be read, or the profile doesn't match the file
+        """
+        import e7epd.importer
+
+        return e7epd.importer.import_csv(self, path, profile, chunk_size, resolve_type, progress)
 
     @staticmethod
-    def _check_spec_required(spec_k: str, spec_i: spec.SpecLineItem, part_dict: dict):
-        if spec_i.required:
-            if spec_k not in part_dict:
-                raise InputException(f"Required key of {spec_k} is not found in the new part dict")
+    def _validate_new_part(part_class: spec.PartSpec, new_part: dict):
+        """
+        Validates a new part against its spec
+
+        Raises:
+            InputException: If a key is not part of the spec, a value is of the wrong type, or a required key is missing
+        """
+        SpecValidator.for_part(part_class).validate(new_part)
+
+    @staticmethod
+    def _validate_new_pcb(pcb_data: dict):
+        """
+        Validates a new PCB against the PCB spec
+
+        Raises:
+            InputException: If a key is not part of the spec, a value is of the wrong type, or a required key is missing
+        """
+        # todo: add verification of parts
+        SpecValidator.for_pcb().validate(pcb_data)
 
 
 def print_formatted_from_spec(part_class: spec.PartSpec, part_data: dict) -> typing.Union[None, str]:
@@ -491,7 +2360,7 @@ def print_formatted_from_spec(part_class: spec.PartSpec, part_data: dict) -> typ
     """
     ret_str = None
     if part_class is spec.Resistor:
-        ret_str = f"A {str(EngNumber(part_data['resistance'])):s} resistor"
+        ret_str = f"A {e7epd.units.format_eng(part_data['resistance']):s} resistor"
 
         tolerance = part_data['tolerance']
         if tolerance is not None:
@@ -0,0 +1,576 @@
+"""
+An asyncio version of the E7EPD database wrapper, for programs that serve many concurrent lookups
+"""
+import dataclasses
+import logging
+import typing
+import bson
+import pymongo
+import pymongo.errors
+
+import e7epd.e707pd_spec as spec
+from e7epd.e7epd import E7EPD, E7EPDIndexManager, IndexReport, database_spec_rev
+from e7epd.e7epd import InputException, EmptyInDatabase, NegativeStock, KitShortfall
+from e7epd.e7epd import SpecWithOperator, compile_query, BulkInsertResult, make_stock_event, SpecValidator
+from e7epd.e7epd import bom_part_projection, part_update_projection, page_sort
+from e7epd.e7epd import BuildableReport, KitPlan, InventoryStats
+# The queries, writes and conversions shared with E7EPD
+from e7epd.e7epd import _get_projection, _get_page_filter, _stock_adjust_filter, _stock_adjust_update
+from e7epd.e7epd import _iter_bulk_batches, _add_failed_batch, _get_added_events
+from e7epd.e7epd import _prepare_part_update, _get_update_events
+from e7epd.e7epd import _get_stock_changes, _get_stock_change_ops, _get_stock_change_events
+from e7epd.e7epd import _compile_bom, _assemble_bom, _get_pcb_part_filter, _get_buildable_pipeline, _to_buildable_report
+from e7epd.e7epd import _plan_kit, _get_kit_writes, _compile_inventory_stats, _to_inventory_stats, _get_validators
+
+# The async driver was added in pymongo 4.9
+try:
+    import pymongo.asynchronous.database
+except ImportError as e:
+    available = e
+    """available is None if the async driver is available, otherwise it will be the import exception"""
+else:
+    available = None
+
+
+class AsyncE7EPDConfigTable:
+    """
+    The asyncio version of :class:`E7EPDConfigTable`
+    """
+    def __init__(self, db_conn: 'pymongo.asynchronous.database.AsyncDatabase'):
+        self.log = logging.getLogger('config')
+        self.coll = db_conn['config']
+
+    async def get(self, key: str) -> typing.Union[str, None]:
+        d = await self.coll.find_one({'key': key})
+        if d is None:
+            return None
+        else:
+            return d['val']
+
+    async def set(self, key: str, value: typing.Any):
+        d = await self.coll.find_one_and_update({'key': key}, {'$set': {'val': value}})
+        if d is None:
+            await self.coll.insert_one({'key': key, 'val': value})
+
+    async def get_db_version(self) -> typing.Union[str, None]:
+        return await self.get('db_ver')
+
+    async def store_current_db_version(self):
+        await self.set('db_ver', database_spec_rev)
+
+
+class AsyncE7EPD:
+    """
+    The asyncio version of :class:`E7EPD`, built on pymongo's `AsyncMongoClient`. The methods are the same as the
+    synchronous class, but are coroutines, and the queries and validation are shared with it.
+
+    As the constructor can't wait on the database, create this class with `await AsyncE7EPD.create(db)`.
+
+    This needs pymongo 4.9 or newer, which is installed with the `Async` extra (`pip install e7epd[Async]`).
+
+    .. note::
+        This class does not have a parts cache nor an IPN index, as it is meant for long-running programs that should
+        always see the latest data
+    """
+    comp_types = E7EPD.comp_types
+
+    def __init__(self, db_client: 'pymongo.asynchronous.database.AsyncDatabase'):
+        """
+        Args:
+            db_client: The async Mongo database to use
+        """
+        if available is not None:
+            raise available
+        self.log = logging.getLogger('AsyncE7EPD')
+
+        self.db = db_client
+        self.config = AsyncE7EPDConfigTable(self.db)
+
+        self.part_coll = self.db['parts']
+        self.pcb_coll = self.db['pcbs']
+        self.users_coll = self.db['user']
+        self.events_coll = self.db['stock_events']
+
+        # The user that's put in the stock events, if not given when changing the stock
+        self.user = None        # type: typing.Union[str, None]
+
+        self.index_report = None        # type: typing.Union[IndexReport, None]
+        self._is_replica_set = None     # type: typing.Union[bool, None]
+
+    @classmethod
+    async def create(cls, db_client: 'pymongo.asynchronous.database.AsyncDatabase',
+                     ensure_indexes: bool = True) -> 'AsyncE7EPD':
+        """
+        Creates the class, and does the same startup as :class:`E7EPD`
+
+        Args:
+            db_client: The async Mongo database to use
+            ensure_indexes: Whether to create any missing index on startup
+        """
+        self = cls(db_client)
+        if ensure_indexes:
+            self.index_report = await self.ensure_indexes()
+            E7EPDIndexManager.log_report(self.log, self.index_report)
+        # If the DB version is None (if the config table was just created), then set it up at the current version
+        if await self.config.get_db_version() is None:
+            await self.update_database()
+        return self
+
+    async def ensure_indexes(self) -> IndexReport:
+        """
+        Creates any missing index, see :meth:`E7EPDIndexManager.ensure_indexes`
+        """
+        report = IndexReport()
+        definitions = E7EPDIndexManager.get_index_definitions(self.comp_types)
+        existing = {c: [d['name'] async for d in await self.db[c].list_indexes()]
+                    for c in E7EPDIndexManager.get_collections(definitions)}
+        for i in E7EPDIndexManager.get_missing(definitions, existing, report):
+            try:
+                await self.db[i.collection].create_index(i.keys, **i.create_kwargs())
+            except pymongo.errors.OperationFailure as e:
+                E7EPDIndexManager.add_build_result(self.log, report, i, e)
+            else:
+                E7EPDIndexManager.add_build_result(self.log, report, i, None)
+        return report
+
+    async def is_replica_set(self) -> bool:
+        """
+        Returns whether the database is part of a replica set (or a sharded cluster), see :meth:`E7EPD.is_replica_set`
+        """
+        if self._is_replica_set is None:
+            r = await self.db.client.admin.command('hello')
+            self._is_replica_set = 'setName' in r or r.get('msg') == 'isdbgrid'
+        return self._is_replica_set
+
+    async def _run_stock_change(self, func: typing.Callable[[typing.Any], typing.Awaitable]) -> typing.Any:
+        """ Runs a stock change in a transaction on replica sets, see :meth:`E7EPD._run_stock_change` """
+        if await self.is_replica_set():
+            async with self.db.client.start_session() as s:
+                return await s.with_transaction(func)
+        return await func(None)
+
+    async def _log_stock_events(self, events: typing.List[dict], session=None):
+        if len(events) != 0:
+            await self.events_coll.insert_many(events, ordered=False, session=session)
+
+    def _get_user(self, user: typing.Union[str, None]) -> typing.Union[str, None]:
+        return user if user is not None else self.user
+
+    def _make_stock_event(self, ipn: str, delta: int, stock: typing.Union[int, None] = None, user: str = None,
+                          reason: str = None) -> dict:
+        return make_stock_event(ipn, delta, stock, self._get_user(user), reason)
+
+    async def close(self):
+        """
+        Call this when exiting your program. The database client is not closed, as it's owned by the caller
+        """
+        pass
+
+    async def add_new_pcb(self, pcb_data: dict):
+        """
+        Adds a new PCB to the database, see :meth:`E7EPD.add_new_pcb`
+        """
+        SpecValidator.for_pcb().validate(pcb_data)
+        # Check for any duplicates
+        if await self.pcb_coll.count_documents({'id': pcb_data['id'], 'rev': pcb_data['rev']}) != 0:
+            raise InputException("PCB ID already exists in the database")
+        await self.pcb_coll.insert_one(pcb_data)
+
+    async def get_pcb(self, pcb_id: str = None, rev: str = None) -> dict:
+        return await self.pcb_coll.find_one({'id': pcb_id, 'rev': rev})
+
+    async def get_all_unique_pcbs(self) -> typing.List[typing.Dict]:
+        return [{'id': i['id'], 'rev': i['rev']} async for i in self.pcb_coll.find({}, {'_id': 0, 'id': 1, 'rev': 1})]
+
+    async def find_pcb_part(self, part: dict) -> typing.Union[None, typing.List[dict]]:
+        part_type = part['type']
+        part = part['part']
+        if 'ipn' in part:
+            p = await self.get_part_by_ipn(part['ipn'])
+            if p is not None:
+                return [p]
+        else:
+            return await self.get_parts(self.get_part_spec_by_db_name(part_type), _get_pcb_part_filter(part))
+        return []
+
+    async def resolve_bom(self, pcb: dict) -> typing.List[typing.List[dict]]:
+        """
+        Finds the parts for every line of a PCB's BOM in at most two database requests, see :meth:`E7EPD.resolve_bom`
+        """
+        c = _compile_bom(pcb)
+        parts_by_ipn = {}
+        if len(c.ipns) != 0:
+            parts_by_ipn = {p['ipn']: p async for p in self.part_coll.find({'ipn': {'$in': c.ipns}},
+                                                                           bom_part_projection)}
+        facets = {}
+        for pipeline, collation in c.pipelines:
+            cursor = await self.part_coll.aggregate(pipeline, collation=collation)
+            facets.update(await cursor.next())
+        for k in c.get_truncated_facets(facets):
+            q = c.facet_queries[k]
+            facets[k] = [p async for p in self.part_coll.find(q.filter, bom_part_projection, collation=q.collation)
+                         .sort('ipn', pymongo.ASCENDING)]
+        return _assemble_bom(pcb, c, parts_by_ipn, facets)
+
+    async def buildable_quantity(self, pcb_id: str, rev: str) -> BuildableReport:
+        """
+        Calculates how many of a PCB can be built with the current stock, see :meth:`E7EPD.buildable_quantity`
+
+        Raises:
+            EmptyInDatabase: If the PCB is not in the database
+        """
+        r = await (await self.pcb_coll.aggregate(_get_buildable_pipeline({'id': pcb_id, 'rev': rev}))).to_list()
+        if len(r) == 0:
+            if await self.pcb_coll.count_documents({'id': pcb_id, 'rev': rev}) == 0:
+                raise EmptyInDatabase()
+            return BuildableReport(pcb_id, rev, None)
+        return _to_buildable_report(r[0])
+
+    async def buildable_report(self) -> typing.List[BuildableReport]:
+        """
+        Calculates how many of each PCB can be built with the current stock, see :meth:`E7EPD.buildable_report`
+        """
+        return [_to_buildable_report(d) async for d in await self.pcb_coll.aggregate(_get_buildable_pipeline({}))]
+
+    async def plan_kit(self, pcb_id: str, rev: str, count: int, allocation: typing.Dict[int, str] = None) -> KitPlan:
+        """
+        Plans which parts to take from the stock to build some PCBs, see :meth:`E7EPD.plan_kit`
+
+        Raises:
+            EmptyInDatabase: If the PCB is not in the database
+            InputException: If the count is not positive, or an allocated IPN doesn't match its BOM line
+        """
+        if count <= 0:
+            raise InputException("The number of PCBs to build must be positive")
+        pcb = await self.get_pcb(pcb_id, rev)
+        if pcb is None:
+            raise EmptyInDatabase()
+        return _plan_kit(pcb, await self.resolve_bom(pcb), count, allocation)
+
+    async def kit_build(self, pcb_id: str, rev: str, count: int, allocation: typing.Dict[int, str] = None,
+                        dry_run: bool = False, user: str = None) -> KitPlan:
+        """
+        Builds some PCBs, by taking all of their parts from the stock and adding to the PCB's stock in one go, see
+        :meth:`E7EPD.kit_build`
+
+        Raises:
+            KitShortfall: If there isn't enough stock for any line. Nothing is taken from the stock
+            EmptyInDatabase: If the PCB is not in the database
+            InputException: If the count is not positive, or an allocated IPN doesn't match its BOM line
+        """
+        plan = await self.plan_kit(pcb_id, rev, count, allocation)
+        if dry_run:
+            return plan
+        if not plan.is_buildable:
+            raise KitShortfall(plan)
+        build_id = bson.ObjectId()
+        ops, events, pcb_q, pcb_update = _get_kit_writes(plan, build_id, self._get_user(user))
+        self.log.debug(f"Building {count} of {pcb_q}, taking {plan.get_totals()}")
+        try:
+            if await self.is_replica_set():
+                async def build(session):
+                    if len(ops) != 0:
+                        r = await self.part_coll.bulk_write(ops, ordered=False, session=session)
+                        if r.matched_count != len(ops):
+                            raise KitShortfall(plan)
+                    await self._log_stock_events(events, session)
+                    await self.pcb_coll.update_one(pcb_q, pcb_update, session=session)
+
+                async with self.db.client.start_session() as s:
+                    await s.with_transaction(build)
+            else:
+                done = []
+                for ipn, n in plan.get_totals().items():
+                    r = await self.part_coll.update_one(_stock_adjust_filter(ipn, -n),
+                                                        _stock_adjust_update(-n))
+                    if r.matched_count != 1:
+                        for done_ipn, done_n in done:
+                            await self.part_coll.update_one({'ipn': done_ipn}, _stock_adjust_update(done_n))
+                        raise KitShortfall(plan)
+                    done.append((ipn, n))
+                await self._log_stock_events(events)
+                await self.pcb_coll.update_one(pcb_q, pcb_update)
+        except KitShortfall:
+            raise KitShortfall(await self.plan_kit(pcb_id, rev, count, allocation))
+        plan.build_id = build_id
+        return plan
+
+    async def add_user(self, u: spec.UserSpec):
+        # Do a check to ensure the same name does not exist
+        if await self.users_coll.count_documents({'name': u.name}) != 0:
+            raise InputException("The user (by name) already exists in the database")
+        await self.users_coll.insert_one(dataclasses.asdict(u))
+
+    async def get_user_by_name(self, name: str) -> typing.Union[dict, None]:
+        return await self.users_coll.find_one({'name': name})
+
+    async def get_all_users_name(self) -> typing.List[str]:
+        return [i['name'] async for i in self.users_coll.find({}, {'_id': 0, 'name': 1})]
+
+    async def check_if_already_in_db_by_ipn(self, ipn: str) -> bool:
+        """
+        Checks if an ipn is already in the database
+        """
+        if ipn is None:
+            raise InputException("Did not give a manufacturer part number")
+        d = await self.part_coll.count_documents({'ipn': ipn})
+        if d > 1:
+            raise UserWarning("There is more than 1 entry for a manufacturer part number")
+        return d == 1
+
+    async def get_part_by_ipn(self, ipn: str) -> dict:
+        return await self.part_coll.find_one({'ipn': ipn})
+
+    async def get_number_of_parts_in_db(self, part_class: spec.PartSpec) -> int:
+        return await self.part_coll.count_documents({'type': part_class.db_type_name})
+
+    async def get_parts(self, part_class: spec.PartSpec,
+                        to_filter: typing.List[SpecWithOperator] = None) -> typing.List[dict]:
+        """
+        Get parts in the database, see :meth:`E7EPD.get_parts`
+        """
+        return [p async for p in self.iter_parts(part_class, to_filter)]
+
+    async def iter_parts(self, part_class: typing.Union[spec.PartSpec, None],
+                         to_filter: typing.List[SpecWithOperator] = None,
+                         sort: typing.Union[str, typing.List[typing.Tuple[str, int]], None] = None,
+                         batch_size: int = None, limit: int = None, skip: int = None,
+                         projection: typing.Union[typing.List[str], dict, None] = None) -> typing.AsyncIterator[dict]:
+        """
+        Iterates through parts in the database as they are fetched, see :meth:`E7EPD.iter_parts`
+        """
+        q = compile_query(part_class, to_filter)
+        self.log.debug(f"Getting parts with {q}")
+        cursor = self.part_coll.find(q.filter, _get_projection(projection), collation=q.collation)
+        if sort is not None:
+            cursor = cursor.sort(sort)
+        if batch_size is not None:
+            cursor = cursor.batch_size(batch_size)
+        if skip is not None:
+            cursor = cursor.skip(skip)
+        if limit is not None:
+            cursor = cursor.limit(limit)
+        try:
+            async for p in cursor:
+                yield p
+        finally:
+            await cursor.close()
+
+    async def page_after(self, part_class: typing.Union[spec.PartSpec, None],
+                         last_ipn: typing.Union[str, None] = None, page_size: int = 50,
+                         to_filter: typing.List[SpecWithOperator] = None,
+                         last_id: typing.Union[bson.ObjectId, None] = None) -> typing.List[dict]:
+        """
+        Gets a page of parts sorted by IPN, then by `_id`, see :meth:`E7EPD.page_after`
+        """
+        q = compile_query(part_class, to_filter)
+        cursor = self.part_coll.find(_get_page_filter(q.filter, last_ipn, last_id), collation=q.collation)
+        return await cursor.sort(page_sort).limit(page_size).to_list()
+
+    async def get_all_parts_by_keys(self, part_class: typing.Union[spec.PartSpec, None],
+                                    ret_key: typing.Union[str, list], unique: bool = False) -> list:
+        """
+        Returns all parts in the database, but filtered to only return some keys, see
+        :meth:`E7EPD.get_all_parts_by_keys`
+        """
+        q = compile_query(part_class)
+        if type(ret_key) is list:
+            projection = _get_projection(ret_key)
+            return [{i: d_i.get(i) for i in ret_key} async for d_i in self.part_coll.find(q.filter, projection)]
+        elif unique:
+            return await self.part_coll.distinct(ret_key, q.filter)
+        else:
+            projection = _get_projection([ret_key])
+            return [d.get(ret_key) async for d in self.part_coll.find(q.filter, projection)]
+
+    async def search(self, text: str, limit: int = 50) -> typing.List[dict]:
+        """
+        Searches all string keys of all parts for some words, see :meth:`E7EPD.search`
+        """
+        self.log.debug(f"Searching for {text}")
+        score = {'$meta': 'textScore'}
+        parts = await self.part_coll.find({'$text': {'$search': text}}, {'_score': score}) \
+            .sort([('_score', score)]).limit(limit).to_list()
+        for p in parts:
+            p.pop('_score')
+        return parts
+
+    async def inventory_stats(self, group_by: typing.Sequence[str] = ('type',),
+                              part_class: typing.Union[spec.PartSpec, None] = None,
+                              to_filter: typing.List[SpecWithOperator] = None) -> InventoryStats:
+        """
+        Gets statistics about the parts, calculated by the database in a single request, see
+        :meth:`E7EPD.inventory_stats`
+
+        Raises:
+            InputException: If a group by key is not part of the spec
+        """
+        pipeline, collation = _compile_inventory_stats(group_by, part_class, to_filter)
+        self.log.debug(f"Getting the inventory statistics with {pipeline}")
+        cursor = await self.part_coll.aggregate(pipeline, collation=collation)
+        return _to_inventory_stats(await cursor.next(), group_by, part_class)
+
+    async def add_new_part(self, part_class: spec.PartSpec, new_part: dict):
+        """
+        Adds a new part to the database, see :meth:`E7EPD.add_new_part`
+        """
+        SpecValidator.for_part(part_class).validate(new_part)
+        new_part['type'] = part_class.db_type_name
+        self.log.debug(f"Writing to database: {new_part}")
+
+        async def add(session):
+            await self.part_coll.insert_one(new_part, session=session)
+            await self._log_stock_events(_get_added_events([new_part], self.user), session)
+
+        await self._run_stock_change(add)
+
+    async def add_new_parts(self, part_class: typing.Union[spec.PartSpec, None], parts: typing.Iterable[dict],
+                            ordered: bool = False, batch_size: int = 1000, validate: bool = True) -> BulkInsertResult:
+        """
+        Adds multiple new parts to the database in batches, see :meth:`E7EPD.add_new_parts`
+        """
+        result = BulkInsertResult()
+        for batch in _iter_bulk_batches(part_class, parts, ordered, batch_size, validate, result):
+            if not await self._insert_parts_batch(batch, ordered, result) and ordered:
+                break
+        return result
+
+    async def _insert_parts_batch(self, batch: typing.List[typing.Tuple[int, dict]], ordered: bool,
+                                  result: BulkInsertResult) -> bool:
+        self.log.debug(f"Writing {len(batch)} parts to the database")
+        try:
+            r = await self.part_coll.insert_many([p for _, p in batch], ordered=ordered)
+        except pymongo.errors.BulkWriteError as e:
+            inserted = _add_failed_batch(batch, ordered, e.details, result)
+            await self._log_stock_events(_get_added_events(inserted, self.user))
+            return False
+        await self._log_stock_events(_get_added_events([p for _, p in batch], self.user))
+        result.inserted += len(r.inserted_ids)
+        return True
+
+    async def delete_part(self, part_class: spec.PartSpec, ipn: str):
+        q = {'ipn': ipn, 'type': part_class.db_type_name}
+        self.log.debug(f"Deleting: {q}")
+
+        async def delete(session):
+            d = await self.part_coll.find_one_and_delete(q, projection={'_id': 0, 'stock': 1}, session=session)
+            if d is not None:
+                await self._log_stock_events([self._make_stock_event(ipn, -(d.get('stock') or 0), 0,
+                                                                     reason='deleted')], session)
+
+        await self._run_stock_change(delete)
+
+    async def update_part(self, part_class: typing.Union[spec.PartSpec, None], ipn: str, new_values: dict,
+                          user: str = None, reason: str = None):
+        """
+        Updates a part with a certain type and IPN with some new values, see :meth:`E7EPD.update_part`
+        """
+        q = _prepare_part_update(part_class, ipn, new_values)
+        self.log.debug(f"Updating {q} with {new_values}")
+
+        async def update(session):
+            d = await self.part_coll.find_one_and_update(q, {"$set": new_values}, projection=part_update_projection,
+                                                         session=session)
+            if d is not None and new_values.get('ipn', ipn) != ipn:
+                # Keep the part's stock history
+                rename = {'$set': {'ipn': new_values['ipn']}}
+                await self.events_coll.update_many({'ipn': ipn}, rename, session=session)
+                await self.db['stock_snapshots'].update_many({'ipn': ipn}, rename, session=session)
+            await self._log_stock_events(_get_update_events(d, ipn, new_values, self._get_user(user), reason),
+                                         session)
+
+        await self._run_stock_change(update)
+
+    async def update_part_stock(self, ipn: str, new_qty: int, user: str = None, reason: str = None):
+        await self.update_part(None, ipn, {'stock': new_qty}, user, reason)
+
+    async def adjust_stock(self, ipn: str, delta: int, user: str = None, reason: str = None) -> int:
+        """
+        Atomically adds to or removes from a part's stock, see :meth:`E7EPD.adjust_stock`
+
+        Raises:
+            NegativeStock: If removing the stock will make it negative. The stock is left unchanged
+            EmptyInDatabase: If the part is not in the database
+        """
+        self.log.debug(f"Adjusting stock of {ipn} by {delta}")
+
+        async def adjust(session):
+            r = await self.part_coll.find_one_and_update(_stock_adjust_filter(ipn, delta),
+                                                         _stock_adjust_update(delta),
+                                                         projection={'_id': 0, 'stock': 1},
+                                                         return_document=pymongo.ReturnDocument.AFTER, session=session)
+            if r is not None:
+                await self._log_stock_events([self._make_stock_event(ipn, delta, r['stock'], user, reason)], session)
+            return r
+
+        d = await self._run_stock_change(adjust)
+        if d is None:
+            d = await self.part_coll.find_one({'ipn': ipn}, projection={'_id': 0, 'stock': 1})
+            if d is None:
+                raise EmptyInDatabase()
+            raise NegativeStock(d.get('stock') or 0)
+        return d['stock']
+
+    async def bulk_adjust_stock(self, deltas: typing.Dict[str, int], user: str = None, reason: str = None) -> int:
+        """
+        Adds to or removes from multiple parts' stock with a single write, see :meth:`E7EPD.bulk_adjust_stock`
+        """
+        if len(deltas) == 0:
+            return 0
+
+        async def adjust(session):
+            if session is None:
+                events = []
+                for ipn, delta in deltas.items():
+                    r = await self.part_coll.find_one_and_update(_stock_adjust_filter(ipn, delta),
+                                                                 _stock_adjust_update(delta),
+                                                                 projection={'_id': 0, 'stock': 1},
+                                                                 return_document=pymongo.ReturnDocument.AFTER)
+                    if r is not None:
+                        events.append(self._make_stock_event(ipn, delta, r['stock'], user, reason))
+                await self._log_stock_events(events)
+                return len(events)
+            found = await self.part_coll.find({'ipn': {'$in': list(deltas)}}, {'_id': 0, 'ipn': 1, 'stock': 1},
+                                              session=session).to_list()
+            changes = _get_stock_changes(deltas, found)
+            if len(changes) == 0:
+                return 0
+            r = await self.part_coll.bulk_write(_get_stock_change_ops(changes), ordered=False, session=session)
+            await self._log_stock_events(_get_stock_change_events(changes, self._get_user(user), reason),
+                                         session)
+            return r.matched_count
+
+        matched = await self._run_stock_change(adjust)
+        if matched != len(deltas):
+            self.log.warning(f"Only changed the stock of {matched} out of {len(deltas)} parts")
+        return matched
+
+    def get_part_spec_by_db_name(self, db_name: str):
+        return E7EPD.get_part_spec_by_db_name(db_name)
+
+    async def is_latest_database(self) -> bool:
+        """
+        Returns whether the database is matched with the latest rev
+        """
+        return await self.config.get_db_version() == database_spec_rev
+
+    async def update_database(self):
+        """
+        Updates the database to the most recent revision, see :meth:`E7EPD.update_database`
+        """
+        self.log.info(f"Updating the database from {await self.config.get_db_version()} to {database_spec_rev}")
+        await self.install_validators()
+        await self.config.store_current_db_version()
+
+    async def install_validators(self):
+        """
+        Installs or upgrades the `$jsonSchema` validators of the parts and PCBs collections, see
+        :meth:`E7EPD.install_validators`
+        """
+        for coll_name, options in _get_validators(self.comp_types).items():
+            try:
+                await self.db.command('collMod', coll_name, **options)
+            except pymongo.errors.OperationFailure as e:
+                if e.code != 26:
+                    raise
+                await self.db.create_collection(coll_name, **options)
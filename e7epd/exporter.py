@@ -0,0 +1,147 @@
+"""
+Exporting the parts into CSV, NDJSON or Parquet files, streamed from the database so the memory used doesn't depend on
+the number of parts
+"""
+import csv
+import dataclasses
+import json
+import logging
+import os
+import typing
+
+import e7epd.e707pd_spec as spec
+import e7epd.e7epd
+from e7epd.e7epd import InputException
+
+# Parquet files need the optional pyarrow package
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError as e:
+    pyarrow_available = e
+    """pyarrow_available is None if Parquet exports are available, otherwise it will be the import exception"""
+else:
+    pyarrow_available = None
+
+export_formats = ('csv', 'ndjson', 'parquet')
+# The file name of a part type without a type, like `Others`
+other_type_name = 'other'
+# The file name of an NDJSON export, which has all parts in one file
+ndjson_file_name = 'parts.ndjson'
+
+
+@dataclasses.dataclass
+class ExportFile:
+    """ Dataclass for an exported file """
+    file: str           # The file name, relative to the export directory
+    count: int          # How many parts are in it
+
+
+@dataclasses.dataclass
+class ExportResult:
+    """ Dataclass for the outcome of an export """
+    path: str
+    format: str
+    files: typing.List[ExportFile] = dataclasses.field(default_factory=list)
+
+    @property
+    def count(self) -> int:
+        """ The total number of parts exported """
+        return sum(f.count for f in self.files)
+
+
+def get_type_file_name(part_class: spec.PartSpec) -> str:
+    """ Gets the name, without extension, of a part type's file """
+    return part_class.db_type_name or other_type_name
+
+
+def _get_arrow_schema(part_class: spec.PartSpec) -> 'pyarrow.Schema':
+    """ Makes an Arrow schema from a part spec, with the columns in the spec's display order """
+    arrow_types = {int: pyarrow.int64(), float: pyarrow.float64()}
+    return pyarrow.schema([(k, arrow_types.get(part_class.items[k].input_type, pyarrow.string()))
+                           for k in part_class.table_display_order])
+
+
+def _write_csv(parts: typing.Iterable[dict], file_path: str, columns: typing.Sequence[str]) -> int:
+    """ Streams parts into a CSV file, with a header of the spec keys """
+    count = 0
+    with open(file_path, 'w', newline='', encoding='utf-8') as f:
+        w = csv.writer(f)
+        w.writerow(columns)
+        for p in parts:
+            w.writerow(['' if p.get(k) is None else p[k] for k in columns])
+            count += 1
+    return count
+
+
+def _write_ndjson(parts: typing.Iterable[dict], f: typing.TextIO) -> int:
+    """ Streams parts into an open file, one JSON object per line """
+    count = 0
+    for p in parts:
+        f.write(json.dumps(p, ensure_ascii=False, default=str))
+        f.write('\n')
+        count += 1
+    return count
+
+
+def _write_parquet(parts: typing.Iterable[dict], file_path: str, schema: 'pyarrow.Schema', batch_size: int) -> int:
+    """ Streams parts into a Parquet file, converting `batch_size` parts at a time into an Arrow record batch """
+    count = 0
+    with pyarrow.parquet.ParquetWriter(file_path, schema) as w:
+        batch = []
+        for p in parts:
+            batch.append(p)
+            if len(batch) >= batch_size:
+                w.write_batch(pyarrow.RecordBatch.from_pylist(batch, schema=schema))
+                count += len(batch)
+                batch = []
+        if len(batch) != 0 or count == 0:
+            w.write_batch(pyarrow.RecordBatch.from_pylist(batch, schema=schema))
+            count += len(batch)
+    return count
+
+
+def export_parts(db: 'e7epd.e7epd.E7EPD', path: str, fmt: str = 'csv',
+                 part_classes: typing.Iterable[spec.PartSpec] = None, batch_size: int = 5000) -> ExportResult:
+    """
+    Exports the parts into a directory, see :meth:`E7EPD.export_parts`
+
+    Raises:
+        InputException: If the format is unknown, or Parquet is asked for without pyarrow
+    """
+    log = logging.getLogger('exporter')
+    if fmt not in export_formats:
+        raise InputException(f"Unknown export format {fmt}")
+    if fmt == 'parquet' and pyarrow_available is not None:
+        raise InputException("Exporting to Parquet needs the pyarrow package")
+    if part_classes is None:
+        part_classes = db.comp_types
+    os.makedirs(path, exist_ok=True)
+    log.info(f"Exporting parts to {path} as {fmt}")
+
+    result = ExportResult(path=path, format=fmt)
+    if fmt == 'ndjson':
+        file_path = os.path.join(path, ndjson_file_name)
+        count = 0
+        with open(file_path + '.partial', 'w', encoding='utf-8') as f:
+            for part_class in part_classes:
+                count += _write_ndjson(db.iter_parts(part_class, sort='ipn', batch_size=batch_size,
+                                                     projection={'_id': 0}), f)
+        os.replace(file_path + '.partial', file_path)
+        result.files.append(ExportFile(file=ndjson_file_name, count=count))
+        return result
+
+    for part_class in part_classes:
+        file_name = f"{get_type_file_name(part_class)}.{fmt}"
+        file_path = os.path.join(path, file_name)
+        columns = part_class.table_display_order
+        parts = db.iter_parts(part_class, sort='ipn', batch_size=batch_size, projection=list(columns))
+        # Each file is written under a temporary name, and only renamed once complete
+        if fmt == 'csv':
+            count = _write_csv(parts, file_path + '.partial', columns)
+        else:
+            count = _write_parquet(parts, file_path + '.partial', _get_arrow_schema(part_class), batch_size)
+        os.replace(file_path + '.partial', file_path)
+        log.debug(f"Exported {count} parts into {file_name}")
+        result.files.append(ExportFile(file=file_name, count=count))
+    return result
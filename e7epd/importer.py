@@ -0,0 +1,322 @@
+"""
+Importing parts from a CSV file, streamed a chunk of rows at a time, with the columns mapped to part keys by a profile
+that can be saved as JSON and reused
+"""
+import csv
+import dataclasses
+import json
+import logging
+import os
+import time
+import typing
+
+import e7epd.e707pd_spec as spec
+import e7epd.e7epd
+import e7epd.units
+from e7epd.e7epd import InputException, BulkRowError, SpecValidator
+from e7epd.exporter import get_type_file_name
+
+# The key a column is mapped to for it to be the part type
+type_key = 'type'
+
+
+@dataclasses.dataclass
+class ImportProfile:
+    """
+    Dataclass for how a CSV file's columns map to part keys, and its part type text to part types.
+
+    Part types are given by their name, which is their database type name, or `other` for :data:`spec.Others`.
+    A profile is saved with :meth:`save` and loaded with :meth:`load`, to import similar files without being asked
+    for the mapping again
+    """
+    # The CSV header to the key for all part types, like `ipn` or `stock`, or `type` for the part type's column
+    columns: typing.Dict[str, str] = dataclasses.field(default_factory=dict)
+    # The part type name to the CSV header to key, for the keys specific to that part type
+    type_columns: typing.Dict[str, typing.Dict[str, str]] = dataclasses.field(default_factory=dict)
+    # The part type column's text to the part type name
+    types: typing.Dict[str, str] = dataclasses.field(default_factory=dict)
+    # The part type name for all rows, if there is no part type column (like for a file from the CSV exporter)
+    default_type: typing.Union[str, None] = None
+
+    def get_type_column(self) -> typing.Union[str, None]:
+        """ Gets the header of the part type's column, if any """
+        for h, k in self.columns.items():
+            if k == type_key:
+                return h
+        return None
+
+    def to_dict(self) -> dict:
+        return dataclasses.asdict(self)
+
+    @classmethod
+    def from_dict(cls, d: dict) -> 'ImportProfile':
+        return cls(**d)
+
+    def save(self, path: str):
+        """ Saves the profile as a JSON file """
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=4)
+
+    @classmethod
+    def load(cls, path: str) -> 'ImportProfile':
+        """
+        Loads a profile from a JSON file
+
+        Raises:
+            InputException: If the file can't be read, or isn't a profile
+        """
+        try:
+            with open(path, 'r') as f:
+                return cls.from_dict(json.load(f))
+        except (OSError, ValueError, TypeError) as e:
+            raise InputException(f"Unable to load the import profile {path}: {e}")
+
+
+@dataclasses.dataclass
+class ImportProgress:
+    """ Dataclass for how far along an import is """
+    rows: int               # The rows read so far
+    inserted: int           # The parts added so far
+    errors: int             # The rows that could not be added so far
+    elapsed: float          # Seconds since the import started
+    fraction: float         # About how much of the file was read, from 0 to 1
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.elapsed if self.elapsed > 0 else 0.0
+
+
+@dataclasses.dataclass
+class ImportResult:
+    """
+    Dataclass for the outcome of an import. The index of each error is the row's index in the file, not counting
+    the header
+    """
+    rows: int = 0
+    inserted: int = 0
+    errors: typing.List[BulkRowError] = dataclasses.field(default_factory=list)
+    elapsed: float = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.elapsed if self.elapsed > 0 else 0.0
+
+
+def get_part_class_by_name(name: str) -> spec.PartSpec:
+    """
+    Gets a part spec from its name, see :class:`ImportProfile`
+
+    Raises:
+        InputException: If there is no part type with that name
+    """
+    for i in e7epd.e7epd.E7EPD.comp_types:
+        if get_type_file_name(i) == name:
+            return i
+    raise InputException(f"Unknown part type {name}")
+
+
+def parse_value(text: str, input_type: type, unit: str = ''):
+    """
+    Converts a CSV cell to a key's type. Numbers can be in engineering notation, and end with the key's unit. Whole
+    numbers, like the stock, must not have a fraction once converted, so `1.5k` is accepted but `2.7` isn't
+
+    Returns: The value, or None if the cell is empty
+
+    Raises:
+        InputException: If the text can't be converted
+    """
+    text = text.strip()
+    if text == '':
+        return None
+    if input_type is str:
+        return text
+    if input_type in (float, int):
+        try:
+            value = e7epd.units.parse(text, unit)
+        except ValueError:
+            raise InputException(f"Cannot convert {text} to a number")
+        if input_type is int:
+            if not value.is_integer():
+                raise InputException(f"{text} is not a whole number")
+            return int(value)
+        return value
+    try:
+        return input_type(text)
+    except ValueError:
+        raise InputException(f"Cannot convert {text} to {input_type.__name__}")
+
+
+class _CountingLines:
+    """ Iterates over a file's lines, keeping count of how many characters were read """
+    def __init__(self, f: typing.TextIO):
+        self.f = f
+        self.position = 0
+
+    def __iter__(self):
+        for line in self.f:
+            self.position += len(line)
+            yield line
+
+
+class _RowConverter:
+    """ Converts CSV rows into parts with a profile, gathering the columns of each part type once """
+    def __init__(self, profile: ImportProfile, header: typing.List[str],
+                 resolve_type: typing.Union[typing.Callable[[str], typing.Union[spec.PartSpec, None]], None]):
+        self.profile = profile
+        self.header = header
+        self.resolve_type = resolve_type
+        self.header_index = {h: i for i, h in enumerate(header)}
+        type_column = profile.get_type_column()
+        self.type_index = None if type_column is None else self.header_index[type_column]
+        self.ipn_index = None
+        for h, k in profile.columns.items():
+            if k == 'ipn':
+                self.ipn_index = self.header_index[h]
+        # The part type name to its spec, and its (column index, key, type, unit) for each mapped column
+        self._classes = {}          # type: typing.Dict[str, spec.PartSpec]
+        self._columns = {}          # type: typing.Dict[str, typing.List[typing.Tuple[int, str, type, str]]]
+        # The part type text that `resolve_type` returned None for, so it's only asked once
+        self._skipped_types = set()     # type: typing.Set[str]
+
+    def get_ipn(self, row: typing.List[str]) -> typing.Union[str, None]:
+        if self.ipn_index is None or self.ipn_index >= len(row):
+            return None
+        return row[self.ipn_index]
+
+    def _get_type_name(self, row: typing.List[str]) -> str:
+        if self.type_index is None:
+            return self.profile.default_type
+        text = row[self.type_index].strip()
+        name = self.profile.types.get(text)
+        if name is None and self.resolve_type is not None and text not in self._skipped_types:
+            part_class = self.resolve_type(text)
+            if part_class is not None:
+                name = get_type_file_name(part_class)
+                self.profile.types[text] = name
+            else:
+                self._skipped_types.add(text)
+        if name is None:
+            raise InputException(f"Unknown part type {text}")
+        return name
+
+    def _get_columns(self, name: str) -> typing.List[typing.Tuple[int, str, type, str]]:
+        part_class = self._classes[name]
+        columns = []
+        mapping = {**self.profile.columns, **self.profile.type_columns.get(name, {})}
+        for h, k in mapping.items():
+            if k is None or k == type_key:
+                continue
+            if h not in self.header_index:
+                raise InputException(f"The profile's column {h} is not in the file")
+            if k not in part_class.items:
+                raise InputException(f"Key {k} of column {h} is not part of the {part_class.showcase_name} spec")
+            columns.append((self.header_index[h], k, part_class.items[k].input_type, part_class.items[k].units))
+        return columns
+
+    def convert(self, row: typing.List[str]) -> typing.Tuple[spec.PartSpec, dict]:
+        """
+        Converts a row into a part, without validating it
+
+        Raises:
+            InputException: If the row's length, part type or a value is wrong
+        """
+        if len(row) != len(self.header):
+            raise InputException(f"The row has {len(row)} columns, while the header has {len(self.header)}")
+        name = self._get_type_name(row)
+        if name not in self._columns:
+            self._classes[name] = get_part_class_by_name(name)
+            self._columns[name] = self._get_columns(name)
+        part = {}
+        for i, k, t, unit in self._columns[name]:
+            try:
+                v = parse_value(row[i], t, unit)
+            except InputException as e:
+                raise InputException(f"{e}, for {k} in column {self.header[i]}")
+            if v is not None:
+                part[k] = v
+        return self._classes[name], part
+
+
+def _import_chunk(db: 'e7epd.e7epd.E7EPD', chunk: typing.List[typing.Tuple[int, spec.PartSpec, dict]],
+                  result: ImportResult):
+    """ Validates a chunk of parts per part type, then adds the valid ones in one batch """
+    by_class = {}           # type: typing.Dict[str, typing.List[typing.Tuple[int, spec.PartSpec, dict]]]
+    for c in chunk:
+        by_class.setdefault(c[1].db_type_name, []).append(c)
+    to_add = []             # type: typing.List[typing.Tuple[int, dict]]
+    for rows in by_class.values():
+        errors = SpecValidator.for_part(rows[0][1]).validate_many([p for _, _, p in rows])
+        invalid = set()
+        for e in errors:
+            if e.index not in invalid:
+                invalid.add(e.index)
+                result.errors.append(BulkRowError(rows[e.index][0], e.ipn, e.message))
+        to_add += [(row_i, {**p, 'type': part_class}) for i, (row_i, part_class, p) in enumerate(rows)
+                   if i not in invalid]
+    if len(to_add) == 0:
+        return
+    r = db.add_new_parts(None, [p for _, p in to_add], batch_size=len(to_add), validate=False)
+    result.inserted += r.inserted
+    for e in r.errors:
+        result.errors.append(BulkRowError(to_add[e.index][0], e.ipn, e.message))
+
+
+def import_csv(db: 'e7epd.e7epd.E7EPD', path: str, profile: ImportProfile, chunk_size: int = 1000,
+               resolve_type: typing.Callable[[str], typing.Union[spec.PartSpec, None]] = None,
+               progress: typing.Callable[[ImportProgress], None] = None) -> ImportResult:
+    """
+    Imports parts from a CSV file, see :meth:`E7EPD.import_csv`
+
+    Raises:
+        InputException: If the file can't be read, or the profile doesn't match the file
+    """
+    log = logging.getLogger('importer')
+    for k, i in spec.BasePartItems.items():
+        if i.required and k not in profile.columns.values():
+            raise InputException(f"The required key {k} is not mapped to a column")
+    if profile.get_type_column() is None and profile.default_type is None:
+        raise InputException("There is no part type column, and no default part type")
+    try:
+        size = os.path.getsize(path)
+        f = open(path, 'r', newline='', encoding='utf-8-sig')
+    except OSError as e:
+        raise InputException(f"Unable to open {path}: {e}")
+
+    log.info(f"Importing parts from {path}")
+    result = ImportResult()
+    start = time.perf_counter()
+    with f:
+        lines = _CountingLines(f)
+        reader = csv.reader(lines)
+        header = next(reader, None)
+        if header is None:
+            raise InputException(f"{path} is empty")
+        header = [h.strip() for h in header]
+        for h in profile.columns:
+            if h not in header:
+                raise InputException(f"The profile's column {h} is not in the file")
+        converter = _RowConverter(profile, header, resolve_type)
+
+        chunk = []          # type: typing.List[typing.Tuple[int, spec.PartSpec, dict]]
+        for row_i, row in enumerate(reader):
+            result.rows += 1
+            try:
+                part_class, part = converter.convert(row)
+            except InputException as e:
+                result.errors.append(BulkRowError(row_i, converter.get_ipn(row), str(e)))
+            else:
+                chunk.append((row_i, part_class, part))
+            if len(chunk) >= chunk_size:
+                _import_chunk(db, chunk, result)
+                chunk = []
+                if progress is not None:
+                    progress(ImportProgress(result.rows, result.inserted, len(result.errors),
+                                            time.perf_counter() - start, min(lines.position / max(size, 1), 1.0)))
+        if len(chunk) != 0:
+            _import_chunk(db, chunk, result)
+    result.elapsed = time.perf_counter() - start
+    result.errors.sort(key=lambda e: e.index)
+    if progress is not None:
+        progress(ImportProgress(result.rows, result.inserted, len(result.errors), result.elapsed, 1.0))
+    log.info(f"Imported {result.inserted} parts out of {result.rows} rows in {result.elapsed:.1f}s")
+    return result
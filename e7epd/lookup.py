@@ -0,0 +1,255 @@
+"""
+In-memory indexes for quickly looking up parts, like autocompleting IPNs
+"""
+import bisect
+import collections
+import dataclasses
+import heapq
+import math
+import re
+import typing
+
+import e7epd.e707pd_spec as spec
+
+
+class IPNIndex:
+    """
+    An in-memory index of all IPNs and their part type, for autocompletion.
+
+    The IPNs are kept sorted (case-insensitively) so completing by prefix is a binary search, both for all parts and
+    per part type. Getting an IPN's type is a dict lookup.
+    """
+    def __init__(self, parts: typing.Iterable[dict] = ()):
+        """
+        Args:
+            parts: The parts to start with, where each has at least the `ipn` and `type` keys
+        """
+        self._types = {}        # type: typing.Dict[str, typing.Union[str, None]]
+        for p in parts:
+            self._types[p['ipn']] = p.get('type')
+        # Sorted lists of (upper-case IPN, IPN), for all parts and per type
+        self._sorted = sorted((i.upper(), i) for i in self._types)
+        self._sorted_by_type = {}       # type: typing.Dict[typing.Union[str, None], typing.List[typing.Tuple[str, str]]]
+        for k in self._sorted:
+            self._sorted_by_type.setdefault(self._types[k[1]], []).append(k)
+
+    def __len__(self):
+        return len(self._types)
+
+    def __contains__(self, ipn: str):
+        return ipn in self._types
+
+    def _get_sorted(self, part_class: typing.Union[spec.PartSpec, None]) -> typing.List[typing.Tuple[str, str]]:
+        if part_class is None:
+            return self._sorted
+        return self._sorted_by_type.get(part_class.db_type_name, [])
+
+    def add(self, ipn: str, part_type: typing.Union[str, None]):
+        """
+        Adds an IPN to the index, or updates its type if it already exists
+
+        Args:
+            ipn: The IPN to add
+            part_type: The part's database type name
+        """
+        if ipn in self._types:
+            self.remove(ipn)
+        self._types[ipn] = part_type
+        k = (ipn.upper(), ipn)
+        bisect.insort(self._sorted, k)
+        bisect.insort(self._sorted_by_type.setdefault(part_type, []), k)
+
+    def remove(self, ipn: str):
+        """ Removes an IPN from the index, if it exists """
+        if ipn not in self._types:
+            return
+        part_type = self._types.pop(ipn)
+        k = (ipn.upper(), ipn)
+        for li in [self._sorted, self._sorted_by_type[part_type]]:
+            i = bisect.bisect_left(li, k)
+            if i < len(li) and li[i] == k:
+                del li[i]
+
+    def get_type(self, ipn: str) -> typing.Union[str, None]:
+        """
+        Gets the database type name of an IPN
+
+        Raises:
+            KeyError: If the IPN is not in the index
+        """
+        return self._types[ipn]
+
+    def ipns(self, part_class: spec.PartSpec = None) -> typing.List[str]:
+        """ Returns all IPNs sorted, optionally only for a part type """
+        return [i[1] for i in self._get_sorted(part_class)]
+
+    def complete(self, prefix: str, limit: int = 50, part_class: spec.PartSpec = None) -> typing.List[str]:
+        """
+        Gets the IPNs starting with a prefix, case-insensitively
+
+        Args:
+            prefix: The start of the IPN
+            limit: The maximum number of IPNs to return
+            part_class: Optionally only complete IPNs of this part type
+        """
+        li = self._get_sorted(part_class)
+        prefix = prefix.upper()
+        ret = []
+        for i in range(bisect.bisect_left(li, (prefix,)), len(li)):
+            if len(ret) >= limit or not li[i][0].startswith(prefix):
+                break
+            ret.append(li[i][1])
+        return ret
+
+    def search(self, text: str, limit: int = 50, part_class: spec.PartSpec = None) -> typing.List[str]:
+        """
+        Gets the IPNs that contain some text, case-insensitively. IPNs that start with the text are returned first
+
+        Args:
+            text: The text to look for
+            limit: The maximum number of IPNs to return
+            part_class: Optionally only search IPNs of this part type
+        """
+        ret = self.complete(text, limit, part_class)
+        if len(ret) >= limit:
+            return ret
+        text = text.upper()
+        for k, ipn in self._get_sorted(part_class):
+            if text in k and not k.startswith(text):
+                ret.append(ipn)
+                if len(ret) >= limit:
+                    break
+        return ret
+
+
+# Packaging and ordering suffixes that don't change what a part is, removed before comparing part numbers
+part_number_suffixes = ('/NOPB', '#TRPBF', '#PBF', '-REEL7', '-REEL', '-TR', '/TR', '-ND', '-CT', '-DKR')
+
+_non_alnum_regex = re.compile(r'[^0-9A-Z]')
+
+
+def normalize_part_number(pn: str) -> str:
+    """
+    Normalises a part number for comparing, by upper-casing it, removing packaging suffixes like ``-TR`` or ``/NOPB``,
+    then removing anything that isn't a letter or digit
+    """
+    pn = pn.strip().upper()
+    stripped = True
+    while stripped:
+        stripped = False
+        for suffix in part_number_suffixes:
+            if pn.endswith(suffix) and len(pn) > len(suffix):
+                pn = pn[:-len(suffix)]
+                stripped = True
+    return _non_alnum_regex.sub('', pn)
+
+
+def get_trigrams(pn: str) -> typing.FrozenSet[str]:
+    """ Gets the set of trigrams of a normalised part number, padded so the start and end count more """
+    pn = f"$${pn}$"
+    return frozenset(pn[i:i+3] for i in range(len(pn) - 2))
+
+
+@dataclasses.dataclass
+class SimilarPart:
+    """ A part with a part number similar to the one searched for """
+    ipn: str
+    mfg_part_numb: typing.Optional[str]
+    similarity: float       # From 0 to 1, where 1 means the normalised part numbers are the same
+
+
+class PartNumberIndex:
+    """
+    An in-memory trigram index of all IPNs and manufacturer part numbers, for finding near duplicate parts.
+
+    Part numbers are normalised with :func:`normalize_part_number`, then split into trigrams. The similarity between
+    two part numbers is the Jaccard index of their trigrams, and a part's similarity is the highest of its IPN's and
+    manufacturer part number's.
+    """
+    _fields = ('ipn', 'mfg_part_numb')
+
+    def __init__(self, parts: typing.Iterable[dict] = ()):
+        """
+        Args:
+            parts: The parts to start with, where each has at least the `ipn` key, and optionally `mfg_part_numb`
+        """
+        self._mfg_part_numbs = {}       # type: typing.Dict[str, typing.Union[str, None]]
+        # The trigrams of each (IPN, field), and the (IPN, field)s having each trigram
+        self._trigrams = {}             # type: typing.Dict[typing.Tuple[str, str], typing.FrozenSet[str]]
+        self._postings = {}             # type: typing.Dict[str, typing.Set[typing.Tuple[str, str]]]
+        for p in parts:
+            self.add(p['ipn'], p.get('mfg_part_numb'))
+
+    def __len__(self):
+        return len(self._mfg_part_numbs)
+
+    def __contains__(self, ipn: str):
+        return ipn in self._mfg_part_numbs
+
+    def add(self, ipn: str, mfg_part_numb: typing.Union[str, None]):
+        """
+        Adds a part to the index, or updates its manufacturer part number if it already exists
+
+        Args:
+            ipn: The part's IPN
+            mfg_part_numb: The part's manufacturer part number
+        """
+        if ipn in self._mfg_part_numbs:
+            self.remove(ipn)
+        self._mfg_part_numbs[ipn] = mfg_part_numb
+        for field, pn in zip(self._fields, (ipn, mfg_part_numb)):
+            if not pn:
+                continue
+            k = (ipn, field)
+            self._trigrams[k] = get_trigrams(normalize_part_number(pn))
+            for g in self._trigrams[k]:
+                self._postings.setdefault(g, set()).add(k)
+
+    def remove(self, ipn: str):
+        """ Removes a part from the index, if it exists """
+        if ipn not in self._mfg_part_numbs:
+            return
+        del self._mfg_part_numbs[ipn]
+        for field in self._fields:
+            k = (ipn, field)
+            for g in self._trigrams.pop(k, ()):
+                self._postings[g].discard(k)
+                if len(self._postings[g]) == 0:
+                    del self._postings[g]
+
+    def find(self, pn: typing.Union[str, None], k: int = 5, min_similarity: float = 0.3) -> typing.List[SimilarPart]:
+        """
+        Finds the parts with an IPN or manufacturer part number most similar to a part number
+
+        Args:
+            pn: The part number to look for
+            k: The maximum number of parts to return
+            min_similarity: The minimum similarity, from 0 to 1, for a part to be returned
+
+        Returns: The most similar parts, most similar first. Empty if the part number is empty or None, or has no
+                 letters or digits
+        """
+        normalized = normalize_part_number(pn) if pn else ''
+        if normalized == '':
+            return []
+        q = get_trigrams(normalized)
+        # A part needs at least `min_similarity * len(q)` trigrams in common, so only a part with one of the rarest
+        # trigrams can be similar enough. The others are only counted for the parts found by those
+        grams = sorted(q, key=lambda i: len(self._postings.get(i, ())))
+        n_rarest = len(q) - math.ceil(min_similarity * len(q)) + 1
+        shared = collections.Counter()
+        for g in grams[:n_rarest]:
+            shared.update(self._postings.get(g, ()))
+        for g in grams[n_rarest:]:
+            posting = self._postings.get(g, ())
+            if len(posting) < len(shared):
+                shared.update(key for key in posting if key in shared)
+            else:
+                shared.update([key for key in shared if key in posting])
+        best = {}       # type: typing.Dict[str, float]
+        for key, n in shared.items():
+            sim = n / (len(q) + len(self._trigrams[key]) - n)
+            if sim >= min_similarity and sim > best.get(key[0], 0):
+                best[key[0]] = sim
+        top = heapq.nlargest(k, best.items(), key=lambda i: i[1])
+        return [SimilarPart(ipn, self._mfg_part_numbs[ipn], sim) for ipn, sim in top]
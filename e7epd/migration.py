@@ -8,6 +8,7 @@ import logging
 import pkg_resources
 import pymongo
 import pymongo.database
+from e7epd.e7epd import E7EPD
 try:
     import sqlalchemy
     import sqlalchemy.future
@@ -303,8 +304,7 @@ def update_06_to_07(mongo_conn: pymongo.database.Database, sql_info: dict):
                 log.debug(f"New part: {new_part}")
                 all_new_parts.append(new_part)
 
-    # return
-
-    coll = mongo_conn['parts']
-    coll.insert_many(all_new_parts)
-    log.info("Done with migration!")
+    r = E7EPD(mongo_conn).add_new_parts(None, all_new_parts)
+    for err in r.errors:
+        log.error(f"Unable to migrate part {err.ipn}: {err.message}")
+    log.info(f"Done with migration! Migrated {r.inserted} out of {len(all_new_parts)} parts")
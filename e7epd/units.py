@@ -0,0 +1,175 @@
+"""
+Parsing and formatting numbers in engineering notation, like `4.7k`, `4k7`, `100nF` or `10 kΩ`.
+
+This does what `EngNumber` is used for, without going through `Decimal`: the parser is a compiled regular expression,
+and the formatter works on the number's digits, with the results of both cached as the same values come up again and
+again in a parts database
+"""
+import functools
+import math
+import re
+import typing
+
+import e7epd.e707pd_spec as spec
+
+# The power of 10 of each SI prefix. `R` is for values like `4R7`, where it's the decimal point
+prefixes = {
+    'y': -24, 'z': -21, 'a': -18, 'f': -15, 'p': -12, 'n': -9, 'u': -6, 'µ': -6, 'μ': -6, 'm': -3,
+    'R': 0, 'k': 3, 'K': 3, 'M': 6, 'G': 9, 'T': 12, 'P': 15, 'E': 18,
+}
+# The prefix for each power of 10 when formatting, the same as `EngNumber`'s
+format_prefixes = {
+    -30: 'q', -27: 'r', -24: 'y', -21: 'z', -18: 'a', -15: 'f', -12: 'p', -9: 'n', -6: 'u', -3: 'm', 0: '',
+    3: 'k', 6: 'M', 9: 'G', 12: 'T', 15: 'P', 18: 'E', 21: 'Z', 27: 'R', 30: 'Q',
+}
+
+# Other ways to write a unit. Units are matched ignoring case
+unit_aliases = {
+    spec.UnicodeCharacters.Omega.value: ('ohms', 'ohm', '\u2126'),
+}
+# Every unit used by the part specs
+spec_units = frozenset(i.units for c in vars(spec).values() if isinstance(c, spec.PartSpec)
+                       for i in c.items.values() if i.units)
+
+_number_pattern = r'(?P<sign>[+-]?)(?P<int>\d*)(?:\.(?P<frac>\d*))?(?:[eE](?P<exp>[+-]?\d+))?'
+_prefix_pattern = r'(?:(?P<prefix>[' + ''.join(prefixes) + r'])(?P<digits>\d*))?'
+_digits_regex = re.compile(r'^(-?)(\d*)\.?(\d*)(?:[eE]([+-]?\d+))?$')
+# The floats closest to each power of 10, parsed from text so they compare like the numbers' shortest text does
+_powers_of_10 = {i: float(f'1e{i}') for i in range(-40, 41)}
+
+# How many parsed and formatted values to keep
+cache_size = 4096
+
+
+@functools.lru_cache(maxsize=None)
+def _get_regex(unit: typing.Union[str, None]) -> typing.Pattern:
+    """ Compiles the regex for numbers with a unit, or with any of the spec's units if None """
+    if unit is None:
+        units = set(spec_units)
+    elif unit == '':
+        units = set()
+    else:
+        units = {unit}
+    for u in list(units):
+        units.update(unit_aliases.get(u, ()))
+    unit_pattern = ''
+    if len(units) != 0:
+        # Longer units first, so `Hz` is not matched as `H`
+        unit_pattern = '(?i:' + '|'.join(re.escape(u) for u in sorted(units, key=len, reverse=True)) + ')?'
+    return re.compile(rf'^\s*{_number_pattern}\s*{_prefix_pattern}\s*{unit_pattern}\s*$')
+
+
+@functools.lru_cache(maxsize=cache_size)
+def parse(text: str, unit: typing.Union[str, None] = None) -> float:
+    """
+    Parses a number in engineering notation, which can have an SI prefix (`4.7k`), use the prefix as the decimal
+    point (`4k7`, or `4R7` for 4.7), and end with a unit (`100nF`).
+
+    Prefixes are case-sensitive (`m` is milli and `M` is mega), and are matched before units, so `1f` is one femto.
+    Units are matched ignoring case, with `ohm` and `ohms` also accepted for `Ω`
+
+    Args:
+        text: The text to parse
+        unit: The unit the number can end with, usually a :class:`SpecLineItem`'s `units`. If None, any of the specs'
+              units is accepted, and if empty no unit is
+
+    Raises:
+        ValueError: If the text is not a number in engineering notation
+    """
+    m = _get_regex(unit).match(text)
+    if m is None:
+        raise ValueError(f"{text} is not an engineering number")
+    int_part, frac, exp, prefix, digits = m.group('int', 'frac', 'exp', 'prefix', 'digits')
+    if not (int_part or frac or digits) or (digits and (frac is not None or exp is not None)):
+        raise ValueError(f"{text} is not an engineering number")
+    power = int(exp or 0) + (prefixes[prefix] if prefix else 0)
+    return float(f"{m.group('sign')}{int_part or '0'}.{frac or ''}{digits or ''}e{power:d}")
+
+
+def parse_many(texts: typing.Iterable[str], unit: typing.Union[str, None] = None) -> typing.List[float]:
+    """
+    Parses many numbers with the same unit, see :func:`parse`
+
+    Raises:
+        ValueError: At the first text that is not a number in engineering notation
+    """
+    return [parse(t, unit) for t in texts]
+
+
+def _round_half_even(digits: str, keep: int) -> str:
+    """ Rounds a string of digits to its first `keep` digits, rounding ties to the even digit like `Decimal` """
+    kept, rest = digits[:keep], digits[keep:]
+    if rest == '' or rest[0] < '5':
+        return kept
+    if rest[0] == '5' and rest[1:].strip('0') == '' and (kept == '' or kept[-1] in '02468'):
+        return kept
+    return str(int(kept or '0') + 1).rjust(len(kept), '0')
+
+
+def _format_digits(value: typing.Union[float, int], precision: int) -> str:
+    """ Formats a number by rounding the digits of its text, like `EngNumber` does with `Decimal` """
+    m = _digits_regex.match(str(value))
+    if m is None:
+        # Like inf or nan
+        return str(value)
+    sign, int_part, frac, exp = m.groups()
+    digits = (int_part + frac).lstrip('0')
+    if digits == '':
+        sign = ''
+        base = '0.' + '0' * precision if precision > 0 else '0'
+        power = 0
+    else:
+        # The power of 10 of the first digit, then the engineering power at or below it
+        if int_part.strip('0') != '':
+            adjusted = len(int_part.lstrip('0')) - 1 + int(exp or 0)
+        else:
+            adjusted = len(frac.lstrip('0')) - len(frac) - 1 + int(exp or 0)
+        power = adjusted - adjusted % 3
+        n_int = adjusted - power + 1
+        rounded = _round_half_even(digits.rstrip('0').ljust(n_int + precision, '0'), n_int + precision)
+        # Rounding up can carry into a new digit, like 999.995 to 1000.00, which stays with the same prefix
+        n_int += len(rounded) - (n_int + precision)
+        base = rounded[:n_int] + ('.' + rounded[n_int:] if precision > 0 else '')
+    if precision == 2 and base.endswith('.00'):
+        base = base[:-3]
+    if power not in format_prefixes:
+        raise ValueError(f"{value} is too large or small for an SI prefix")
+    return sign + base + format_prefixes[power]
+
+
+@functools.lru_cache(maxsize=cache_size)
+def format_eng(value: typing.Union[float, int], precision: int = 2) -> str:
+    """
+    Formats a number in engineering notation, giving the same text as `str(EngNumber(value))`, like `4.70k` or `100n`
+
+    Args:
+        value: The number
+        precision: How many decimals to keep. With 2, `.00` is removed, like `EngNumber` does by default
+    """
+    a = abs(value)
+    if not 1e-30 <= a < 1e33 or (type(value) is int and a > 2 ** 53):
+        return _format_digits(value, precision)
+    adjusted = math.floor(math.log10(a))
+    # log10 can be off by one right at a power of 10
+    if a >= _powers_of_10[adjusted + 1]:
+        adjusted += 1
+    elif a < _powers_of_10[adjusted]:
+        adjusted -= 1
+    power = adjusted - adjusted % 3
+    if power not in format_prefixes:
+        return _format_digits(value, precision)
+    scaled = value / _powers_of_10[power]
+    # Dividing isn't exact, which only changes the rounding when the value is about halfway between two roundings
+    shifted = abs(scaled) * 10 ** precision
+    if abs(shifted - math.floor(shifted) - 0.5) < 1e-6:
+        return _format_digits(value, precision)
+    base = f"{scaled:.{precision}f}"
+    if precision == 2 and base.endswith('.00'):
+        base = base[:-3]
+    return base + format_prefixes[power]
+
+
+def format_many(values: typing.Iterable[typing.Union[float, int, None]], precision: int = 2) -> \
+        typing.List[typing.Union[str, None]]:
+    """ Formats many numbers in engineering notation, see :func:`format_eng`. None stays None """
+    return [None if v is None else format_eng(v, precision) for v in values]
@@ -0,0 +1,117 @@
+"""
+Tests for the full and incremental backups, and restoring them. These need a replica set (a single-node one is
+enough) for the change stream, given with the `E7EPD_TEST_MONGO_URI` environment variable, and are skipped otherwise
+"""
+import os
+import uuid
+
+import pymongo
+import pymongo.errors
+import pytest
+
+import e7epd
+import e7epd.backup
+
+mongo_uri = os.environ.get('E7EPD_TEST_MONGO_URI')
+
+pytestmark = pytest.mark.skipif(mongo_uri is None,
+                                reason="Set E7EPD_TEST_MONGO_URI to a replica set to run the backup tests")
+
+
+@pytest.fixture
+def make_db():
+    """ Creates E7EPD objects on new databases, which are dropped after the test """
+    client = pymongo.MongoClient(mongo_uri)
+    names = []
+
+    def make() -> e7epd.E7EPD:
+        name = f"e7epd_test_{uuid.uuid4().hex}"
+        names.append(name)
+        db = e7epd.E7EPD(client[name])
+        if not db.is_replica_set():
+            pytest.skip("E7EPD_TEST_MONGO_URI is not a replica set")
+        return db
+
+    yield make
+    for name in names:
+        client.drop_database(name)
+    client.close()
+
+
+@pytest.fixture
+def db(make_db) -> e7epd.E7EPD:
+    db = make_db()
+    db.add_new_parts(e7epd.spec.Resistor, [{'ipn': f'R{i}', 'stock': i, 'package': '0603', 'resistance': float(i)}
+                                           for i in range(10)])
+    return db
+
+
+def get_docs(db: e7epd.E7EPD, collection: str) -> list:
+    return list(db.db[collection].find({}, sort=[('_id', 1)]))
+
+
+def test_incremental_restore_replace(db, make_db, tmp_path):
+    path = str(tmp_path / 'backup')
+    db.backup_db(path)
+    events_before = db.events_coll.count_documents({})
+
+    db.add_new_part(e7epd.spec.Resistor, {'ipn': 'NEW', 'stock': 1, 'package': '0805', 'resistance': 10.0})
+    db.adjust_stock('R1', 5)
+    db.adjust_stock('R1', 5)
+    db.update_part(None, 'R2', {'comments': 'updated'})
+    db.delete_part(e7epd.spec.Resistor, 'R3')
+
+    delta = db.backup_db_incremental(path)
+    assert delta is not None
+    # The two stock changes of R1 are backed up once, as its latest version, along with each new stock event
+    assert delta.count == 4 + db.events_coll.count_documents({}) - events_before
+    assert db.backup_db_incremental(path) is None
+
+    manifest = e7epd.backup.read_manifest(path)
+    assert [d.file for d in manifest.deltas] == [delta.file]
+
+    dst = make_db()
+    dst.add_new_part(e7epd.spec.Resistor, {'ipn': 'OTHER', 'stock': 1, 'package': '0603', 'resistance': 1.0})
+    result = dst.restore(path, mode='replace')
+    assert result.deltas[delta.file].deleted == 1
+    assert len(result.deltas[delta.file].errors) == 0
+
+    assert get_docs(dst, 'parts') == get_docs(db, 'parts')
+    assert get_docs(dst, 'stock_events') == get_docs(db, 'stock_events')
+    assert dst.get_part_by_ipn('R1')['stock'] == 11
+    assert dst.get_part_by_ipn('R2')['comments'] == 'updated'
+    assert not dst.check_if_already_in_db_by_ipn('R3')
+    assert not dst.check_if_already_in_db_by_ipn('OTHER')
+
+
+def test_incremental_after_drop(db, tmp_path):
+    path = str(tmp_path / 'backup')
+    db.backup_db(path)
+    db.db.drop_collection('parts')
+
+    with pytest.raises(e7epd.InputException, match="take a new full backup"):
+        db.backup_db_incremental(path)
+    # The archive is left as it was, so the next full backup is the only way forward
+    assert len(e7epd.backup.read_manifest(path).deltas) == 0
+
+
+def test_incremental_history_lost(db, tmp_path, monkeypatch):
+    path = str(tmp_path / 'backup')
+    db.backup_db(path)
+
+    def get_change_stream(*args, **kwargs):
+        raise pymongo.errors.OperationFailure("Resume of change stream was not possible", code=286)
+
+    monkeypatch.setattr(e7epd.backup, '_get_change_stream', get_change_stream)
+    with pytest.raises(e7epd.InputException, match="no longer in the oplog"):
+        db.backup_db_incremental(path)
+
+
+def test_incremental_needs_resume_token(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(db, 'is_replica_set', lambda: False)
+    path = str(tmp_path / 'backup')
+    manifest = db.backup_db(path)
+    assert manifest.resume_token is None
+
+    with pytest.raises(e7epd.InputException, match="no change stream position"):
+        db.backup_db_incremental(path)
@@ -0,0 +1,108 @@
+""" Tests for converting CSV rows into parts when importing """
+import pytest
+
+import e7epd
+from e7epd.importer import ImportProfile, parse_value, _RowConverter
+
+
+@pytest.mark.parametrize('text, input_type, unit, expected', [
+    ('', float, '', None),
+    ('   ', str, '', None),
+    (' 0603 ', str, '', '0603'),
+    ('4k7', float, 'Ω', 4.7e3),
+    ('10 kΩ', float, 'Ω', 10e3),
+    ('100nF', float, 'F', 100e-9),
+    ('1.5k', int, '', 1500),
+    ('12', int, '', 12),
+    ('1e3', int, '', 1000),
+])
+def test_parse_value(text, input_type, unit, expected):
+    v = parse_value(text, input_type, unit)
+    assert v == expected
+    assert type(v) is type(expected)
+
+
+@pytest.mark.parametrize('text, input_type, unit', [
+    ('2.7', int, ''),
+    ('1.5', int, ''),
+    ('many', int, ''),
+    ('10F', float, 'Ω'),
+    ('4k7x', float, ''),
+])
+def test_parse_value_invalid(text, input_type, unit):
+    with pytest.raises(e7epd.InputException):
+        parse_value(text, input_type, unit)
+
+
+profile = ImportProfile(
+    columns={'Part #': 'ipn', 'Qty': 'stock', 'Footprint': 'package', 'Kind': 'type', 'Notes': None},
+    type_columns={'resistor': {'Value': 'resistance'}, 'capacitor': {'Value': 'capacitance'}},
+    types={'Res': 'resistor'},
+)
+header = ['Part #', 'Kind', 'Qty', 'Value', 'Footprint', 'Notes']
+
+
+def test_convert():
+    converter = _RowConverter(profile, header, None)
+    part_class, part = converter.convert(['R1', 'Res', '1.5k', '4k7', ' 0603', 'ignored'])
+    assert part_class is e7epd.spec.Resistor
+    assert part == {'ipn': 'R1', 'stock': 1500, 'resistance': 4.7e3, 'package': '0603'}
+    assert converter.get_ipn(['R2', 'Res', '', '', '', '']) == 'R2'
+    # Empty cells are left out
+    assert converter.convert(['R2', 'Res', '', '1', '', ''])[1] == {'ipn': 'R2', 'resistance': 1.0}
+
+
+def test_convert_resolve_type():
+    asked = []
+
+    def resolve_type(text):
+        asked.append(text)
+        return e7epd.spec.Capacitor if text == 'Cap' else None
+
+    converter = _RowConverter(ImportProfile(**{**vars(profile), 'types': {}}), header, resolve_type)
+    part_class, part = converter.convert(['C1', 'Cap', '1', '100n', '0402', ''])
+    assert part_class is e7epd.spec.Capacitor
+    assert part['capacitance'] == 100e-9
+    converter.convert(['C2', 'Cap', '1', '1u', '0402', ''])
+    for _ in range(2):
+        with pytest.raises(e7epd.InputException, match="Unknown part type Thing"):
+            converter.convert(['X1', 'Thing', '1', '1', '', ''])
+    # Each part type text is only asked once, and remembered in the profile
+    assert asked == ['Cap', 'Thing']
+    assert converter.profile.types == {'Cap': 'capacitor'}
+
+
+def test_convert_default_type():
+    converter = _RowConverter(ImportProfile(columns={'IPN': 'ipn', 'resistance': 'resistance'},
+                                            default_type='resistor'), ['IPN', 'resistance'], None)
+    assert converter.convert(['R1', '1M']) == (e7epd.spec.Resistor, {'ipn': 'R1', 'resistance': 1e6})
+
+
+def test_convert_errors():
+    converter = _RowConverter(profile, header, None)
+    with pytest.raises(e7epd.InputException, match="The row has 2 columns"):
+        converter.convert(['R1', 'Res'])
+    with pytest.raises(e7epd.InputException, match="Unknown part type Cap"):
+        converter.convert(['C1', 'Cap', '1', '1', '', ''])
+    with pytest.raises(e7epd.InputException, match="2.5 is not a whole number, for stock in column Qty"):
+        converter.convert(['R1', 'Res', '2.5', '1', '', ''])
+
+
+def test_convert_bad_profile():
+    bad = ImportProfile(columns={'Part #': 'ipn', 'Kind': 'type'}, type_columns={'resistor': {'Value': 'voltage'}},
+                        types={'Res': 'resistor'})
+    with pytest.raises(e7epd.InputException, match="not part of the Resistor spec"):
+        _RowConverter(bad, header, None).convert(['R1', 'Res', '1', '1', '', ''])
+    missing = ImportProfile(columns={'Part #': 'ipn', 'Kind': 'type', 'Tolerance': 'tolerance'},
+                            types={'Res': 'resistor'})
+    with pytest.raises(e7epd.InputException, match="column Tolerance is not in the file"):
+        _RowConverter(missing, header, None).convert(['R1', 'Res', '1', '1', '', ''])
+
+
+def test_profile_save_load(tmp_path):
+    path = str(tmp_path / 'profile.json')
+    profile.save(path)
+    assert ImportProfile.load(path) == profile
+    (tmp_path / 'bad.json').write_text('[1, 2]')
+    with pytest.raises(e7epd.InputException):
+        ImportProfile.load(str(tmp_path / 'bad.json'))
@@ -0,0 +1,27 @@
+""" Tests for finding parts with similar part numbers """
+import pytest
+
+from e7epd.lookup import PartNumberIndex, normalize_part_number
+
+
+@pytest.fixture
+def index() -> PartNumberIndex:
+    return PartNumberIndex([{'ipn': 'R1', 'mfg_part_numb': 'RC0603FR-071KL'},
+                            {'ipn': 'U1', 'mfg_part_numb': 'LM358DR/NOPB'},
+                            {'ipn': 'X1', 'mfg_part_numb': None},
+                            {'ipn': 'X2', 'mfg_part_numb': '--'}])
+
+
+def test_normalize():
+    assert normalize_part_number(' lm358dr-tr/nopb ') == 'LM358DR'
+    assert normalize_part_number('-TR') == 'TR'
+
+
+def test_find(index):
+    assert [(p.ipn, p.similarity) for p in index.find('rc0603fr-071kl-tr')] == [('R1', 1.0)]
+    assert index.find('LM358DR', min_similarity=0.9)[0].mfg_part_numb == 'LM358DR/NOPB'
+
+
+@pytest.mark.parametrize('pn', [None, '', '  ', '-/-'])
+def test_find_nothing(index, pn):
+    assert index.find(pn) == []
@@ -0,0 +1,82 @@
+""" Tests for compiling part filters into database queries """
+import pytest
+
+import e7epd
+from e7epd import SpecWithOperator, ComparisonOperators
+from e7epd.e7epd import case_insensitive_collation
+
+
+def test_type_only():
+    q = e7epd.compile_query(e7epd.spec.Resistor)
+    assert q.filter == {'type': 'resistor'}
+    assert q.collation is None
+
+
+def test_no_type():
+    q = e7epd.compile_query(None, [SpecWithOperator('stock', 0, ComparisonOperators.greater)])
+    assert q.filter == {'stock': {'$gt': 0}}
+
+
+def test_no_type_only_base_keys():
+    with pytest.raises(e7epd.InputException):
+        e7epd.compile_query(None, [SpecWithOperator('resistance', 1.0)])
+
+
+def test_unknown_key():
+    with pytest.raises(e7epd.InputException):
+        e7epd.compile_query(e7epd.spec.Resistor, [SpecWithOperator('capacitance', 1.0)])
+
+
+def test_string_equal():
+    q = e7epd.compile_query(e7epd.spec.Resistor, [SpecWithOperator('package', '0603')])
+    # An exact match, made case-insensitive by the collation instead of a regex
+    assert q.filter == {'type': 'resistor', 'package': {'$eq': '0603'}}
+    assert q.collation == case_insensitive_collation
+
+
+def test_string_starts_with():
+    q = e7epd.compile_query(e7epd.spec.Resistor, [SpecWithOperator('ipn', 'R-', ComparisonOperators.starts_with)])
+    assert q.filter == {'type': 'resistor', 'ipn': {'$gte': 'R-', '$lt': 'R-\uffff'}}
+    assert q.collation == case_insensitive_collation
+
+
+def test_string_contains():
+    q = e7epd.compile_query(e7epd.spec.Resistor, [SpecWithOperator('comments', '1.5 (x)',
+                                                                   ComparisonOperators.contains)])
+    # The value is escaped, so it's never taken as a regex
+    assert q.filter == {'type': 'resistor', 'comments': {'$regex': r'1\.5\ \(x\)', '$options': 'i'}}
+    assert q.collation is None
+
+
+@pytest.mark.parametrize('operator', [ComparisonOperators.less, ComparisonOperators.greater_equal])
+def test_string_with_numerical_operator(operator):
+    with pytest.raises(e7epd.InputException):
+        e7epd.compile_query(e7epd.spec.Resistor, [SpecWithOperator('package', '0603', operator)])
+
+
+@pytest.mark.parametrize('operator', [ComparisonOperators.starts_with, ComparisonOperators.contains])
+def test_number_with_string_operator(operator):
+    with pytest.raises(e7epd.InputException):
+        e7epd.compile_query(e7epd.spec.Resistor, [SpecWithOperator('resistance', 1.0, operator)])
+
+
+def test_number_range():
+    q = e7epd.compile_query(e7epd.spec.Resistor, [
+        SpecWithOperator('resistance', 1e3, ComparisonOperators.greater_equal),
+        SpecWithOperator('resistance', 10e3, ComparisonOperators.less_equal),
+        SpecWithOperator('power', 0.25),
+    ])
+    assert q.filter == {'type': 'resistor', 'resistance': {'$gte': 1e3, '$lte': 10e3}, 'power': {'$eq': 0.25}}
+    assert q.collation is None
+
+
+@pytest.mark.parametrize('filters', [
+    [SpecWithOperator('resistance', 1.0, ComparisonOperators.less),
+     SpecWithOperator('resistance', 2.0, ComparisonOperators.less)],
+    [SpecWithOperator('package', '0603'), SpecWithOperator('package', '0805')],
+    [SpecWithOperator('stock', 1), SpecWithOperator('stock', 'many')],
+    [SpecWithOperator('stock', 'many'), SpecWithOperator('stock', 1)],
+])
+def test_conflicting_filters(filters):
+    with pytest.raises(e7epd.InputException, match="conflicting"):
+        e7epd.compile_query(e7epd.spec.Resistor, filters)
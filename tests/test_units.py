@@ -0,0 +1,78 @@
+""" Tests for parsing and formatting numbers in engineering notation """
+import random
+
+import pytest
+from engineering_notation import EngNumber
+
+from e7epd import units
+
+
+@pytest.mark.parametrize('text, unit, expected', [
+    ('4.7k', None, 4.7e3),
+    ('4k7', None, 4.7e3),
+    ('4R7', None, 4.7),
+    ('100nF', 'F', 100e-9),
+    ('10 kΩ', 'Ω', 10e3),
+    ('10kohms', 'Ω', 10e3),
+    ('10 OHM', 'Ω', 10.0),
+    ('2.2uH', None, 2.2e-6),
+    ('2.2µ', None, 2.2e-6),
+    ('16MHz', None, 16e6),
+    ('1m', '', 1e-3),
+    ('1M', '', 1e6),
+    ('1f', None, 1e-15),
+    ('-1.5e3', None, -1.5e3),
+    ('.5', None, 0.5),
+    ('  12  ', '', 12.0),
+])
+def test_parse(text, unit, expected):
+    assert units.parse(text, unit) == expected
+
+
+@pytest.mark.parametrize('text, unit', [
+    ('', None),
+    ('k', None),
+    ('.', None),
+    ('1.5k7', None),
+    ('1e3k7', None),
+    ('10F', 'Ω'),
+    ('10Ω', ''),
+    ('4.7 k x', None),
+    ('1kk', None),
+])
+def test_parse_invalid(text, unit):
+    with pytest.raises(ValueError):
+        units.parse(text, unit)
+
+
+def test_parse_many():
+    assert units.parse_many(['1k', '2k2', '3.3k'], 'Ω') == [1e3, 2.2e3, 3.3e3]
+    with pytest.raises(ValueError):
+        units.parse_many(['1k', 'one'], 'Ω')
+
+
+@pytest.mark.parametrize('value, precision, expected', [
+    (4700, 2, '4.70k'),
+    (1000, 2, '1k'),
+    (100e-9, 2, '100n'),
+    (0, 2, '0'),
+    (-2.2e-6, 2, '-2.20u'),
+    (999.995, 2, '1000'),
+    (4.7e3, 0, '5k'),
+    (1e30, 2, '1Q'),
+])
+def test_format_eng(value, precision, expected):
+    assert units.format_eng(value, precision) == expected
+
+
+def test_format_matches_engnumber():
+    rng = random.Random(707)
+    values = [0, 1, 999, 1000, 0.5, 2.5, 0.125, 1e-12, 123456789, 2 ** 60]
+    values += [round(rng.uniform(1, 1000), rng.randint(0, 6)) * 10 ** rng.randint(-15, 12) for _ in range(2000)]
+    values += [-v for v in values]
+    for v in values:
+        assert units.format_eng(v) == str(EngNumber(v)), v
+
+
+def test_format_many():
+    assert units.format_many([1000, None, 4.7e-6]) == ['1k', None, '4.70u']
@@ -0,0 +1,72 @@
+""" Tests for validating parts and PCBs against their spec """
+import pytest
+
+import e7epd
+from e7epd import SpecValidator
+
+valid_resistor = {'ipn': 'R1', 'stock': 10, 'package': '0603', 'resistance': 1e3}
+
+
+@pytest.fixture
+def validator() -> SpecValidator:
+    return SpecValidator.for_part(e7epd.spec.Resistor)
+
+
+def test_shared_validators():
+    assert SpecValidator.for_part(e7epd.spec.Resistor) is SpecValidator.for_part(e7epd.spec.Resistor)
+    assert SpecValidator.for_part(e7epd.spec.Resistor) is not SpecValidator.for_part(e7epd.spec.Capacitor)
+    assert SpecValidator.for_pcb() is SpecValidator.for_pcb()
+    assert SpecValidator.for_pcb().items is e7epd.spec.PCBItems
+
+
+def test_valid(validator):
+    assert validator.get_errors(valid_resistor) == []
+    # None is allowed for any key, even required ones
+    assert validator.get_errors({**valid_resistor, 'tolerance': None, 'stock': None}) == []
+    validator.validate(valid_resistor)
+
+
+def test_unknown_key(validator):
+    assert validator.get_errors({**valid_resistor, 'capacitance': 1.0}) == \
+           ["Given key of capacitance is not part of the spec"]
+
+
+def test_wrong_type(validator):
+    assert validator.get_errors({**valid_resistor, 'stock': '10'}) == \
+           ["Input value of 10 for stock is not of type <class 'int'>"]
+
+
+def test_missing_required(validator):
+    doc = dict(valid_resistor)
+    del doc['package']
+    del doc['stock']
+    # Reported in the spec's order
+    assert validator.get_errors(doc) == ["Required key of stock is not found in the new part dict",
+                                         "Required key of package is not found in the new part dict"]
+
+
+def test_every_error(validator):
+    errors = validator.get_errors({'ipn': 5, 'stock': 1, 'resistance': 1.0, 'foo': 'bar'})
+    assert errors == ["Input value of 5 for ipn is not of type <class 'str'>",
+                      "Given key of foo is not part of the spec",
+                      "Required key of package is not found in the new part dict"]
+    with pytest.raises(e7epd.InputException) as e:
+        validator.validate({'ipn': 5, 'stock': 1, 'resistance': 1.0, 'foo': 'bar'})
+    assert str(e.value) == errors[0]
+
+
+def test_update(validator):
+    # New values only need to be convertible to the key's type, and don't need the required keys
+    assert validator.get_update_errors({'stock': '10', 'resistance': 1}) == []
+    validator.validate_update({'comments': 'new'})
+    assert validator.get_update_errors({'stock': 'many', 'foo': 1}) == \
+           ["Input value of many for stock is not of type <class 'int'>", "Given key of foo is not part of the spec"]
+    with pytest.raises(e7epd.InputException):
+        validator.validate_update({'resistance': None})
+
+
+def test_validate_many(validator):
+    errors = validator.validate_many([valid_resistor, {**valid_resistor, 'ipn': 'R2', 'stock': 'x'},
+                                      {'ipn': 'R3', 'foo': 1}])
+    assert [(e.index, e.ipn) for e in errors] == [(1, 'R2'), (2, 'R3'), (2, 'R3'), (2, 'R3'), (2, 'R3')]
+    assert errors[1].message == "Given key of foo is not part of the spec"